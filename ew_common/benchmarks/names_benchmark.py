@@ -0,0 +1,100 @@
+# Benchmark of name normalization over a donor-like name corpus: uncached
+# HumanName parsing against the cached normalize_name/extract_name and
+# normalize_names_batch.
+#
+#   python benchmarks/names_benchmark.py [--names 100000]
+
+import argparse
+import random
+import time
+
+from ew_common.input_validation import (
+    _extract_name,
+    extract_name,
+    normalize_name,
+    normalize_names_batch,
+)
+
+# fmt: off
+FIRST_NAMES = [
+    "james", "mary", "john", "patricia", "robert", "jennifer", "michael",
+    "linda", "william", "elizabeth", "david", "barbara", "richard", "susan",
+    "joseph", "jessica", "thomas", "sarah", "charles", "karen", "christopher",
+    "nancy", "daniel", "lisa", "matthew", "margaret", "anthony", "betty",
+    "mark", "sandra", "donald", "ashley", "steven", "dorothy", "paul",
+    "kimberly", "andrew", "emily", "joshua", "donna", "kenneth", "michelle",
+    "kevin", "carol", "brian", "amanda", "george", "melissa", "edward",
+    "deborah", "maría", "josé", "jo ann", "mary beth", "d'andre", "ellen",
+]
+LAST_NAMES = [
+    "smith", "johnson", "williams", "brown", "jones", "garcia", "miller",
+    "davis", "rodriguez", "martinez", "hernandez", "lopez", "gonzalez",
+    "wilson", "anderson", "thomas", "taylor", "moore", "jackson", "martin",
+    "lee", "perez", "thompson", "white", "harris", "sanchez", "clark",
+    "ramirez", "lewis", "robinson", "walker", "young", "allen", "king",
+    "wright", "scott", "torres", "nguyen", "hill", "flores", "green",
+    "mcdonald", "o'brien", "macdonald", "katz-brown", "van der berg",
+    "de la cruz", "st. john", "o'connor", "mcallister",
+]
+# fmt: on
+
+
+def donor_names(n, seed=0):
+    """(first, last) pairs, Zipf-ish and in the mix of cases donors type."""
+    rng = random.Random(seed)
+    first_weights = [1 / (i + 1) for i in range(len(FIRST_NAMES))]
+    last_weights = [1 / (i + 1) for i in range(len(LAST_NAMES))]
+    names = []
+    for first, last in zip(
+        rng.choices(FIRST_NAMES, first_weights, k=n),
+        rng.choices(LAST_NAMES, last_weights, k=n),
+    ):
+        case = rng.random()
+        if case < 0.15:
+            first, last = first.upper(), last.upper()
+        elif case < 0.85:
+            first, last = first.title(), last.title()
+        names.append((first, last))
+    return names
+
+
+def timed(f):
+    started = time.perf_counter()
+    result = f()
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--names", type=int, default=100000)
+    args = parser.parse_args()
+
+    names = donor_names(args.names)
+    full_names = [f"{first} {last}" for first, last in names]
+    print(f"{len(names)} names, {len(set(names))} distinct")
+
+    uncached_normalize = normalize_name.__wrapped__
+    uncached_extract = _extract_name.__wrapped__
+
+    normalize_name.cache_clear()
+    _extract_name.cache_clear()
+    results = [
+        ("normalize_name, uncached", lambda: [uncached_normalize(*n) for n in names]),
+        ("normalize_name, cached", lambda: [normalize_name(*n) for n in names]),
+        ("normalize_names_batch", lambda: normalize_names_batch(names)),
+        ("extract_name, uncached", lambda: [uncached_extract(n) for n in full_names]),
+        ("extract_name, cached", lambda: [extract_name(n) for n in full_names]),
+    ]
+
+    outputs = {}
+    for label, f in results:
+        seconds, outputs[label] = timed(f)
+        print(f"{label}: {seconds:.3f}s ({seconds / len(names) * 1e6:.1f}us per name)")
+
+    assert outputs["normalize_name, uncached"] == outputs["normalize_name, cached"]
+    assert outputs["normalize_name, uncached"] == outputs["normalize_names_batch"]
+    assert outputs["extract_name, uncached"] == outputs["extract_name, cached"]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# Benchmark of phone number extraction: PhoneNumberMatcher on every value
+# (what extract_phone_number always did) against the canonical-number fast
+# path, and against ew_common.dataframes.phone_numbers on a Series.
+#
+#   python benchmarks/phone_numbers_benchmark.py [--phones 1000000]
+
+import argparse
+import random
+import time
+
+import pandas as pd
+import phonenumbers
+
+from ew_common.dataframes import phone_numbers
+from ew_common.input_validation import extract_phone_number
+
+
+def matcher_only(t):
+    matcher = phonenumbers.PhoneNumberMatcher(t, "US")
+    if matcher.has_next():
+        return phonenumbers.format_number(
+            matcher.next().number, phonenumbers.PhoneNumberFormat.E164
+        ).replace("+", "")
+
+
+def valid_number(rng):
+    while True:
+        number = f"{rng.randint(200, 999)}{rng.randint(2000000, 9999999)}"
+        phone_number = phonenumbers.PhoneNumber(
+            country_code=1, national_number=int(number)
+        )
+        if phonenumbers.is_valid_number_for_region(phone_number, "US"):
+            return number
+
+
+def sample_phones(n, seed=0):
+    """Mostly clean valid numbers, as from ActBlue and Mobile Commons, with
+    repeats (donors give more than once) and some free text."""
+    rng = random.Random(seed)
+    distinct = [valid_number(rng) for _ in range(n // 3)]
+    phones = []
+    for _ in range(n):
+        number = rng.choice(distinct)
+        kind = rng.random()
+        if kind < 0.5:
+            phones.append(number)
+        elif kind < 0.9:
+            phones.append("1" + number)
+        elif kind < 0.95:
+            phones.append("+1" + number)
+        else:
+            phones.append(f"call me at ({number[:3]}) {number[3:6]}-{number[6:]}")
+    return phones
+
+
+def timed(f):
+    started = time.perf_counter()
+    result = f()
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--phones", type=int, default=1000000)
+    parser.add_argument(
+        "--matcher-sample",
+        type=int,
+        default=20000,
+        help="how many phones to time PhoneNumberMatcher on; it's slow",
+    )
+    args = parser.parse_args()
+
+    phones = sample_phones(args.phones)
+    sample = phones[: args.matcher_sample]
+
+    matcher_seconds, expected = timed(lambda: [matcher_only(t) for t in sample])
+    fast_seconds, actual = timed(lambda: [extract_phone_number(t) for t in sample])
+    assert actual == expected, "Fast path differs from PhoneNumberMatcher"
+    for label, seconds in [
+        ("PhoneNumberMatcher", matcher_seconds),
+        ("extract_phone_number", fast_seconds),
+    ]:
+        print(f"{label}: {seconds / len(sample) * 1e6:.1f}us per phone")
+
+    series = pd.Series(phones)
+    series_seconds, result = timed(lambda: phone_numbers(series))
+    assert result[: len(sample)].tolist() == expected
+    print(
+        f"phone_numbers on {len(phones)} phones: {series_seconds:.2f}s"
+        f" ({series_seconds / len(phones) * 1e6:.2f}us per phone)"
+    )
+
+
+if __name__ == "__main__":
+    main()
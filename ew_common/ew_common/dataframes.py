@@ -0,0 +1,108 @@
+# ew_common.dataframes
+#
+# Column-wise cleaning of DataFrames read from Civis. Pipelines that upload
+# rows one at a time can clean the whole DataFrame with these up front,
+# instead of calling pd.isnull, str, int etc. on every field of every row.
+#
+# Apps using this module need pandas, and the dependencies of
+# ew_common.input_validation.
+
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+from ew_common.input_validation import (
+    CANONICAL_US_PHONE_NUMBER_RE,
+    extract_phone_number,
+    us_phone_number_e164,
+)
+
+YES_VALUES = (1, "1", "Yes")
+NO_VALUES = (0, "0", "No")
+
+
+def nulls_to_none(series, blank_strings=False):
+    """Returns series as objects, with nulls (None, NaN, NaT) as None.
+
+    With blank_strings, empty strings become None as well.
+    """
+    missing = series.isna()
+    if blank_strings:
+        missing |= series.astype(object).eq("")
+    return series.astype(object).where(~missing, None)
+
+
+def non_blank_strings(series):
+    """str() of each value, or None for nulls and other falsy values.
+
+    The column equivalent of `str(v) if v and not pd.isnull(v) else None`.
+    """
+    values = series.astype(object)
+    present = series.notna() & values.astype(bool)
+    return values.astype(str).astype(object).where(present, None)
+
+
+def postal_codes(series):
+    """Postal codes as strings, with '' for nulls.
+
+    Pandas sometimes reads e.g. 02145 as the number 2145, or even 2145.0;
+    numbers are zero-padded back to five digits. Strings are left alone.
+    """
+    values = series.astype(object)
+    if is_numeric_dtype(series):
+        is_str = pd.Series(False, index=series.index)
+    else:
+        is_str = values.map(type).eq(str)
+    # Anything else that isn't a number ends up as ''.
+    numbers = pd.to_numeric(values.where(~is_str), errors="coerce")
+    present = numbers.notna().to_numpy()
+
+    result = values.where(is_str, "")
+    # Formatting a list is several times faster than .astype(str).str.zfill.
+    result[present] = [
+        "%05d" % number for number in numbers[present].astype("int64").tolist()
+    ]
+    return result
+
+
+def rounded_ints(series):
+    """Numbers rounded to Python ints (half to even, like round()), or None."""
+    present = series.notna().to_numpy()
+    result = pd.Series([None] * len(series), index=series.index, dtype=object)
+    result[present] = (
+        series[present].astype(float).round().astype("int64").astype(object)
+    ).to_numpy()
+    return result
+
+
+def yes_no(series):
+    """Maps 1/'1'/'Yes' to 'Yes' and 0/'0'/'No' to 'No'; leaves others be."""
+    result = series.astype(object)
+    result = result.mask(series.isin(YES_VALUES), "Yes")
+    result = result.mask(series.isin(NO_VALUES), "No")
+    return result
+
+
+def phone_numbers(series):
+    """extract_phone_number of each value, or None for nulls.
+
+    Each distinct value is only parsed once, and values that are already
+    just a US number (see CANONICAL_US_PHONE_NUMBER_RE) skip
+    PhoneNumberMatcher, so this is quick even for millions of rows.
+    """
+    values = series[series.notna()].astype(str).str.strip()
+    national_numbers = values.str.extract(
+        f"^{CANONICAL_US_PHONE_NUMBER_RE.pattern}$", expand=False
+    )
+    is_canonical = national_numbers.notna()
+
+    extracted = {}
+    for national_number in national_numbers[is_canonical].unique():
+        e164 = us_phone_number_e164(national_number)
+        extracted[national_number] = e164.replace("+", "") if e164 else None
+    for value in values[~is_canonical].unique():
+        extracted[value] = extract_phone_number(value)
+
+    keys = national_numbers.where(is_canonical, values)
+    result = pd.Series([None] * len(series), index=series.index, dtype=object)
+    result[series.notna().to_numpy()] = [extracted[key] for key in keys]
+    return result
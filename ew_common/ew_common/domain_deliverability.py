@@ -0,0 +1,137 @@
+# ew_common.domain_deliverability
+#
+# Caches whether email domains can receive mail, so that jobs validating
+# lots of email addresses (e.g. the BSD cons upload) don't repeat the same
+# DNS lookups for every domain on every run.
+
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable
+
+# Deliverable domains rarely stop being deliverable, but a domain that
+# failed may just have had a DNS hiccup, so we retry those much sooner.
+DEFAULT_TTL_SECONDS = 30 * 24 * 60 * 60
+DEFAULT_NEGATIVE_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_CONCURRENCY = 16
+
+COMMIT_EVERY = 1000
+
+
+def email_validator_resolver(domain: str) -> bool:
+    """Checks domain the way email_validator's check_deliverability does.
+
+    That is, the domain needs an MX record, or failing that an A or AAAA
+    record. Callers using this resolver need email_validator installed.
+    """
+    from email_validator import EmailNotValidError, validate_email
+
+    try:
+        validate_email(f"postmaster@{domain}", check_deliverability=True)
+    except EmailNotValidError:
+        return False
+    return True
+
+
+class DomainDeliverabilityCache:
+    """SQLite-backed cache of per-domain deliverability verdicts.
+
+    Several jobs can share one database file. resolver is called with a
+    domain and returns whether it can receive mail; tests can pass a stub
+    instead of doing DNS lookups. Exceptions from resolver propagate and
+    nothing is cached for that domain.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        resolver: Callable[[str], bool] = email_validator_resolver,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        negative_ttl_seconds: float = DEFAULT_NEGATIVE_TTL_SECONDS,
+        concurrency: int = DEFAULT_CONCURRENCY,
+    ):
+        self.resolver = resolver
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.concurrency = concurrency
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS domain_deliverability ("
+            " domain TEXT PRIMARY KEY,"
+            " deliverable INTEGER NOT NULL,"
+            " checked_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+        # Jobs look up many domains, so load them all up front.
+        self.verdicts = {
+            domain: (bool(deliverable), checked_at)
+            for domain, deliverable, checked_at in self.conn.execute(
+                "SELECT domain, deliverable, checked_at FROM domain_deliverability"
+            )
+        }
+        self.uncommitted = 0
+
+    def cached(self, domain: str):
+        """Returns the unexpired verdict for domain, or None."""
+        verdict = self.verdicts.get(domain.lower())
+        if not verdict:
+            return None
+        deliverable, checked_at = verdict
+        ttl_seconds = self.ttl_seconds if deliverable else self.negative_ttl_seconds
+        if time.time() - checked_at > ttl_seconds:
+            return None
+        return deliverable
+
+    def is_deliverable(self, domain: str) -> bool:
+        deliverable = self.cached(domain)
+        if deliverable is None:
+            deliverable = self.resolver(domain.lower())
+            self.store(domain, deliverable)
+        return deliverable
+
+    def resolve_all(self, domains: Iterable[str]) -> Dict[str, bool]:
+        """Returns verdicts for all of domains (lowercased).
+
+        Domains without an unexpired verdict are resolved concurrently.
+        """
+        verdicts = {}
+        to_resolve = set()
+        for domain in domains:
+            domain = domain.lower()
+            deliverable = self.cached(domain)
+            if deliverable is None:
+                to_resolve.add(domain)
+            else:
+                verdicts[domain] = deliverable
+
+        if to_resolve:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                to_resolve = sorted(to_resolve)
+                for domain, deliverable in zip(
+                    to_resolve, executor.map(self.resolver, to_resolve)
+                ):
+                    self.store(domain, deliverable)
+                    verdicts[domain] = deliverable
+
+        return verdicts
+
+    def store(self, domain: str, deliverable: bool):
+        domain = domain.lower()
+        checked_at = time.time()
+        self.verdicts[domain] = (deliverable, checked_at)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO domain_deliverability"
+            " (domain, deliverable, checked_at) VALUES (?, ?, ?)",
+            (domain, int(deliverable), checked_at),
+        )
+        self.uncommitted += 1
+        if self.uncommitted >= COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
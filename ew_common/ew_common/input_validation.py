@@ -1,10 +1,21 @@
 import re
+from functools import lru_cache
+from typing import Iterable, List, Tuple
 
 import phonenumbers
 from nameparser import HumanName
 
 POSTAL_CODE_RE = re.compile(r"[0-9]{5}")
 
+# US phone numbers the way ActBlue and Mobile Commons send them: 10 digits,
+# optionally preceded by 1 or +1.
+CANONICAL_US_PHONE_NUMBER_RE = re.compile(r"(?:\+1|1)?([2-9][0-9]{9})")
+PHONE_NUMBER_CACHE_SIZE = 50000
+
+# Parsing names with HumanName is slow, and the same names come up over and
+# over, so we cache this many parsed names.
+NAME_CACHE_SIZE = 50000
+
 STATE_TO_ABBREV = {
     "alabama": "AL",
     "alaska": "AK",
@@ -70,6 +81,13 @@ def extract_phone_number(t):
 
 
 def extract_phone_number_e164(t):
+    # Running PhoneNumberMatcher over the text is slow, so we skip it when t
+    # is just a phone number, which is most of the time. The result is the
+    # same either way.
+    canonical = CANONICAL_US_PHONE_NUMBER_RE.fullmatch(t.strip())
+    if canonical:
+        return us_phone_number_e164(canonical.group(1))
+
     matcher = phonenumbers.PhoneNumberMatcher(t, "US")
     if matcher.has_next():
         return phonenumbers.format_number(
@@ -77,6 +95,25 @@ def extract_phone_number_e164(t):
         )
 
 
+@lru_cache(maxsize=PHONE_NUMBER_CACHE_SIZE)
+def us_phone_number_e164(national_number):
+    """E.164 for a 10 digit NANP number, or None if it isn't a valid number.
+
+    national_number is the number's digits as a string, e.g. the group
+    matched by CANONICAL_US_PHONE_NUMBER_RE.
+    """
+    number = phonenumbers.PhoneNumber(
+        country_code=1, national_number=int(national_number)
+    )
+    # Checking against US numbers first is much quicker than is_valid_number,
+    # which has to work out which NANP country the number belongs to. (It
+    # tries the US first, so the answer is the same.)
+    if phonenumbers.is_valid_number_for_region(number, "US"):
+        return "+1" + national_number
+    if phonenumbers.is_valid_number(number):
+        return "+1" + national_number
+
+
 def extract_postal_code(t):
     match = POSTAL_CODE_RE.search(t)
     if match:
@@ -84,7 +121,11 @@ def extract_postal_code(t):
 
 
 def extract_name(full_name):
-    full_name = full_name.strip()
+    return _extract_name(full_name.strip())
+
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def _extract_name(full_name):
     name = HumanName(full_name)
     name.capitalize()
     first_name = " ".join(list(filter(None, [name.title, name.first])))
@@ -116,6 +157,7 @@ def extract_city_state(t):
     return city, state
 
 
+@lru_cache(maxsize=NAME_CACHE_SIZE)
 def normalize_name(first_name, last_name):
     """Normalizes capitalization of first and last name."""
     name = HumanName()
@@ -123,3 +165,17 @@ def normalize_name(first_name, last_name):
     name.last = last_name
     name.capitalize()
     return (name.first, name.last)
+
+
+def normalize_names_batch(names: Iterable[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """normalize_name for each (first_name, last_name) in names.
+
+    Each distinct name is normalized only once, however often it repeats.
+    """
+    normalized = {}
+    results = []
+    for name in names:
+        if name not in normalized:
+            normalized[name] = normalize_name(*name)
+        results.append(normalized[name])
+    return results
@@ -1,4 +1,5 @@
 import logging
+import threading
 import time
 from collections import OrderedDict
 from dataclasses import dataclass, field
@@ -8,12 +9,30 @@ from typing import Dict, List, Set
 import requests
 import xmltodict
 from dateutil import parser as date_parser
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from ew_common.utils import nested_get
 
 MOBILE_COMMONS_API_BASE = "https://secure.mcommons.com/api/"
 MOBILE_COMMONS_SIGNUP_URL = "https://secure.mcommons.com/profiles/join"
 
+# Every call to Mobile Commons goes through one process-wide session (see
+# get_session), so repeated calls from a warm Lambda reuse keep-alive
+# connections instead of paying a TLS handshake each time.
+POOL_MAXSIZE = 10
+# (connect, read) timeouts in seconds.
+DEFAULT_TIMEOUT = (3.05, 15)
+RETRIES = 3
+RETRY_BACKOFF_FACTOR = 0.5
+# Only statuses that mean the request was not processed, since most of the
+# API (e.g. send_message) isn't idempotent. For the same reason read
+# timeouts are never retried, only failures to connect.
+RETRY_STATUSES = (429, 503)
+
+_session = None
+_session_lock = threading.Lock()
+
 
 @dataclass
 class Message:
@@ -88,11 +107,58 @@ class MobileCommonsAPIException(Exception):
     pass
 
 
-def post_to_mobile_commons(username, password, api_method, payload, session=None):
-    poster = session if session else requests
+def new_session(
+    pool_maxsize=POOL_MAXSIZE, retries=RETRIES, backoff_factor=RETRY_BACKOFF_FACTOR
+):
+    """Returns a requests session with a bounded keep-alive pool and retries."""
+    retry_kwargs = dict(
+        total=retries,
+        connect=retries,
+        read=0,
+        status=retries,
+        status_forcelist=RETRY_STATUSES,
+        backoff_factor=backoff_factor,
+        raise_on_status=False,
+    )
+    methods = frozenset(["GET", "POST"])
+    try:
+        retry = Retry(allowed_methods=methods, **retry_kwargs)
+    except TypeError:
+        # urllib3 < 1.26
+        retry = Retry(method_whitelist=methods, **retry_kwargs)
+
+    adapter = HTTPAdapter(
+        pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session():
+    """Returns the session shared by all Mobile Commons calls in this process.
+
+    It's safe to use from several threads at once; at most POOL_MAXSIZE
+    connections are kept open.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = new_session()
+    return _session
+
+
+def post_to_mobile_commons(
+    username, password, api_method, payload, session=None, timeout=DEFAULT_TIMEOUT
+):
+    poster = session if session else get_session()
     try:
         url = MOBILE_COMMONS_API_BASE + api_method
-        resp = poster.post(url, auth=(username, password), json=payload)
+        resp = poster.post(
+            url, auth=(username, password), json=payload, timeout=timeout
+        )
         # logging.info(f"Response from MC {api_method}: {resp.text[0:400]}")
         return resp
     except RuntimeError:
@@ -136,9 +202,11 @@ def get_profile(username, password, phone_number, include_messages=False, sessio
 
 
 # TODO: use get_profile
-def profile_exists(username, password, phone_number):
+def profile_exists(username, password, phone_number, session=None):
     payload = {"phone_number": phone_number}
-    response = post_to_mobile_commons(username, password, "profile", payload)
+    response = post_to_mobile_commons(
+        username, password, "profile", payload, session=session
+    )
     try:
         d = xmltodict.parse(response.text, attr_prefix="", cdata_key="value")
         return (
@@ -170,7 +238,9 @@ def create_or_update_mobile_commons_profile_via_web(
     }
     for k, v in profile_payload.items():
         form_data[f"person[{k}]"] = v
-    return requests.post(MOBILE_COMMONS_SIGNUP_URL, data=form_data)
+    return get_session().post(
+        MOBILE_COMMONS_SIGNUP_URL, data=form_data, timeout=DEFAULT_TIMEOUT
+    )
 
 
 def get_all_received_messages(
@@ -190,50 +260,52 @@ def get_all_received_messages(
     params = {"limit": limit_per_page, "start_time": start_str, "end_time": end_str}
     url = MOBILE_COMMONS_API_BASE + "messages"
     fails = 0
-    with requests.session() as session:
-        while True:
-            if end_page and page >= end_page:
+    session = get_session()
+    while True:
+        if end_page and page >= end_page:
+            break
+        time.sleep(fails * retry_wait)
+
+        params["page"] = page
+        logging.debug(f"Requesting {url} with params {params}")
+
+        try:
+            resp = session.get(
+                url, params=params, auth=(username, password), timeout=DEFAULT_TIMEOUT
+            )
+
+            data = xmltodict.parse(resp.text, attr_prefix="", cdata_key="value")
+
+            error_code = nested_get(data, "response", "error", "id")
+            if error_code:
+                raise MobileCommonsAPIException(
+                    f"Error with Mobile Commons API. Error code {error_code}. Response: {resp.text}"
+                )
+
+            data = nested_get(data, "response", "messages", "message", default=[])
+            if type(data) == OrderedDict:
+                data = [
+                    data
+                ]  # if the page has exactly one item it gets parsed as a dict instead of a list
+            all_data.extend(data)
+
+            if len(data) < limit_per_page:
                 break
-            time.sleep(fails * retry_wait)
-
-            params["page"] = page
-            logging.debug(f"Requesting {url} with params {params}")
-
-            try:
-                resp = session.get(url, params=params, auth=(username, password))
-
-                data = xmltodict.parse(resp.text, attr_prefix="", cdata_key="value")
-
-                error_code = nested_get(data, "response", "error", "id")
-                if error_code:
-                    raise MobileCommonsAPIException(
-                        f"Error with Mobile Commons API. Error code {error_code}. Response: {resp.text}"
-                    )
-
-                data = nested_get(data, "response", "messages", "message", default=[])
-                if type(data) == OrderedDict:
-                    data = [
-                        data
-                    ]  # if the page has exactly one item it gets parsed as a dict instead of a list
-                all_data.extend(data)
-
-                if len(data) < limit_per_page:
-                    break
 
-                if resp.status_code in [429]:
-                    logging.warning("429: Rate limit - waiting 2 seconds")
-                    time.sleep(2)
-                    continue
+            if resp.status_code in [429]:
+                logging.warning("429: Rate limit - waiting 2 seconds")
+                time.sleep(2)
+                continue
 
-                resp.raise_for_status()
+            resp.raise_for_status()
 
-            except (requests.exceptions.RequestException, MobileCommonsAPIException):
-                fails += 1
-                logging.exception("Mobile commons exception")
-                if fails > retry_limit:
-                    raise
+        except (requests.exceptions.RequestException, MobileCommonsAPIException):
+            fails += 1
+            logging.exception("Mobile commons exception")
+            if fails > retry_limit:
+                raise
 
-            page += 1
+        page += 1
 
     return all_data
 
@@ -0,0 +1,97 @@
+# ew_common.sync_state
+#
+# Remembers a hash of the values we last pushed for each record to an
+# external system (e.g. custom fields on a Mobile Commons profile or a BSD
+# constituent), so that sync jobs can skip records whose values haven't
+# changed since.
+
+import hashlib
+import json
+import sqlite3
+import time
+from typing import Any, Optional
+
+COMMIT_EVERY = 1000
+
+
+class SyncState:
+    """SQLite-backed store of per-record hashes of last synced values.
+
+    One database file can hold several syncs, each under its own
+    namespace. Hashes are only recorded via mark_synced, which callers
+    should call once the external system has accepted the values, so a
+    failed push is retried on the next run.
+
+    If resync_after_seconds is set, records synced longer ago than that
+    count as changed, so edits made directly in the external system are
+    eventually overwritten again.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        namespace: str,
+        resync_after_seconds: Optional[float] = None,
+    ):
+        self.namespace = namespace
+        self.resync_after_seconds = resync_after_seconds
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sync_state ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " hash TEXT NOT NULL,"
+            " synced_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        self.conn.commit()
+        # Syncs check every record, so load the namespace up front rather
+        # than querying per record.
+        self.synced = {
+            key: (value_hash, synced_at)
+            for key, value_hash, synced_at in self.conn.execute(
+                "SELECT key, hash, synced_at FROM sync_state WHERE namespace = ?",
+                (namespace,),
+            )
+        }
+        self.uncommitted = 0
+
+    @staticmethod
+    def hash_values(values: Any) -> str:
+        """Stable hash of JSON-like values; dict key order doesn't matter."""
+        encoded = json.dumps(values, sort_keys=True, default=str)
+        return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+    def has_changed(self, key: Any, values: Any) -> bool:
+        synced = self.synced.get(str(key))
+        if not synced:
+            return True
+        value_hash, synced_at = synced
+        if (
+            self.resync_after_seconds is not None
+            and time.time() - synced_at > self.resync_after_seconds
+        ):
+            return True
+        return value_hash != self.hash_values(values)
+
+    def mark_synced(self, key: Any, values: Any):
+        key = str(key)
+        value_hash = self.hash_values(values)
+        synced_at = time.time()
+        self.synced[key] = (value_hash, synced_at)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO sync_state (namespace, key, hash, synced_at)"
+            " VALUES (?, ?, ?, ?)",
+            (self.namespace, key, value_hash, synced_at),
+        )
+        self.uncommitted += 1
+        if self.uncommitted >= COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
@@ -0,0 +1,96 @@
+import pytest
+
+pd = pytest.importorskip("pandas")
+np = pytest.importorskip("numpy")
+
+from ew_common.dataframes import (  # noqa: E402
+    non_blank_strings,
+    nulls_to_none,
+    phone_numbers,
+    postal_codes,
+    rounded_ints,
+    yes_no,
+)
+
+
+def test_nulls_to_none():
+    series = pd.Series(["a", "", None, np.nan, 0])
+    assert nulls_to_none(series).tolist() == ["a", "", None, None, 0]
+    assert nulls_to_none(series, blank_strings=True).tolist() == [
+        "a",
+        None,
+        None,
+        None,
+        0,
+    ]
+
+
+def test_non_blank_strings():
+    series = pd.Series(["a", "", None, np.nan, 0, 2.5, 5555555555])
+    assert non_blank_strings(series).tolist() == [
+        "a",
+        None,
+        None,
+        None,
+        None,
+        "2.5",
+        "5555555555",
+    ]
+
+
+def test_postal_codes():
+    assert postal_codes(pd.Series([2145.0, np.nan, 12345])).tolist() == [
+        "02145",
+        "",
+        "12345",
+    ]
+    assert postal_codes(pd.Series(["02145", 2145, None, "02145-1234"])).tolist() == [
+        "02145",
+        "02145",
+        "",
+        "02145-1234",
+    ]
+
+
+def test_rounded_ints():
+    values = rounded_ints(pd.Series([2.5, 3.5, np.nan, 7.0])).tolist()
+    assert values == [2, 4, None, 7]
+    assert [type(v) for v in values] == [int, int, type(None), int]
+
+
+def test_yes_no():
+    series = pd.Series([0, 1, "0", "1", "No", "Yes", 1.0, None, "maybe"])
+    assert yes_no(series).tolist() == [
+        "No",
+        "Yes",
+        "No",
+        "Yes",
+        "No",
+        "Yes",
+        "Yes",
+        None,
+        "maybe",
+    ]
+
+
+def test_phone_numbers():
+    series = pd.Series(
+        [
+            "5105016227",
+            " +15105016227",
+            "15555555555",
+            "My number is (510) 501-6227.",
+            None,
+            "garbage",
+            "5105016227",
+        ]
+    )
+    assert phone_numbers(series).tolist() == [
+        "15105016227",
+        "15105016227",
+        None,
+        "15105016227",
+        None,
+        None,
+        "15105016227",
+    ]
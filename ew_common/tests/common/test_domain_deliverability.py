@@ -0,0 +1,86 @@
+import threading
+import time
+
+from ew_common.domain_deliverability import DomainDeliverabilityCache
+
+
+class StubResolver:
+    def __init__(self, undeliverable=()):
+        self.undeliverable = set(undeliverable)
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def __call__(self, domain):
+        with self.lock:
+            self.calls.append(domain)
+        return domain not in self.undeliverable
+
+
+def test_verdicts_are_cached_across_runs(tmp_path):
+    path = str(tmp_path / "domains.sqlite")
+    resolver = StubResolver(undeliverable=["nomx.example"])
+    cache = DomainDeliverabilityCache(path, resolver=resolver)
+
+    assert cache.is_deliverable("Gmail.com")
+    assert not cache.is_deliverable("nomx.example")
+    assert cache.is_deliverable("gmail.com")
+    assert resolver.calls == ["gmail.com", "nomx.example"]
+    cache.close()
+
+    resolver = StubResolver()
+    cache = DomainDeliverabilityCache(path, resolver=resolver)
+    assert cache.resolve_all(["gmail.com", "nomx.example"]) == {
+        "gmail.com": True,
+        "nomx.example": False,
+    }
+    assert resolver.calls == []
+
+
+def test_negative_verdicts_expire_sooner(tmp_path):
+    resolver = StubResolver(undeliverable=["nomx.example"])
+    cache = DomainDeliverabilityCache(
+        str(tmp_path / "domains.sqlite"),
+        resolver=resolver,
+        ttl_seconds=3600,
+        negative_ttl_seconds=60,
+    )
+    cache.resolve_all(["gmail.com", "nomx.example"])
+
+    for domain in ["gmail.com", "nomx.example"]:
+        deliverable, _ = cache.verdicts[domain]
+        cache.verdicts[domain] = (deliverable, time.time() - 120)
+    assert cache.cached("gmail.com")
+    assert cache.cached("nomx.example") is None
+
+    resolver.undeliverable = set()
+    assert cache.is_deliverable("nomx.example")
+    assert resolver.calls.count("nomx.example") == 2
+
+
+def test_resolve_all_resolves_concurrently(tmp_path):
+    in_flight = []
+    max_in_flight = []
+    lock = threading.Lock()
+
+    def slow_resolver(domain):
+        with lock:
+            in_flight.append(domain)
+            max_in_flight.append(len(in_flight))
+        time.sleep(0.05)
+        with lock:
+            in_flight.remove(domain)
+        return True
+
+    cache = DomainDeliverabilityCache(
+        str(tmp_path / "domains.sqlite"), resolver=slow_resolver, concurrency=8
+    )
+    domains = [f"domain{i}.example" for i in range(16)]
+
+    started = time.monotonic()
+    verdicts = cache.resolve_all(domains + domains)
+    elapsed = time.monotonic() - started
+
+    assert verdicts == {domain: True for domain in domains}
+    assert max(max_in_flight) == 8
+    # Serially, 16 lookups * 0.05s would take 0.8s.
+    assert elapsed < 0.5
@@ -1,8 +1,12 @@
+import phonenumbers
+
 from ew_common.input_validation import (
     extract_city_state,
     extract_name,
     extract_phone_number,
     extract_postal_code,
+    normalize_name,
+    normalize_names_batch,
 )
 
 
@@ -45,6 +49,47 @@ def test_extract_phone_number():
     assert extract_phone_number("My number is (510) 501-6227.") == "15105016227"
 
 
+def test_extract_phone_number_fast_path_matches_matcher():
+    # Canonical numbers skip PhoneNumberMatcher; they must come out the same
+    # as if they hadn't.
+    for t in [
+        "5105016227",
+        " 15105016227\n",
+        "+15105016227",
+        "5555555555",
+        "15555555555",
+        "2125550123",
+        "+5105016227",
+        "25105016227",
+        "1510501622",
+    ]:
+        matcher = phonenumbers.PhoneNumberMatcher(t, "US")
+        expected = None
+        if matcher.has_next():
+            expected = phonenumbers.format_number(
+                matcher.next().number, phonenumbers.PhoneNumberFormat.E164
+            ).replace("+", "")
+        assert extract_phone_number(t) == expected, t
+
+
 def test_extract_postal_code():
     assert extract_postal_code(" 02145.") == "02145"
     assert extract_postal_code(" 0215.") == None
+
+
+def test_normalize_name():
+    assert normalize_name("JASON", "KATZ-BROWN") == ("Jason", "Katz-Brown")
+    assert normalize_name("jason", "mcdonald") == ("Jason", "McDonald")
+    assert normalize_name("Jason", "KAtz-Brown") == ("Jason", "KAtz-Brown")
+    assert normalize_name("", "") == ("", "")
+
+
+def test_normalize_names_batch():
+    names = [("ELIZABETH", "WARREN"), ("jason", "katz-brown")] * 3 + [("", "")]
+    normalize_name.cache_clear()
+
+    assert normalize_names_batch(names) == [
+        ("Elizabeth", "Warren"),
+        ("Jason", "Katz-Brown"),
+    ] * 3 + [("", "")]
+    assert normalize_name.cache_info().misses == 3
@@ -1,9 +1,11 @@
 import json
 import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 import pytest
 
-from ew_common.mobile_commons import Profile
+from ew_common.mobile_commons import Profile, get_session, new_session
 
 
 @pytest.fixture
@@ -56,3 +58,49 @@ def test_parsing_no_messages(sample_profile):
     del sample_profile["messages"]
     p = Profile.from_xml_dict(sample_profile)
     assert p.messages == []
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Answers 503 to the first request, then 200, over keep-alive."""
+
+    protocol_version = "HTTP/1.1"
+    requests_seen = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        FlakyHandler.requests_seen.append(self.client_address[1])
+        status = 503 if len(FlakyHandler.requests_seen) == 1 else 200
+        body = b"<response success='true'/>"
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def flaky_server():
+    FlakyHandler.requests_seen = []
+    server = ThreadingHTTPServer(("localhost", 0), FlakyHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://localhost:{server.server_port}/"
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_session_is_shared():
+    assert get_session() is get_session()
+
+
+def test_session_retries_and_keeps_connections_alive(flaky_server):
+    session = new_session(backoff_factor=0)
+    for _ in range(2):
+        resp = session.post(flaky_server, json={"phone_number": "15555555555"})
+        assert resp.status_code == 200
+
+    # The 503 was retried, and all three requests shared one connection.
+    assert len(FlakyHandler.requests_seen) == 3
+    assert len(set(FlakyHandler.requests_seen)) == 1
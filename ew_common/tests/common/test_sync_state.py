@@ -0,0 +1,36 @@
+import time
+
+from ew_common.sync_state import SyncState
+
+
+def test_only_changed_values_need_sync(tmp_path):
+    path = str(tmp_path / "sync_state.sqlite")
+    state = SyncState(path, "mobile_commons")
+    assert state.has_changed("15555555555", {"donation_hpc": 100})
+
+    state.mark_synced("15555555555", {"donation_hpc": 100, "donation_num": 2})
+    assert not state.has_changed(
+        "15555555555", {"donation_num": 2, "donation_hpc": 100}
+    )
+    assert state.has_changed("15555555555", {"donation_hpc": 250, "donation_num": 2})
+    state.close()
+
+    # Persisted across runs, separately per namespace.
+    state = SyncState(path, "mobile_commons")
+    assert not state.has_changed(
+        "15555555555", {"donation_hpc": 100, "donation_num": 2}
+    )
+    assert SyncState(path, "bsd").has_changed(
+        "15555555555", {"donation_hpc": 100, "donation_num": 2}
+    )
+
+
+def test_resync_after(tmp_path):
+    state = SyncState(
+        str(tmp_path / "sync_state.sqlite"), "bsd", resync_after_seconds=60
+    )
+    state.mark_synced(1234, ["100", None])
+    assert not state.has_changed(1234, ["100", None])
+
+    state.synced["1234"] = (state.synced["1234"][0], time.time() - 120)
+    assert state.has_changed(1234, ["100", None])
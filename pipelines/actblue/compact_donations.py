@@ -0,0 +1,301 @@
+# Compacts the ActBlue donations archive in S3 into Parquet for the
+# realtime dashboards.
+#
+# toes writes donations under the donations/ prefix either as one JSON
+# object per donation:
+#   donations/<archived at>_<paidAt>_<order number>.json
+# or, in queue ingestion mode, as compressed NDJSON segments partitioned by
+# paidAt hour:
+#   donations/segments/dt=<paidAt date>/hour=<paidAt hour>/<flushed at>_<order number>_<count>.ndjson.gz
+#
+# This job rewrites both into a fixed-schema Parquet dataset partitioned
+# the same way:
+#   donations_parquet/dt=<paidAt date>/hour=<paidAt hour>/*.parquet
+#
+# Rows within each file are sorted by state and written with column
+# statistics, so a query like "total by state for the last hour" prunes
+# down to one or two partitions and reads only the state/amount/paid_at
+# column chunks. See totals_by_state.
+#
+# ActBlue retries webhooks and SQS redelivers messages, so the same
+# donation can be archived more than once. Rows are deduplicated on
+# (order_number, lineitem_id) within each file written, and again across
+# files when aggregating, as a donation can be in both a per-donation
+# object and a segment of the same hour.
+#
+# Compaction is idempotent: output file names are derived from their
+# source, so re-running an hour overwrites rather than duplicates. Since
+# segments for an hour can be flushed a few minutes after it ends, run the
+# job over a trailing window of a few hours.
+
+import argparse
+import datetime
+import gzip
+import io
+import json
+from collections import defaultdict
+
+import boto3
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs
+import pyarrow.parquet as pq
+from dateutil import parser as dateparser
+
+DONATIONS_PREFIX = "donations/"
+SEGMENTS_PREFIX = "donations/segments/"
+PARQUET_PREFIX = "donations_parquet/"
+
+ARCHIVE_TIMESTAMP_FORMAT = "%Y-%m-%d_%H:%M:%S"
+
+DONATIONS_SCHEMA = pa.schema(
+    [
+        ("order_number", pa.string()),
+        ("lineitem_id", pa.string()),
+        ("paid_at", pa.timestamp("s", tz="UTC")),
+        ("amount", pa.float64()),
+        ("is_recurring", pa.bool_()),
+        ("state", pa.string()),
+        ("zip", pa.string()),
+        # Seconds between paidAt and the donation being archived by toes.
+        ("lag_seconds", pa.int64()),
+    ]
+)
+
+PARTITIONING = ds.partitioning(
+    pa.schema([("dt", pa.string()), ("hour", pa.string())]), flavor="hive"
+)
+
+ROW_GROUP_SIZE = 10000
+
+
+def hours_between(start, end):
+    hour = start.replace(minute=0, second=0, microsecond=0)
+    while hour < end:
+        yield hour
+        hour += datetime.timedelta(hours=1)
+
+
+def to_utc(ts):
+    """ts in UTC; naive datetimes are taken to be UTC already."""
+    if ts.tzinfo is None:
+        return ts.replace(tzinfo=datetime.timezone.utc)
+    return ts.astimezone(datetime.timezone.utc)
+
+
+def partition_of(paid_at):
+    return paid_at.strftime("%Y-%m-%d"), paid_at.strftime("%H")
+
+
+def donation_to_row(event, archived_at):
+    line_item = event["lineitems"][-1]
+    paid_at = dateparser.parse(line_item["paidAt"]).astimezone(datetime.timezone.utc)
+    donor = event.get("donor", {})
+    return {
+        "order_number": event["contribution"]["orderNumber"],
+        "lineitem_id": (
+            str(line_item["lineitemId"]) if line_item.get("lineitemId") else None
+        ),
+        "paid_at": paid_at,
+        "amount": float(line_item["amount"]),
+        "is_recurring": bool(event["contribution"].get("isRecurring")),
+        "state": donor.get("state"),
+        "zip": donor.get("zip"),
+        "lag_seconds": int((archived_at - paid_at).total_seconds()),
+    }
+
+
+def donation_key(row):
+    return row["order_number"], row["lineitem_id"]
+
+
+def dedupe_rows(rows):
+    """Keeps one row per donation: the one archived first."""
+    first_rows = {}
+    for row in rows:
+        key = donation_key(row)
+        if key not in first_rows or row["lag_seconds"] < first_rows[key]["lag_seconds"]:
+            first_rows[key] = row
+    return list(first_rows.values())
+
+
+def archived_at_of_key(key):
+    """Parses the archive timestamp at the start of a donation object's name.
+
+    That's when the webhook was processed for per-donation objects, and when
+    the segment was flushed for segments.
+    """
+    basename = key.rsplit("/", 1)[-1]
+    return datetime.datetime.strptime(
+        basename[: len("2019-06-07_20:32:24")], ARCHIVE_TIMESTAMP_FORMAT
+    ).replace(tzinfo=datetime.timezone.utc)
+
+
+def decompress_segment(key, body):
+    if key.endswith(".gz"):
+        return gzip.decompress(body)
+    if key.endswith(".zst"):
+        # zstandard is only needed if toes archives with zstd.
+        import zstandard
+
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            io.BytesIO(body), read_across_frames=True
+        )
+        return reader.read()
+    raise ValueError(f"Unknown segment compression: {key}")
+
+
+class ActBlueDonationsCompaction:
+    def __init__(
+        self, bucket, start, end, s3_client=None, filesystem=None, output_root=None
+    ):
+        self.bucket = bucket
+        # Partitions are named for UTC hours.
+        self.start = to_utc(start)
+        self.end = to_utc(end)
+        self.s3 = s3_client if s3_client else boto3.client("s3")
+        # By default the Parquet dataset lives in the same bucket.
+        self.filesystem = filesystem if filesystem else pyarrow.fs.S3FileSystem()
+        self.output_root = (
+            output_root if output_root else f"{bucket}/{PARQUET_PREFIX}".rstrip("/")
+        )
+
+    def run(self):
+        for hour in hours_between(self.start, self.end):
+            self.compact_objects_archived_in_hour(hour)
+            self.compact_segments_of_hour(hour)
+        print("Done.")
+
+    def compact_objects_archived_in_hour(self, hour):
+        """Compacts per-donation JSON objects archived during the given hour.
+
+        Their paidAt may fall in earlier hours, so this can write to
+        several partitions.
+        """
+        prefix = f"{DONATIONS_PREFIX}{hour.strftime('%Y-%m-%d_%H')}"
+        rows_by_partition = defaultdict(list)
+        for key in self.list_keys(prefix):
+            if not key.endswith(".json"):
+                continue
+            event = json.loads(self.get_object(key))
+            row = donation_to_row(event, archived_at_of_key(key))
+            rows_by_partition[partition_of(row["paid_at"])].append(row)
+
+        for (dt, partition_hour), rows in rows_by_partition.items():
+            self.write_partition(
+                rows, dt, partition_hour, f"objects-{hour.strftime('%Y-%m-%d_%H')}"
+            )
+
+    def compact_segments_of_hour(self, hour):
+        dt, partition_hour = partition_of(hour)
+        prefix = f"{SEGMENTS_PREFIX}dt={dt}/hour={partition_hour}/"
+        rows = []
+        for key in self.list_keys(prefix):
+            if key.endswith(".manifest"):
+                continue
+            archived_at = archived_at_of_key(key)
+            data = decompress_segment(key, self.get_object(key))
+            for line in data.splitlines():
+                if line:
+                    rows.append(donation_to_row(json.loads(line), archived_at))
+
+        if rows:
+            self.write_partition(rows, dt, partition_hour, "segments")
+
+    def write_partition(self, rows, dt, partition_hour, name):
+        table = pa.Table.from_pylist(dedupe_rows(rows), schema=DONATIONS_SCHEMA)
+        # Sorting by state clusters each state into few row groups, so
+        # row group statistics can skip the rest.
+        table = table.sort_by([("state", "ascending"), ("paid_at", "ascending")])
+        path = f"{self.output_root}/dt={dt}/hour={partition_hour}/{name}.parquet"
+        print(f"Writing {table.num_rows} rows to {path}")
+        self.filesystem.create_dir(path.rsplit("/", 1)[0], recursive=True)
+        pq.write_table(
+            table,
+            path,
+            filesystem=self.filesystem,
+            row_group_size=ROW_GROUP_SIZE,
+            compression="zstd",
+            write_statistics=True,
+        )
+
+    def list_keys(self, prefix):
+        paginator = self.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                yield obj["Key"]
+
+    def get_object(self, key):
+        return self.s3.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+
+
+def donations_dataset(root, filesystem=None):
+    """Opens the compacted donations Parquet dataset rooted at root."""
+    return ds.dataset(
+        root,
+        schema=pa.unify_schemas([DONATIONS_SCHEMA, PARTITIONING.schema]),
+        format="parquet",
+        partitioning=PARTITIONING,
+        filesystem=filesystem,
+    )
+
+
+def partition_filter(start, end):
+    """Filter on the dt/hour partition columns covering [start, end)."""
+    hours = list(hours_between(start, end))
+    if not hours:
+        raise ValueError(f"Empty time range: {start} to {end}")
+    expressions = [
+        (ds.field("dt") == dt) & (ds.field("hour") == hour)
+        for dt, hour in (partition_of(h) for h in hours)
+    ]
+    expression = expressions[0]
+    for e in expressions[1:]:
+        expression = expression | e
+    return expression
+
+
+def totals_by_state(dataset, start, end):
+    """Returns dict of state to total donation amount with paidAt in [start, end).
+
+    Partition pruning skips every hour outside the range, and only the
+    state, amount, paid_at and donation key columns are read. Each
+    donation is counted once, even if it was compacted into several files.
+    """
+    table = dataset.to_table(
+        columns=["order_number", "lineitem_id", "state", "amount"],
+        filter=partition_filter(start, end)
+        & (ds.field("paid_at") >= pa.scalar(start, type=pa.timestamp("s", tz="UTC")))
+        & (ds.field("paid_at") < pa.scalar(end, type=pa.timestamp("s", tz="UTC"))),
+    )
+    donations = table.group_by(
+        ["order_number", "lineitem_id"], use_threads=False
+    ).aggregate([("state", "first"), ("amount", "first")])
+    donations = pa.table(
+        {
+            "state": donations.column("state_first"),
+            "amount": donations.column("amount_first"),
+        }
+    )
+    totals = donations.group_by("state").aggregate([("amount", "sum")])
+    return dict(
+        zip(totals.column("state").to_pylist(), totals.column("amount_sum").to_pylist())
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compact the ActBlue donations archive into Parquet"
+    )
+    parser.add_argument("--bucket", help="The ActBlue donations S3 bucket")
+    parser.add_argument(
+        "--start", help="Start of the time range to compact, e.g. 2019-06-07T19:00Z"
+    )
+    parser.add_argument("--end", help="End of the time range to compact (exclusive)")
+    args = parser.parse_args()
+
+    ActBlueDonationsCompaction(
+        args.bucket,
+        to_utc(dateparser.parse(args.start)),
+        to_utc(dateparser.parse(args.end)),
+    ).run()
@@ -0,0 +1,174 @@
+import datetime
+import gzip
+import json
+
+import boto3
+import pyarrow.fs
+import pyarrow.parquet as pq
+import pytest
+from moto import mock_s3
+
+from compact_donations import (
+    ActBlueDonationsCompaction,
+    donation_to_row,
+    donations_dataset,
+    totals_by_state,
+)
+
+BUCKET = "ew-actblue-donations-incoming-dev"
+
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=datetime.timezone.utc)
+
+
+def make_donation(order_number, paid_at, amount, state, is_recurring=False):
+    return {
+        "donor": {"state": state, "zip": "94801"},
+        "contribution": {"orderNumber": order_number, "isRecurring": is_recurring},
+        "lineitems": [
+            {"amount": str(amount), "paidAt": paid_at, "lineitemId": 123456789}
+        ],
+    }
+
+
+@pytest.fixture
+def s3_client():
+    with mock_s3():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def test_donation_to_row():
+    row = donation_to_row(
+        make_donation("AB1", "2019-06-07T15:49:39-04:00", 50.0, "CA", True),
+        utc(2019, 6, 7, 20, 32, 24),
+    )
+    assert row == {
+        "order_number": "AB1",
+        "lineitem_id": "123456789",
+        "paid_at": utc(2019, 6, 7, 19, 49, 39),
+        "amount": 50.0,
+        "is_recurring": True,
+        "state": "CA",
+        "zip": "94801",
+        "lag_seconds": 2565,
+    }
+
+
+def test_compaction_and_totals_by_state(s3_client, tmp_path):
+    # Legacy per-donation objects, archived at 20:32. One was paid at 19:49,
+    # so it belongs in the previous hour's partition.
+    for order_number, paid_at, amount, state in [
+        ("AB1", "2019-06-07T15:49:39-04:00", 50, "CA"),
+        ("AB2", "2019-06-07T16:30:00-04:00", 25, "IA"),
+    ]:
+        s3_client.put_object(
+            Bucket=BUCKET,
+            Key=f"donations/2019-06-07_20:32:24_{paid_at}_{order_number}.json",
+            Body=json.dumps(make_donation(order_number, paid_at, amount, state)),
+        )
+
+    # A segment with two donations paid during the 20:00 hour.
+    segment = "\n".join(
+        json.dumps(make_donation(*d))
+        for d in [
+            ("AB3", "2019-06-07T20:10:00Z", 10, "CA"),
+            ("AB4", "2019-06-07T20:20:00Z", 5, "NV"),
+        ]
+    )
+    key = "donations/segments/dt=2019-06-07/hour=20/2019-06-07_20:35:00_AB3_2.ndjson.gz"
+    s3_client.put_object(Bucket=BUCKET, Key=key, Body=gzip.compress(segment.encode()))
+    s3_client.put_object(Bucket=BUCKET, Key=key + ".manifest", Body="{}")
+
+    filesystem = pyarrow.fs.LocalFileSystem()
+    root = str(tmp_path / "donations_parquet")
+    ActBlueDonationsCompaction(
+        BUCKET,
+        utc(2019, 6, 7, 19),
+        utc(2019, 6, 7, 21),
+        s3_client=s3_client,
+        filesystem=filesystem,
+        output_root=root,
+    ).run()
+
+    assert sorted(str(p.relative_to(root)) for p in tmp_path.glob("**/*.parquet")) == [
+        "dt=2019-06-07/hour=19/objects-2019-06-07_20.parquet",
+        "dt=2019-06-07/hour=20/objects-2019-06-07_20.parquet",
+        "dt=2019-06-07/hour=20/segments.parquet",
+    ]
+    segments_file = pq.ParquetFile(f"{root}/dt=2019-06-07/hour=20/segments.parquet")
+    assert segments_file.metadata.row_group(0).column(5).statistics.min == "CA"
+
+    dataset = donations_dataset(root, filesystem=filesystem)
+    assert totals_by_state(dataset, utc(2019, 6, 7, 20), utc(2019, 6, 7, 21)) == {
+        "CA": 10.0,
+        "IA": 25.0,
+        "NV": 5.0,
+    }
+    assert totals_by_state(
+        dataset, utc(2019, 6, 7, 19, 30), utc(2019, 6, 7, 20, 15)
+    ) == {"CA": 60.0}
+
+
+def test_duplicate_donations_are_counted_once(s3_client, tmp_path):
+    # AB1 was redelivered within its segment, and was also archived as a
+    # per-donation object.
+    s3_client.put_object(
+        Bucket=BUCKET,
+        Key="donations/2019-06-07_20:32:24_2019-06-07T20:10:00Z_AB1.json",
+        Body=json.dumps(make_donation("AB1", "2019-06-07T20:10:00Z", 10, "CA")),
+    )
+    segment = "\n".join(
+        json.dumps(make_donation(*d))
+        for d in [
+            ("AB1", "2019-06-07T20:10:00Z", 10, "CA"),
+            ("AB2", "2019-06-07T20:20:00Z", 5, "NV"),
+            ("AB1", "2019-06-07T20:10:00Z", 10, "CA"),
+        ]
+    )
+    key = "donations/segments/dt=2019-06-07/hour=20/2019-06-07_20:35:00_AB1_3.ndjson.gz"
+    s3_client.put_object(Bucket=BUCKET, Key=key, Body=gzip.compress(segment.encode()))
+
+    filesystem = pyarrow.fs.LocalFileSystem()
+    root = str(tmp_path / "donations_parquet")
+    ActBlueDonationsCompaction(
+        BUCKET,
+        utc(2019, 6, 7, 20),
+        utc(2019, 6, 7, 21),
+        s3_client=s3_client,
+        filesystem=filesystem,
+        output_root=root,
+    ).run()
+
+    segments_table = pq.read_table(f"{root}/dt=2019-06-07/hour=20/segments.parquet")
+    assert sorted(segments_table.column("order_number").to_pylist()) == ["AB1", "AB2"]
+
+    dataset = donations_dataset(root, filesystem=filesystem)
+    assert totals_by_state(dataset, utc(2019, 6, 7, 20), utc(2019, 6, 7, 21)) == {
+        "CA": 10.0,
+        "NV": 5.0,
+    }
+
+
+def test_compaction_range_in_another_timezone(s3_client, tmp_path):
+    key = "donations/segments/dt=2019-06-07/hour=20/2019-06-07_20:35:00_AB1_1.ndjson.gz"
+    segment = json.dumps(make_donation("AB1", "2019-06-07T20:10:00Z", 10, "CA"))
+    s3_client.put_object(Bucket=BUCKET, Key=key, Body=gzip.compress(segment.encode()))
+
+    eastern = datetime.timezone(datetime.timedelta(hours=-4))
+    root = str(tmp_path / "donations_parquet")
+    ActBlueDonationsCompaction(
+        BUCKET,
+        datetime.datetime(2019, 6, 7, 16, tzinfo=eastern),
+        datetime.datetime(2019, 6, 7, 17, tzinfo=eastern),
+        s3_client=s3_client,
+        filesystem=pyarrow.fs.LocalFileSystem(),
+        output_root=root,
+    ).run()
+
+    # 16:00 Eastern is the 20:00 UTC partition.
+    assert [str(p.relative_to(root)) for p in tmp_path.glob("**/*.parquet")] == [
+        "dt=2019-06-07/hour=20/segments.parquet"
+    ]
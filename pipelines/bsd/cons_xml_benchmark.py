@@ -0,0 +1,119 @@
+# Microbenchmark of ConsXmlWriter against the ElementTree serialization it
+# replaced, on batches shaped like BsdExport's new-cons uploads.
+#
+#   python cons_xml_benchmark.py [--conses 100] [--batches 200]
+
+import argparse
+import time
+import xml.etree.ElementTree
+
+from cons_xml import ConsXmlWriter
+
+
+def sample_cons(i):
+    return {
+        "firstname": "José",
+        "lastname": f"O'Brien {i}",
+        "source": "shopify",
+        "addr1": f"{i} Main St & Co",
+        "city": "Reno",
+        "state_cd": "NV",
+        "zip": "89501",
+        "phone": f"555555{i:04d}",
+        "email": f"voter{i}@example.com",
+    }
+
+
+def element_tree_batch(conses):
+    top = xml.etree.ElementTree.Element("api")
+    for c in conses:
+        cons = xml.etree.ElementTree.SubElement(top, "cons")
+        xml.etree.ElementTree.SubElement(cons, "firstname").text = c["firstname"]
+        xml.etree.ElementTree.SubElement(cons, "lastname").text = c["lastname"]
+        xml.etree.ElementTree.SubElement(cons, "is_banned").text = "0"
+        xml.etree.ElementTree.SubElement(cons, "source").text = c["source"]
+        cons_addr = xml.etree.ElementTree.SubElement(cons, "cons_addr")
+        for tag in ("addr1", "city", "state_cd", "zip"):
+            xml.etree.ElementTree.SubElement(cons_addr, tag).text = c[tag]
+        xml.etree.ElementTree.SubElement(cons_addr, "country").text = "US"
+        cons_phone = xml.etree.ElementTree.SubElement(cons, "cons_phone")
+        xml.etree.ElementTree.SubElement(cons_phone, "phone").text = c["phone"]
+        xml.etree.ElementTree.SubElement(cons_phone, "phone_type").text = "home"
+        xml.etree.ElementTree.SubElement(cons_phone, "is_subscribed").text = "0"
+        xml.etree.ElementTree.SubElement(cons_phone, "is_primary").text = "1"
+        cons_email = xml.etree.ElementTree.SubElement(cons, "cons_email")
+        xml.etree.ElementTree.SubElement(cons_email, "email").text = c["email"]
+        xml.etree.ElementTree.SubElement(cons_email, "email_type").text = "personal"
+        xml.etree.ElementTree.SubElement(cons_email, "is_subscribed").text = "1"
+        xml.etree.ElementTree.SubElement(cons_email, "is_primary").text = "1"
+        for cons_group_id in ("1", "2", "30384"):
+            xml.etree.ElementTree.SubElement(cons, "cons_group", id=cons_group_id)
+        cons_field = xml.etree.ElementTree.SubElement(cons, "cons_field", id="3")
+        xml.etree.ElementTree.SubElement(cons_field, "value").text = "shopify"
+    return b'<?xml version="1.0" encoding="utf-8"?>' + xml.etree.ElementTree.tostring(
+        top
+    )
+
+
+def writer_batch(writer, conses):
+    writer.reset()
+    for c in conses:
+        writer.start_cons()
+        writer.text_element("firstname", c["firstname"])
+        writer.text_element("lastname", c["lastname"])
+        writer.text_element("is_banned", "0")
+        writer.text_element("source", c["source"])
+        writer.start("cons_addr")
+        for tag in ("addr1", "city", "state_cd", "zip"):
+            writer.text_element(tag, c[tag])
+        writer.text_element("country", "US")
+        writer.end("cons_addr")
+        writer.start("cons_phone")
+        writer.text_element("phone", c["phone"])
+        writer.text_element("phone_type", "home")
+        writer.text_element("is_subscribed", "0")
+        writer.text_element("is_primary", "1")
+        writer.end("cons_phone")
+        writer.start("cons_email")
+        writer.text_element("email", c["email"])
+        writer.text_element("email_type", "personal")
+        writer.text_element("is_subscribed", "1")
+        writer.text_element("is_primary", "1")
+        writer.end("cons_email")
+        for cons_group_id in ("1", "2", "30384"):
+            writer.cons_group(cons_group_id)
+        writer.cons_field("3", "shopify")
+        writer.end_cons()
+    return writer.getvalue()
+
+
+def timed(f, batches):
+    started = time.perf_counter()
+    outputs = [f(conses) for conses in batches]
+    return time.perf_counter() - started, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conses", type=int, default=100, help="cons per batch")
+    parser.add_argument("--batches", type=int, default=200)
+    args = parser.parse_args()
+
+    batches = [
+        [sample_cons(b * args.conses + i) for i in range(args.conses)]
+        for b in range(args.batches)
+    ]
+    writer = ConsXmlWriter()
+
+    element_tree_seconds, expected = timed(element_tree_batch, batches)
+    writer_seconds, actual = timed(lambda c: writer_batch(writer, c), batches)
+    assert actual == expected, "ConsXmlWriter output differs from ElementTree"
+
+    total = args.conses * args.batches
+    print(f"ElementTree:   {element_tree_seconds:.3f}s ({total} cons)")
+    print(f"ConsXmlWriter: {writer_seconds:.3f}s ({total} cons)")
+    print(f"Speedup: {element_tree_seconds / writer_seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
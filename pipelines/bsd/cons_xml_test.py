@@ -0,0 +1,93 @@
+import os
+import xml.etree.ElementTree
+
+from cons_xml import ConsXmlWriter
+
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), "testdata", "cons_batch.xml")
+
+# Values that exercise escaping: markup characters, quotes, whitespace that
+# has to become character references in attributes, and non-ASCII text.
+TRICKY = '12 Rue d\'Église & <Co> "x"\r\n\t東京 \U0001f600'
+
+
+def element_tree_cons(top, cons):
+    """Builds a <cons> the way the pipelines did before ConsXmlWriter."""
+    attrib = {"id": cons["id"]} if cons.get("id") else {}
+    element = xml.etree.ElementTree.SubElement(top, "cons", **attrib)
+    for tag, text in cons.get("fields", []):
+        xml.etree.ElementTree.SubElement(element, tag).text = text
+    if "addr" in cons:
+        cons_addr = xml.etree.ElementTree.SubElement(element, "cons_addr")
+        for tag, text in cons["addr"]:
+            xml.etree.ElementTree.SubElement(cons_addr, tag).text = text
+    for cons_group_id in cons.get("groups", []):
+        xml.etree.ElementTree.SubElement(element, "cons_group", id=cons_group_id)
+    for cons_field_id, value in cons.get("cons_fields", []):
+        cons_field = xml.etree.ElementTree.SubElement(
+            element, "cons_field", id=cons_field_id
+        )
+        if value is not None:
+            xml.etree.ElementTree.SubElement(cons_field, "value").text = value
+
+
+def element_tree_xml(conses):
+    top = xml.etree.ElementTree.Element("api")
+    for cons in conses:
+        element_tree_cons(top, cons)
+    return b'<?xml version="1.0" encoding="utf-8"?>' + xml.etree.ElementTree.tostring(
+        top
+    )
+
+
+def writer_xml(writer, conses):
+    writer.reset()
+    for cons in conses:
+        writer.start_cons(cons.get("id"))
+        for tag, text in cons.get("fields", []):
+            writer.text_element(tag, text)
+        if "addr" in cons:
+            writer.start("cons_addr")
+            for tag, text in cons["addr"]:
+                writer.text_element(tag, text)
+            writer.end("cons_addr")
+        for cons_group_id in cons.get("groups", []):
+            writer.cons_group(cons_group_id)
+        for cons_field_id, value in cons.get("cons_fields", []):
+            writer.cons_field(cons_field_id, value)
+        writer.end_cons()
+    return writer.getvalue()
+
+
+CONSES = [
+    {
+        "fields": [("firstname", "José"), ("is_banned", "0"), ("source", "")],
+        "addr": [("addr1", TRICKY), ("country", "US")],
+        "groups": ["1", "30384"],
+        "cons_fields": [("3", "shopify")],
+    },
+    {
+        "fields": [("lastname", "O'Brien & Sons"), ("is_banned", "0")],
+        "addr": [("country", "US")],
+        "groups": ["1", "30384"],
+        "cons_fields": [("3", "")],
+    },
+    {"id": "4853942", "cons_fields": [("10", "24"), ("11", None), ("12", TRICKY)]},
+    {"id": TRICKY, "groups": [TRICKY], "cons_fields": [(TRICKY, TRICKY)]},
+]
+
+
+def test_matches_golden_file():
+    with open(GOLDEN_PATH, "rb") as f:
+        golden = f.read()
+
+    assert writer_xml(ConsXmlWriter(), CONSES) == golden
+    assert element_tree_xml(CONSES) == golden
+
+
+def test_matches_element_tree():
+    writer = ConsXmlWriter()
+    for i in range(len(CONSES) + 1):
+        # Also checks that reset() leaves nothing behind, and that cached
+        # fragments are reused correctly.
+        assert writer_xml(writer, CONSES[i:]) == element_tree_xml(CONSES[i:])
+        assert writer_xml(writer, CONSES[:i]) == element_tree_xml(CONSES[:i])
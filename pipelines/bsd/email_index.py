@@ -0,0 +1,110 @@
+# Local index of email addresses that already belong to BSD constituents.
+#
+# BsdExport used to ask BSD about every email it was about to upload, 100
+# emails per /cons/get_constituents_by_email call. BsdEmailIndex keeps the
+# emails it has seen in a SQLite file instead, refreshed incrementally from
+# bsd.cons_email in Civis (cons_email_id only ever grows, so each refresh
+# only reads rows added since the last one), plus whatever BSD tells us
+# along the way. Only emails missing from the index need to go to BSD.
+
+import sqlite3
+from typing import Iterable, Optional
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+
+class BsdEmailIndex:
+    """SQLite-backed set of normalized emails known to exist in BSD.
+
+    The index only ever learns that emails exist, never that they don't, so
+    a miss means "ask BSD", not "new". path may be ":memory:" for an index
+    that only lasts for the run.
+    """
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS bsd_emails (email TEXT PRIMARY KEY)"
+            " WITHOUT ROWID"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS bsd_email_index_state ("
+            " key TEXT PRIMARY KEY,"
+            " value INTEGER NOT NULL)"
+        )
+        self.conn.commit()
+
+    def __contains__(self, email):
+        return (
+            self.conn.execute(
+                "SELECT 1 FROM bsd_emails WHERE email = ?", (normalize_email(email),)
+            ).fetchone()
+            is not None
+        )
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM bsd_emails").fetchone()[0]
+
+    def known(self, emails: Iterable[str]) -> set:
+        """Returns the normalized emails among emails that are in the index."""
+        emails = {normalize_email(email) for email in emails}
+        # A temp table join beats one SELECT per email for large runs.
+        self.conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS lookup_emails (email TEXT PRIMARY KEY)"
+        )
+        self.conn.execute("DELETE FROM lookup_emails")
+        self.conn.executemany(
+            "INSERT INTO lookup_emails (email) VALUES (?)",
+            ((email,) for email in emails),
+        )
+        return {
+            email
+            for (email,) in self.conn.execute(
+                "SELECT email FROM lookup_emails JOIN bsd_emails USING (email)"
+            )
+        }
+
+    def add(self, emails: Iterable[str]):
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO bsd_emails (email) VALUES (?)",
+            ((normalize_email(email),) for email in emails),
+        )
+        self.conn.commit()
+
+    @property
+    def last_cons_email_id(self) -> Optional[int]:
+        """The highest bsd.cons_email.cons_email_id refreshed from, if any."""
+        row = self.conn.execute(
+            "SELECT value FROM bsd_email_index_state WHERE key = 'last_cons_email_id'"
+        ).fetchone()
+        return row[0] if row else None
+
+    def add_cons_emails(self, cons_emails):
+        """Adds (cons_email_id, email) pairs from bsd.cons_email.
+
+        Records the highest cons_email_id seen, for the next refresh.
+        """
+        last_cons_email_id = self.last_cons_email_id
+        emails = []
+        for cons_email_id, email in cons_emails:
+            # Some cons_email rows have no email.
+            if isinstance(email, str) and email:
+                emails.append(email)
+            cons_email_id = int(cons_email_id)
+            if last_cons_email_id is None or cons_email_id > last_cons_email_id:
+                last_cons_email_id = cons_email_id
+
+        self.add(emails)
+        if last_cons_email_id is not None:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO bsd_email_index_state (key, value)"
+                " VALUES ('last_cons_email_id', ?)",
+                (last_cons_email_id,),
+            )
+            self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
@@ -0,0 +1,39 @@
+from email_index import BsdEmailIndex
+
+
+def test_known_emails(tmp_path):
+    path = str(tmp_path / "bsd_emails.sqlite")
+    index = BsdEmailIndex(path)
+    index.add([" Warren@Example.com", "liz@example.com"])
+
+    assert "warren@example.com" in index
+    assert "WARREN@example.com " in index
+    assert "new@example.com" not in index
+    assert index.known(["Liz@example.com", "new@example.com"]) == {"liz@example.com"}
+    index.close()
+
+    # Persisted across runs.
+    index = BsdEmailIndex(path)
+    assert len(index) == 2
+    assert "liz@example.com" in index
+
+
+def test_incremental_refresh_from_cons_email(tmp_path):
+    path = str(tmp_path / "bsd_emails.sqlite")
+    index = BsdEmailIndex(path)
+    assert index.last_cons_email_id is None
+
+    index.add_cons_emails([(3, "a@example.com"), (7, "b@example.com"), (5, None)])
+    assert index.last_cons_email_id == 7
+    index.close()
+
+    index = BsdEmailIndex(path)
+    index.add_cons_emails([(8, "c@example.com")])
+    assert index.last_cons_email_id == 8
+    index.add_cons_emails([])
+    assert index.last_cons_email_id == 8
+    assert index.known(["a@example.com", "b@example.com", "c@example.com"]) == {
+        "a@example.com",
+        "b@example.com",
+        "c@example.com",
+    }
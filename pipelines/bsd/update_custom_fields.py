@@ -1,10 +1,16 @@
 import time
-import xml.etree.ElementTree
 
 from bsdapi.BsdApi import Factory as BsdApiFactory
 import pandas as pd
 import civis
 
+from ew_common.sync_state import SyncState
+from .cons_xml import ConsXmlWriter
+from .upload_engine import DEFAULT_MAX_IN_FLIGHT, BsdUploadEngine
+
+SYNC_STATE_NAMESPACE = 'bsd_custom_fields'
+CONS_PER_BATCH = 100
+
 class BsdUpdateCustomFields:
     def __init__(
             self,
@@ -17,6 +23,8 @@ class BsdUpdateCustomFields:
             custom_field_bsd_ids,
             start,
             limit,
+            sync_state_path=None,
+            max_batches_in_flight=DEFAULT_MAX_IN_FLIGHT,
     ):
         self.database = database
         self.schema = schema
@@ -32,28 +40,69 @@ class BsdUpdateCustomFields:
         self.custom_fields = custom_fields
         self.custom_field_bsd_ids = custom_field_bsd_ids
         self.start = start
+        # Where we remember what we last pushed for each cons, so unchanged
+        # cons can be skipped. None pushes every row.
+        self.sync_state_path = sync_state_path
+        # Without sync state we don't wait around for the deferred results
+        # to finish, so a batch is only in flight while BSD accepts it. With
+        # it, we only remember cons as synced once their deferred result
+        # says the upsert succeeded, so failed upserts are retried next run.
+        self.upload_engine = BsdUploadEngine(
+            self.bsd_api,
+            max_in_flight=max_batches_in_flight,
+            wait_for_results=bool(sync_state_path),
+        )
+        self.cons_xml_writer = ConsXmlWriter()
         assert len(self.custom_fields) == len(self.custom_field_bsd_ids)
 
     def run(self):
         df = self.get_custom_fields_to_update()
+        sync_state = SyncState(self.sync_state_path, SYNC_STATE_NAMESPACE) if self.sync_state_path else None
+        print(f'Will iterate over {len(df)} rows.')
+        try:
+            self.upload_engine.upload(
+                self.batches(df, sync_state),
+                lambda rows, resp: self.batch_uploaded(rows, resp, sync_state),
+            )
+        finally:
+            if sync_state:
+                sync_state.close()
+        print('Done.')
+
+    # Yields (cons XML, rows) for batches of rows to upload.
+    def batches(self, df, sync_state=None):
         i = 0
+        unchanged = 0
         rows = []
-        print(f'Will iterate over {len(df)} rows.')
         for row in df.itertuples(index=False):
+            if sync_state and not sync_state.has_changed(row.cons_id, self.cons_field_values(row)):
+                unchanged += 1
+                continue
             rows.append(row)
             i += 1
-            if i % 100 == 0:
-                cons_xml = self.compose_cons_xml(rows)
-                self.update_cons(cons_xml)
+            if i % CONS_PER_BATCH == 0:
+                yield self.compose_cons_xml(rows), rows
                 rows = []
                 print(f'Row number {i} is {row}')
                 if self.limit and i >= self.limit:
                     print(f'Hit limit of {self.limit} cons')
                     break
         if rows:
-            cons_xml = self.compose_cons_xml(rows)
-            self.update_cons(cons_xml)
-        print('Done.')
+            yield self.compose_cons_xml(rows), rows
+        if sync_state:
+            print(f'Skipped {unchanged} cons whose custom fields have not changed.')
+
+    def batch_uploaded(self, rows, resp, sync_state=None):
+        # For sanity checking:
+        #print(f'Got response: {resp.http_status} {resp.body}')
+        if resp.http_status not in (200, 202):
+            print(f'Failed to upsert cons: {resp.http_status} {resp.body}')
+            return
+        # 202 is only final when we're not waiting for deferred results, and
+        # then we don't know the upsert worked.
+        if sync_state and resp.http_status == 200:
+            for row in rows:
+                sync_state.mark_synced(row.cons_id, self.cons_field_values(row))
 
     def prepare_query(self):
         query = f"SELECT * FROM {self.schema}.custom_fields_to_update_in_bsd"
@@ -70,37 +119,33 @@ class BsdUpdateCustomFields:
 
         return df
 
-    def update_cons(self, cons_xml):
-        # For sanity checking:
-        #print(f'update_cons({cons_xml})')
-
-        deferred_id = None
-        resp = self.bsd_api.cons_upsertConstituentData(cons_xml)
-
-        # We don't wait around for the deferred result to finish.
+    def cons_field_values(self, row):
+        """Returns the value to upload for each custom field, None if empty."""
+        values = []
+        for custom_field in self.custom_fields:
+            v = getattr(row, custom_field)
+            if v and not pd.isnull(v):
+                # All numbers come out as floats from the dataframe; if we
+                # take their str() representation as-is, we'll upload e.g.
+                # 24.0 for donation_num_gifts_wfp, which should be an
+                # integer. So we'll avoid uploading explicit decimals where
+                # the value is a whole number.
+                if isinstance(v, float) and abs(round(v) - v) < 0.000001:
+                    v = round(v)
+                values.append(str(v))
+            else:
+                values.append(None)
+        return values
 
     def compose_cons_xml(self, rows):
-        top = xml.etree.ElementTree.Element('api')
+        writer = self.cons_xml_writer
+        writer.reset()
         for row in rows:
-            cons = xml.etree.ElementTree.SubElement(top, 'cons', id=str(row.cons_id))
-            for custom_field, custom_field_bsd_id in zip(self.custom_fields, self.custom_field_bsd_ids):
-                cons_field = xml.etree.ElementTree.SubElement(cons, 'cons_field', id=str(custom_field_bsd_id))
-
-                v = getattr(row, custom_field)
-                if v and not pd.isnull(v):
-                    # All numbers come out as floats from the dataframe; if we
-                    # take their str() representation as-is, we'll upload e.g.
-                    # 24.0 for donation_num_gifts_wfp, which should be an
-                    # integer. So we'll avoid uploading explicit decimals where
-                    # the value is a whole number.
-                    if isinstance(v, float) and abs(round(v) - v) < 0.000001:
-                        v = round(v)
-                    xml.etree.ElementTree.SubElement(cons_field, 'value').text = str(v)
-                else:
-                    # If we set no 'value', BSD will set value to empty.
-                    pass
-
-
-        cons_xml = xml.etree.ElementTree.tostring(top)
+            writer.start_cons(str(row.cons_id))
+            values = self.cons_field_values(row)
+            for custom_field_bsd_id, v in zip(self.custom_field_bsd_ids, values):
+                # If we set no 'value', BSD will set value to empty.
+                writer.cons_field(str(custom_field_bsd_id), v)
+            writer.end_cons()
 
-        return b'<?xml version="1.0" encoding="utf-8"?>' + cons_xml
+        return writer.getvalue()
@@ -0,0 +1,128 @@
+# Pipelined uploads of constituent XML to BSD.
+#
+# cons_upsertConstituentData usually answers 202 with a deferred id, and
+# the actual result has to be fetched later with getDeferredResults. Rather
+# than waiting on each batch in turn, BsdUploadEngine keeps several batches
+# in flight at once and polls all outstanding deferred ids from a single
+# scheduler loop, sleeping once per round instead of once per request.
+
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Tuple
+
+DEFAULT_MAX_IN_FLIGHT = 4
+DEFAULT_POLL_INTERVAL_SECONDS = 1
+
+
+@dataclass
+class _Deferred:
+    deferred_id: str
+    context: Any
+    next_poll_at: float
+
+
+class BsdUploadEngine:
+    def __init__(
+        self,
+        bsd_api,
+        max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+        poll_interval_seconds=DEFAULT_POLL_INTERVAL_SECONDS,
+        wait_for_results=True,
+    ):
+        """
+        bsd_api: a bsdapi.BsdApi instance.
+        max_in_flight: how many batches may be uploading or awaiting their
+            deferred result at once.
+        wait_for_results: if False, a 202 response is final and its deferred
+            result is never fetched.
+        """
+        self.bsd_api = bsd_api
+        self.max_in_flight = max_in_flight
+        self.poll_interval_seconds = poll_interval_seconds
+        self.wait_for_results = wait_for_results
+
+    def upload(
+        self,
+        batches: Iterable[Tuple[bytes, Any]],
+        on_result: Callable[[Any, Any], None],
+    ):
+        """Uploads (cons_xml, context) batches, in parallel.
+
+        batches is consumed lazily, only as fast as there's room in flight.
+        on_result is called from this thread with each batch's context and
+        its final response, in completion order. Exceptions from BSD
+        requests propagate, after in-flight requests finish.
+        """
+        batches = iter(batches)
+        exhausted = False
+        # Futures of requests currently running, to the batch context, or
+        # for polls to the _Deferred being polled.
+        uploads = {}
+        polls = {}
+        # Batches waiting for their next poll.
+        deferreds = []
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            while True:
+                in_flight = len(uploads) + len(polls) + len(deferreds)
+                while not exhausted and in_flight < self.max_in_flight:
+                    try:
+                        cons_xml, context = next(batches)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    future = executor.submit(
+                        self.bsd_api.cons_upsertConstituentData, cons_xml
+                    )
+                    uploads[future] = context
+                    in_flight += 1
+
+                if not in_flight:
+                    return
+
+                now = time.monotonic()
+                due = [d for d in deferreds if d.next_poll_at <= now]
+                for deferred in due:
+                    deferreds.remove(deferred)
+                    future = executor.submit(
+                        self.bsd_api.getDeferredResults, deferred.deferred_id
+                    )
+                    polls[future] = deferred
+
+                timeout = None
+                if deferreds:
+                    next_poll_at = min(d.next_poll_at for d in deferreds)
+                    timeout = max(0, next_poll_at - time.monotonic())
+                if uploads or polls:
+                    done, _ = wait(
+                        list(uploads) + list(polls),
+                        timeout=timeout,
+                        return_when=FIRST_COMPLETED,
+                    )
+                else:
+                    time.sleep(timeout)
+                    done = []
+
+                for future in done:
+                    if future in uploads:
+                        context = uploads.pop(future)
+                        deferred_id = None
+                    else:
+                        deferred = polls.pop(future)
+                        context = deferred.context
+                        deferred_id = deferred.deferred_id
+                    resp = future.result()
+
+                    if resp.http_status == 202 and self.wait_for_results:
+                        if not deferred_id and resp.body:
+                            deferred_id = resp.body
+                        deferreds.append(
+                            _Deferred(
+                                deferred_id,
+                                context,
+                                time.monotonic() + self.poll_interval_seconds,
+                            )
+                        )
+                    else:
+                        on_result(context, resp)
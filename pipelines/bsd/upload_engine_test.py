@@ -0,0 +1,73 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from upload_engine import BsdUploadEngine
+
+
+class FakeBsdApi:
+    """Answers every upsert with a deferred id that's ready after two polls."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.polls = {}
+        self.max_concurrent = 0
+        self.concurrent = 0
+
+    def _request(self, f):
+        with self.lock:
+            self.concurrent += 1
+            self.max_concurrent = max(self.max_concurrent, self.concurrent)
+        time.sleep(0.01)
+        try:
+            return f()
+        finally:
+            with self.lock:
+                self.concurrent -= 1
+
+    def cons_upsertConstituentData(self, cons_xml):
+        return self._request(
+            lambda: SimpleNamespace(http_status=202, body=f"deferred-{cons_xml}")
+        )
+
+    def getDeferredResults(self, deferred_id):
+        def poll():
+            with self.lock:
+                self.polls[deferred_id] = self.polls.get(deferred_id, 0) + 1
+                if self.polls[deferred_id] < 2:
+                    return SimpleNamespace(http_status=202, body="")
+            return SimpleNamespace(http_status=200, body=f"result of {deferred_id}")
+
+        return self._request(poll)
+
+
+def test_upload_pipelines_batches_and_deferred_polls():
+    api = FakeBsdApi()
+    engine = BsdUploadEngine(api, max_in_flight=4, poll_interval_seconds=0.05)
+    results = {}
+
+    started = time.monotonic()
+    engine.upload(
+        ((str(i), i) for i in range(8)),
+        lambda context, resp: results.__setitem__(context, resp.body),
+    )
+    elapsed = time.monotonic() - started
+
+    assert results == {i: f"result of deferred-{i}" for i in range(8)}
+    assert all(polls == 2 for polls in api.polls.values())
+    assert api.max_concurrent == 4
+    # Sequentially, 8 batches * 2 polls * 0.05s would take at least 0.8s.
+    assert elapsed < 0.6
+
+
+def test_upload_without_waiting_for_results():
+    api = FakeBsdApi()
+    engine = BsdUploadEngine(api, wait_for_results=False)
+    statuses = []
+
+    engine.upload(
+        [(b"a", "a"), (b"b", "b")], lambda c, resp: statuses.append(resp.http_status)
+    )
+
+    assert statuses == [202, 202]
+    assert api.polls == {}
@@ -1,19 +1,36 @@
 import datetime
 import os
 import time
-import xml.etree.ElementTree
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 import civis
 import pandas as pd
 import xmltodict
 from bsdapi.BsdApi import Factory as BsdApiFactory
-from nameparser import HumanName
 from email_validator import validate_email, EmailNotValidError
 
+from ew_common.dataframes import non_blank_strings
+from ew_common.input_validation import normalize_names_batch
+from ew_common.domain_deliverability import DomainDeliverabilityCache
+from .cons_xml import ConsXmlWriter
+from .email_index import BsdEmailIndex, normalize_email
+from .upload_engine import DEFAULT_MAX_IN_FLIGHT, BsdUploadEngine
+
 RESUBSCRIBE_FORM_ID = 1059
 RESUBSCRIBE_FORM_EMAIL_FIELD_ID = 16362
 
+# New cons per cons_upsertConstituentData request.
+DEFAULT_CONS_PER_BATCH = 100
+
+# Emails per /cons/get_constituents_by_email request. We have to cram all
+# the emails into the URL, so BSD errors on the URL being too long if
+# there are many more.
+EMAILS_PER_EXISTENCE_REQUEST = 100
+
+# Rows whose email domains are resolved at once, ahead of validating them.
+DOMAIN_RESOLVE_WINDOW_ROWS = 1000
+
 with open(os.path.join(os.path.dirname(__file__), "export.sql")) as f:
     GET_EMAILS_SQL = f.read()
 
@@ -55,11 +72,27 @@ class BsdExport:
         custom_field_id_email_type,
         limit_per_type,
         dry_run,
+        cons_per_batch=DEFAULT_CONS_PER_BATCH,
+        max_batches_in_flight=DEFAULT_MAX_IN_FLIGHT,
+        email_index_path=None,
+        domain_deliverability_path=None,
     ):
         self.database = database
         self.bsd_api = BsdApiFactory().create(
             api_id=bsd_api_id, secret=bsd_secret, host=bsd_host, port=80, securePort=443
         )
+        self.upload_engine = BsdUploadEngine(
+            self.bsd_api, max_in_flight=max_batches_in_flight
+        )
+        self.cons_per_batch = cons_per_batch
+        self.cons_xml_writer = ConsXmlWriter()
+        self.max_batches_in_flight = max_batches_in_flight
+
+        # Emails known to exist in BSD. With a path, the index persists
+        # across runs and is refreshed from bsd.cons_email; without one, it
+        # only remembers what BSD told us during this run.
+        self.email_index_path = email_index_path
+        self.email_index = BsdEmailIndex(email_index_path or ":memory:")
 
         # To test that we uploaded a past constituent as intended : )
         # resp = self.bsd_api.cons_getConstituentsById([4853942], bundles=['cons_addr'])
@@ -75,13 +108,20 @@ class BsdExport:
 
         self.detailed_logs = []
         self.rejected_emails = []
-        self.domain_deliverability_cache = {}
+        # Whether email domains can receive mail. With a path, verdicts are
+        # kept across runs (and can be shared with other jobs).
+        self.domain_deliverability = DomainDeliverabilityCache(
+            domain_deliverability_path or ":memory:"
+        )
 
         self.dry_run = dry_run
 
     # Computes emails that are in various tables in Civis but not in any BSD
     # constituent. Creates BSD constituents for such email addresses.
     def sync_emails(self):
+        if self.email_index_path:
+            self.refresh_email_index()
+
         emails = self.get_emails()
         counts_by_type = defaultdict(int)
         for profile in emails.itertuples():
@@ -108,6 +148,9 @@ class BsdExport:
             print("Caught an exception; flushing logs and then re-throwing")
             self.insert_detailed_logs()
             raise e
+        finally:
+            self.email_index.close()
+            self.domain_deliverability.close()
 
         self.insert_detailed_logs()
         self.update_rejected_emails_table()
@@ -262,27 +305,86 @@ class BsdExport:
     #   [ext_id, first_name, last_name, postal_code, phone_number, email]
     # Creates corresponding BSD constituents.
     def export_emails(self, emails, email_type, email_type_cons_group_id, limit):
-        i = 0
-        num_new_cons = 0
-        num_resub_cons = 0
-        num_rejected = 0
+        counts = defaultdict(int)
+        present_emails = emails["email"][emails["email"].notna()]
 
         # Especially for dry runs, but also to verify BSD's behavior during live
         # runs, we first query for whether each emails exists in BSD and log that
         # along with the subscription result.
-        email_existence = self.get_email_existence(
-            [
-                e.email
-                for e in emails.itertuples()
-                if e.email is not None and not pd.isnull(e.email)
-            ]
+        email_existence = self.get_email_existence(list(present_emails))
+
+        def cons_uploaded(batch, resp):
+            results = self.parse_cons_response(resp, [email for email, _, _ in batch])
+            for (email, _, enable_log), (was_new, was_error, response_snippet) in zip(
+                batch, results
+            ):
+                if enable_log:
+                    print(f"Got response for {email.email}: {response_snippet}")
+                if was_new and not was_error:
+                    counts["new"] += 1
+                    self.email_index.add([email.email])
+                self.detailed_logs.append(
+                    self.detailed_log_row(
+                        email,
+                        False,
+                        was_new,
+                        email_existence,
+                        response_snippet,
+                        was_error,
+                    )
+                )
+
+        self.upload_engine.upload(
+            self.cons_batches(
+                emails,
+                email_type,
+                email_type_cons_group_id,
+                limit,
+                email_existence,
+                counts,
+            ),
+            cons_uploaded,
         )
 
-        for email in emails.itertuples():
+        print(
+            f"Done with {email_type}. Created {counts['new']} new cons and resubscribed {counts['resub']} cons (out of {len(emails)} emails). Rejected {counts['rejected']} emails."
+        )
+        return counts["new"] + counts["resub"]
+
+    # Yields (cons XML, batch) for batches of new cons to create, where batch
+    # is a list of (email, cons, enable_log) and cons is email's row of
+    # cons_fields. Handles rejected emails, dry runs and resubscribes along
+    # the way.
+    def cons_batches(
+        self,
+        emails,
+        email_type,
+        email_type_cons_group_id,
+        limit,
+        email_existence,
+        counts,
+    ):
+        i = 0
+        batch = []
+        resolved_through = 0
+        conses = self.cons_fields(emails)
+        rows = zip(emails.itertuples(), conses.itertuples())
+        for j, (email, cons) in enumerate(rows):
             if i >= limit:
                 print(f"Hit limit of {limit} emails")
                 break
 
+            if j >= resolved_through:
+                # Look up the domains of the next rows all at once, rather
+                # than one at a time as validate_email comes across them.
+                # Windows are resolved as we reach them, so a limited run
+                # doesn't resolve every domain in the input. (The limit
+                # counts accepted rows, so it can't size the window:
+                # rejected rows would shrink it to a row or two.)
+                window = min(DOMAIN_RESOLVE_WINDOW_ROWS, len(emails) - j)
+                self.resolve_domains(emails["email"].iloc[j : j + window])
+                resolved_through = j + window
+
             if i % 100 == 0:
                 enable_log = True
                 print(f"Exporting type {email_type}: {i} / {len(emails)}")
@@ -295,7 +397,7 @@ class BsdExport:
                 if enable_log:
                     print(f"Rejecting email: {email.email}")
 
-                num_rejected += 1
+                counts["rejected"] += 1
                 self.rejected_emails.append(
                     [
                         email.email,
@@ -318,8 +420,7 @@ class BsdExport:
                 )
                 continue
 
-            response_snippet = ""
-            was_error = False
+            i += 1
             if self.dry_run:
                 was_new = not email_existence[email.email.strip().lower()]
                 if enable_log:
@@ -333,50 +434,63 @@ class BsdExport:
                 was_new = None
 
                 # form_xml = self.compose_resubscribe_form_xml(email)
-                # num_resub_cons += self.resubscribe_cons(form_xml, enable_log)
+                # counts["resub"] += self.resubscribe_cons(form_xml, enable_log)
             else:
-                cons_xml = self.compose_cons_xml(
-                    email, email_type, email_type_cons_group_id
-                )
-                was_new, was_error, response_snippet = self.create_cons(
-                    cons_xml, enable_log
-                )
-
-                if was_new and not was_error:
-                    num_new_cons += 1
+                # Logged once BSD has created it.
+                batch.append((email, cons, enable_log))
+                if len(batch) >= self.cons_per_batch:
+                    yield self.compose_cons_batch_xml(
+                        [cons for _, cons, _ in batch],
+                        email_type,
+                        email_type_cons_group_id,
+                    ), batch
+                    batch = []
+                continue
 
             self.detailed_logs.append(
-                [
-                    datetime.datetime.now(tz=datetime.timezone.utc),
-                    is_resubscribe,
-                    was_new,
-                    email.email,
-                    email.first_name,
-                    email.last_name,
-                    email.postal_code,
-                    email.addr1,
-                    email.addr2,
-                    email.city,
-                    email.state_cd,
-                    email.phone_number,
-                    email.ext_type,
-                    email.ext_id,
-                    email.source,
-                    email.subsource,
-                    epoch_to_datetime(email.resubscribeable_action_time_epoch),
-                    epoch_to_datetime(email.unsub_epoch),
-                    self.dry_run,
-                    email_existence[email.email.strip().lower()],
-                    response_snippet,
-                    was_error,
-                ]
+                self.detailed_log_row(
+                    email, is_resubscribe, was_new, email_existence, "", False
+                )
             )
 
-            i += 1
-        print(
-            f"Done with {email_type}. Created {num_new_cons} new cons and resubscribed {num_resub_cons} cons (out of {len(emails)} emails). Rejected {num_rejected} emails."
-        )
-        return num_new_cons + num_resub_cons
+        if batch:
+            yield self.compose_cons_batch_xml(
+                [cons for _, cons, _ in batch], email_type, email_type_cons_group_id
+            ), batch
+
+    def detailed_log_row(
+        self,
+        email,
+        is_resubscribe,
+        was_new,
+        email_existence,
+        response_snippet,
+        was_error,
+    ):
+        return [
+            datetime.datetime.now(tz=datetime.timezone.utc),
+            is_resubscribe,
+            was_new,
+            email.email,
+            email.first_name,
+            email.last_name,
+            email.postal_code,
+            email.addr1,
+            email.addr2,
+            email.city,
+            email.state_cd,
+            email.phone_number,
+            email.ext_type,
+            email.ext_id,
+            email.source,
+            email.subsource,
+            epoch_to_datetime(email.resubscribeable_action_time_epoch),
+            epoch_to_datetime(email.unsub_epoch),
+            self.dry_run,
+            email_existence[email.email.strip().lower()],
+            response_snippet,
+            was_error,
+        ]
 
     # Returns emails that are in various tables in Civis but not in any BSD
     # constituent.
@@ -392,125 +506,108 @@ class BsdExport:
 
         return df
 
-    # Returns XML string according to this spec:
-    #   https://secure.bluestatedigital.com/page/api/doc#-------------Incoming-XML-Constituent-Records---------
-    #
-    # Adds to appropriate cons groups.
-    def compose_cons_xml(self, email, email_type, email_type_cons_group_id):
-        top = xml.etree.ElementTree.Element("api")
-        cons = xml.etree.ElementTree.SubElement(top, "cons")
-
-        if email.first_name and not pd.isnull(email.first_name):
-            first_name = str(email.first_name)
-        else:
-            first_name = ""
-        if email.last_name and not pd.isnull(email.last_name):
-            last_name = str(email.last_name)
-        else:
-            last_name = ""
-        if first_name or last_name:
-            first_name, last_name = self.normalize_name(first_name, last_name)
-
-        if first_name:
-            xml.etree.ElementTree.SubElement(cons, "firstname").text = first_name
-        if last_name:
-            xml.etree.ElementTree.SubElement(cons, "lastname").text = last_name
-        xml.etree.ElementTree.SubElement(cons, "is_banned").text = "0"
-        if email.source and not pd.isnull(email.source):
-            xml.etree.ElementTree.SubElement(cons, "source").text = str(email.source)
-        if email.subsource and not pd.isnull(email.subsource):
-            xml.etree.ElementTree.SubElement(cons, "subsource").text = str(
-                email.subsource
-            )
-
-        cons_addr = xml.etree.ElementTree.SubElement(cons, "cons_addr")
-        if email.addr1 and not pd.isnull(email.addr1):
-            xml.etree.ElementTree.SubElement(cons_addr, "addr1").text = str(email.addr1)
-        if email.addr2 and not pd.isnull(email.addr2):
-            xml.etree.ElementTree.SubElement(cons_addr, "addr2").text = str(email.addr2)
-        if email.city and not pd.isnull(email.city):
-            xml.etree.ElementTree.SubElement(cons_addr, "city").text = str(email.city)
-        if email.state_cd and not pd.isnull(email.state_cd):
-            xml.etree.ElementTree.SubElement(cons_addr, "state_cd").text = str(
-                email.state_cd
-            )
-        if email.postal_code and not pd.isnull(email.postal_code):
-            xml.etree.ElementTree.SubElement(cons_addr, "zip").text = str(
-                email.postal_code
-            )
-        xml.etree.ElementTree.SubElement(cons_addr, "country").text = "US"
+    # Returns a DataFrame, with the same index as emails, of the values for
+    # each email's cons: strings, or None where the cons shouldn't have that
+    # field. Cleaning them all up front leaves write_cons only the writing.
+    def cons_fields(self, emails):
+        first_names = non_blank_strings(emails["first_name"])
+        last_names = non_blank_strings(emails["last_name"])
 
-        if email.phone_number and not pd.isnull(email.phone_number):
-            primary_cons_phone = xml.etree.ElementTree.SubElement(cons, "cons_phone")
-            xml.etree.ElementTree.SubElement(primary_cons_phone, "phone").text = str(
-                email.phone_number
-            )
-            xml.etree.ElementTree.SubElement(
-                primary_cons_phone, "phone_type"
-            ).text = self.PHONE_TYPE
-            xml.etree.ElementTree.SubElement(
-                primary_cons_phone, "is_subscribed"
-            ).text = self.PHONE_IS_SUBSCRIBED
-            xml.etree.ElementTree.SubElement(
-                primary_cons_phone, "is_primary"
-            ).text = "1"
-
-        primary_cons_email = xml.etree.ElementTree.SubElement(cons, "cons_email")
-        xml.etree.ElementTree.SubElement(primary_cons_email, "email").text = str(
-            email.email
+        names = normalize_names_batch(
+            zip(first_names.fillna(""), last_names.fillna(""))
         )
-        xml.etree.ElementTree.SubElement(
-            primary_cons_email, "email_type"
-        ).text = self.CONS_EMAIL_EMAIL_TYPE
-        xml.etree.ElementTree.SubElement(
-            primary_cons_email, "is_subscribed"
-        ).text = self.EMAIL_IS_SUBSCRIBED
-        xml.etree.ElementTree.SubElement(primary_cons_email, "is_primary").text = "1"
-
-        xml.etree.ElementTree.SubElement(
-            cons, "cons_group", {"id": self.cons_group_email}
-        )
-        xml.etree.ElementTree.SubElement(
-            cons, "cons_group", {"id": self.cons_group_added_via_civis_sync}
-        )
-        xml.etree.ElementTree.SubElement(
-            cons, "cons_group", {"id": email_type_cons_group_id}
+        normalized_first_names = [first_name or None for first_name, _ in names]
+        normalized_last_names = [last_name or None for _, last_name in names]
+
+        return pd.DataFrame(
+            {
+                "firstname": normalized_first_names,
+                "lastname": normalized_last_names,
+                "source": non_blank_strings(emails["source"]),
+                "subsource": non_blank_strings(emails["subsource"]),
+                "addr1": non_blank_strings(emails["addr1"]),
+                "addr2": non_blank_strings(emails["addr2"]),
+                "city": non_blank_strings(emails["city"]),
+                "state_cd": non_blank_strings(emails["state_cd"]),
+                "zip": non_blank_strings(emails["postal_code"]),
+                "phone": non_blank_strings(emails["phone_number"]),
+                "email": emails["email"].astype(str).astype(object),
+            },
+            index=emails.index,
+            dtype=object,
         )
 
-        cons_field = xml.etree.ElementTree.SubElement(
-            cons, "cons_field", {"id": self.custom_field_id_email_type}
+    # Returns XML string according to this spec:
+    #   https://secure.bluestatedigital.com/page/api/doc#-------------Incoming-XML-Constituent-Records---------
+    #
+    # Adds to appropriate cons groups. cons is a row of cons_fields.
+    def compose_cons_xml(self, cons, email_type, email_type_cons_group_id):
+        return self.compose_cons_batch_xml(
+            [cons], email_type, email_type_cons_group_id
         )
-        xml.etree.ElementTree.SubElement(cons_field, "value").text = email_type
-
-        cons_xml = xml.etree.ElementTree.tostring(top)
-
-        return b'<?xml version="1.0" encoding="utf-8"?>' + cons_xml
-
-    def create_cons(self, cons_xml, enable_log):
-        if enable_log:
-            print(f"create_cons({cons_xml})")
-
-        deferred_id = None
-        resp = self.bsd_api.cons_upsertConstituentData(cons_xml)
-
-        if enable_log:
-            print(f"Got response: {resp.http_status} {resp.body}")
-
-        while resp.http_status == 202:
-            if not deferred_id and resp.body:
-                deferred_id = resp.body
-
-            if enable_log:
-                print(f"Making followup request with deferred id: {deferred_id}")
-
-            time.sleep(1)
-            resp = self.bsd_api.getDeferredResults(deferred_id)
-
-        if enable_log:
-            print(f"Got response: {resp.http_status} {resp.body}")
-
-        d = xmltodict.parse(resp.body, attr_prefix="", cdata_key="value")
 
+    # Like compose_cons_xml, but with a <cons> for each of conses.
+    def compose_cons_batch_xml(self, conses, email_type, email_type_cons_group_id):
+        writer = self.cons_xml_writer
+        writer.reset()
+        for cons in conses:
+            self.write_cons(writer, cons, email_type, email_type_cons_group_id)
+
+        return writer.getvalue()
+
+    def write_cons(self, writer, cons, email_type, email_type_cons_group_id):
+        writer.start_cons()
+
+        if cons.firstname:
+            writer.text_element("firstname", cons.firstname)
+        if cons.lastname:
+            writer.text_element("lastname", cons.lastname)
+        writer.text_element("is_banned", "0")
+        if cons.source:
+            writer.text_element("source", cons.source)
+        if cons.subsource:
+            writer.text_element("subsource", cons.subsource)
+
+        writer.start("cons_addr")
+        if cons.addr1:
+            writer.text_element("addr1", cons.addr1)
+        if cons.addr2:
+            writer.text_element("addr2", cons.addr2)
+        if cons.city:
+            writer.text_element("city", cons.city)
+        if cons.state_cd:
+            writer.text_element("state_cd", cons.state_cd)
+        if cons.zip:
+            writer.text_element("zip", cons.zip)
+        writer.text_element("country", "US")
+        writer.end("cons_addr")
+
+        if cons.phone:
+            writer.start("cons_phone")
+            writer.text_element("phone", cons.phone)
+            writer.text_element("phone_type", self.PHONE_TYPE)
+            writer.text_element("is_subscribed", self.PHONE_IS_SUBSCRIBED)
+            writer.text_element("is_primary", "1")
+            writer.end("cons_phone")
+
+        writer.start("cons_email")
+        writer.text_element("email", cons.email)
+        writer.text_element("email_type", self.CONS_EMAIL_EMAIL_TYPE)
+        writer.text_element("is_subscribed", self.EMAIL_IS_SUBSCRIBED)
+        writer.text_element("is_primary", "1")
+        writer.end("cons_email")
+
+        writer.cons_group(self.cons_group_email)
+        writer.cons_group(self.cons_group_added_via_civis_sync)
+        writer.cons_group(email_type_cons_group_id)
+
+        writer.cons_field(self.custom_field_id_email_type, email_type)
+
+        writer.end_cons()
+
+    # Given the final response to a cons_upsertConstituentData request for
+    # emails, returns a (was_new, was_error, response_snippet) for each email.
+    def parse_cons_response(self, resp, emails):
         # Possible responses:
         #
         # Invalid email domain:
@@ -538,18 +635,75 @@ class BsdExport:
         #     <guid>pXT0UVNw52hdeTw1h9AFsjA</guid>
         #   </cons>
         # </api>
-
-        was_new = d["api"].get("cons", {}).get("is_new") == "1"
-        was_error = d["api"].get("errors") != None
-        body_snippet = resp.body[:500]
-        return (was_new, was_error, body_snippet)
-
-    def normalize_name(self, first_name, last_name):
-        name = HumanName()
-        name.first = first_name
-        name.last = last_name
-        name.capitalize()
-        return (name.first, name.last)
+        #
+        # With several cons per request, BSD answers with a <cons> for each
+        # cons it created or updated and an <error> for each one it
+        # rejected. We match <cons> to emails by their <cons_email>, and
+        # only fall back on the order we sent them in when every result is
+        # accounted for; otherwise one missing result would shift the rest
+        # onto the wrong emails, so the whole batch is marked failed.
+        d = xmltodict.parse(resp.body)
+        api_res = d.get("api") or {}
+        errors = (api_res.get("errors") or {}).get("error", [])
+        if not isinstance(errors, list):
+            errors = [errors]
+        cons_records = api_res.get("cons", [])
+        if not isinstance(cons_records, list):
+            cons_records = [cons_records]
+
+        errors_by_email = {}
+        for error in errors:
+            error_id = error.get("id")
+            if isinstance(error_id, dict) and error_id.get("@type") == "email":
+                errors_by_email[error_id.get("#text", "").strip().lower()] = error
+
+        cons_by_email = {}
+        unkeyed_cons_records = []
+        for cons_record in cons_records:
+            cons_email = self.cons_record_email(cons_record)
+            if cons_email:
+                cons_by_email[cons_email] = cons_record
+            else:
+                unkeyed_cons_records.append(cons_record)
+
+        if len(errors_by_email) != len(errors) or (
+            len(cons_records) + len(errors) != len(emails)
+        ):
+            print(
+                f"Got {len(cons_records)} cons and {len(errors)} errors for "
+                f"{len(emails)} emails; marking the whole batch as failed"
+            )
+            return [(False, True, resp.body[:500]) for _ in emails]
+
+        results = []
+        unkeyed_cons_records = iter(unkeyed_cons_records)
+        for email in emails:
+            normalized_email = str(email.email).strip().lower()
+            error = errors_by_email.get(normalized_email)
+            if error:
+                snippet = xmltodict.unparse({"error": error}, full_document=False)
+                results.append((False, True, snippet[:500]))
+                continue
+            cons_record = cons_by_email.get(normalized_email)
+            if cons_record is None:
+                cons_record = next(unkeyed_cons_records, None)
+            if cons_record is None:
+                results.append((False, True, resp.body[:500]))
+                continue
+            snippet = xmltodict.unparse({"cons": cons_record}, full_document=False)
+            results.append((cons_record.get("@is_new") == "1", False, snippet[:500]))
+        return results
+
+    # Returns the lowercased email of a <cons> in a BSD response, if it has
+    # a <cons_email>.
+    def cons_record_email(self, cons_record):
+        cons_emails = cons_record.get("cons_email") or []
+        if not isinstance(cons_emails, list):
+            cons_emails = [cons_emails]
+        for cons_email in cons_emails:
+            if isinstance(cons_email, dict) and cons_email.get("email"):
+                return str(cons_email["email"]).strip().lower()
+        return None
 
     def parse_email_types_and_cons_group_ids_arg(
         self, email_types_and_cons_group_ids_arg
@@ -564,80 +718,115 @@ class BsdExport:
         pieces = email_types_and_cons_group_ids_arg.split(",")
         return zip(pieces[0::2], pieces[1::2])
 
+    # Reads bsd.cons_email rows added since the last refresh into the email
+    # index.
+    def refresh_email_index(self):
+        last_cons_email_id = self.email_index.last_cons_email_id
+        sql = "SELECT cons_email_id, TRIM(LOWER(email)) AS email FROM bsd.cons_email"
+        if last_cons_email_id is not None:
+            sql += f" WHERE cons_email_id > {int(last_cons_email_id)}"
+
+        try:
+            df = civis.io.read_civis_sql(sql, self.database, use_pandas=True)
+        except civis.base.EmptyResultError:
+            df = pd.DataFrame(columns=["cons_email_id", "email"])
+
+        self.email_index.add_cons_emails(zip(df["cons_email_id"], df["email"]))
+        print(
+            f"Refreshed email index with {len(df)} cons_email rows after id {last_cons_email_id}; {len(self.email_index)} emails known"
+        )
+
+    # Returns a defaultdict from normalized email to whether a BSD cons has
+    # it. Emails not in the email index are checked with BSD, several
+    # requests at a time, and those found are added to the index.
     def get_email_existence(self, emails):
         existence = defaultdict(bool)
 
-        # We have to cram all the emails into the URL, so we break it
-        # into chunks or BSD will error on the URL being to long
-        for email_chunk in in_groups_of(100, emails):
-            # The BSD python API doesn't provide access to
-            # get_constituents_by_email, so we use _generateRequest
-            # to manually generate the URL for the request (so we
-            # can use the python API's hmac code)
-            bsd_url = self.bsd_api._generateRequest(
-                "/cons/get_constituents_by_email",
-                {
-                    "emails": ",".join(email_chunk),
-                    "deferred": "1",
-                    "bundles": "cons_email",
-                },
-            )
-            resp = self.bsd_api._makeGETRequest(bsd_url)
+        known = self.email_index.known(emails)
+        for email in known:
+            existence[email] = True
 
-            deferred_id = None
-            while resp.http_status == 202:
-                if not deferred_id and resp.body:
-                    deferred_id = resp.body
+        unknown = sorted({normalize_email(email) for email in emails} - known)
+        print(
+            f"{len(known)} emails are in the email index; checking {len(unknown)} with BSD"
+        )
+        with ThreadPoolExecutor(max_workers=self.max_batches_in_flight) as executor:
+            for existing_emails in executor.map(
+                self.get_existing_emails,
+                in_groups_of(EMAILS_PER_EXISTENCE_REQUEST, unknown),
+            ):
+                self.email_index.add(existing_emails)
+                for email in existing_emails:
+                    existence[email] = True
 
-                time.sleep(1)
-                resp = self.bsd_api.getDeferredResults(deferred_id)
+        return existence
 
-            d = xmltodict.parse(resp.body, attr_prefix="", cdata_key="value")
+    # Returns the normalized emails among email_chunk that belong to BSD
+    # cons.
+    def get_existing_emails(self, email_chunk):
+        # The BSD python API doesn't provide access to
+        # get_constituents_by_email, so we use _generateRequest
+        # to manually generate the URL for the request (so we
+        # can use the python API's hmac code)
+        bsd_url = self.bsd_api._generateRequest(
+            "/cons/get_constituents_by_email",
+            {"emails": ",".join(email_chunk), "deferred": "1", "bundles": "cons_email"},
+        )
+        resp = self.bsd_api._makeGETRequest(bsd_url)
 
-            api_res = d["api"]
-            if api_res is None:
-                # No emails in this batch
-                continue
+        deferred_id = None
+        while resp.http_status == 202:
+            if not deferred_id and resp.body:
+                deferred_id = resp.body
+
+            time.sleep(1)
+            resp = self.bsd_api.getDeferredResults(deferred_id)
 
-            cons_records = api_res.get("cons", [])
-            if not isinstance(cons_records, list):
-                cons_records = [cons_records]
+        d = xmltodict.parse(resp.body, attr_prefix="", cdata_key="value")
 
-            for cons_record in cons_records:
-                cons_emails = cons_record.get("cons_email", [])
-                if not isinstance(cons_emails, list):
-                    cons_emails = [cons_emails]
+        api_res = d["api"]
+        if api_res is None:
+            # No emails in this batch
+            return []
 
-                for cons_email in cons_emails:
-                    existence[cons_email["email"].strip().lower()] = True
+        cons_records = api_res.get("cons", [])
+        if not isinstance(cons_records, list):
+            cons_records = [cons_records]
 
-        return existence
+        existing_emails = []
+        for cons_record in cons_records:
+            cons_emails = cons_record.get("cons_email", [])
+            if not isinstance(cons_emails, list):
+                cons_emails = [cons_emails]
 
-    def validate_email(self, email):
+            for cons_email in cons_emails:
+                existing_emails.append(normalize_email(cons_email["email"]))
+
+        return existing_emails
+
+    # Looks up the deliverability of the domains of emails concurrently.
+    def resolve_domains(self, emails):
+        domains = {self.email_domain(email) for email in emails.dropna().unique()}
+        domains.discard(None)
+        self.domain_deliverability.resolve_all(domains)
+
+    # Returns email's domain, or None if email isn't syntactically valid.
+    def email_domain(self, email):
         try:
             metadata = validate_email(email, check_deliverability=False)
         except EmailNotValidError:
-            return False
-
-        domain = metadata["domain"]
+            return None
 
-        if domain not in self.domain_deliverability_cache:
-            # Check domain deliverability
-            try:
-                metadata = validate_email(email, check_deliverability=True)
+        return metadata["domain"]
 
-                # We *could* also reject domains that are deliverable but have an A
-                # record rather than an MX record. When we manually reviewed these, we
-                # found that many were undeliverable domains but a fair number were also
-                # legitimate domains for small businesses that just use A record for their
-                # mail config.
-                #
-                # if metadata.get("mx-fallback"):
-                #     print(f"Rejecting email {email} due to valid domain but missing MX")
-                #     self.domain_deliverability_cache[domain] = False
-
-                self.domain_deliverability_cache[domain] = True
-            except EmailNotValidError:
-                self.domain_deliverability_cache[domain] = False
+    def validate_email(self, email):
+        domain = self.email_domain(email)
+        if domain is None:
+            return False
 
-        return self.domain_deliverability_cache[domain]
+        # We *could* also reject domains that are deliverable but have an A
+        # record rather than an MX record. When we manually reviewed these, we
+        # found that many were undeliverable domains but a fair number were also
+        # legitimate domains for small businesses that just use A record for their
+        # mail config.
+        return self.domain_deliverability.is_deliverable(domain)
@@ -1,8 +1,12 @@
+import os
+import threading
 import time
-from typing import List, Dict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List
 
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 
 from mobilecommons.utils import (
     is_error_response,
@@ -14,15 +18,120 @@ from shopify.client import ShopifyAPI
 API_BASE_URL = 'https://secure.mcommons.com/api/'
 DataBatch = Dict[str, pd.DataFrame]
 
+# Defaults for bulk_create_or_update_profiles. Mobile Commons starts
+# answering 429 somewhere above ~10 requests/second per account.
+DEFAULT_CONCURRENCY = 8
+DEFAULT_REQUESTS_PER_SECOND = 8
+# How long to pause everyone after a 429 without a Retry-After header.
+DEFAULT_RATE_LIMIT_WAIT_SECONDS = 2
+PROFILE_UPDATE_RETRY_LIMIT = 5
+
+# Errors that retrying won't fix, so the row counts as done. Not textable
+# is mostly landline numbers, we don't need to see that error message.
+PERMANENT_PROFILE_ERRORS = ('Phone is not textable',)
+
 
 class MobileCommonsAPIException(Exception):
     pass
 
 
+class MobileCommonsRateLimitException(MobileCommonsAPIException):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Thread-safe token bucket shared by all upsert workers.
+
+    Allows rate requests per second on average, and bursts of up to burst.
+    On a 429 Mobile Commons wants us to back off entirely for a while, so
+    backoff() stops everyone until then and halves the rate; each
+    successful request after that creeps the rate back up to its maximum.
+    """
+
+    def __init__(self, rate: float, burst: int = None):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst if burst else max(1, int(rate))
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                    self.updated_at = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait_seconds = (1 - self.tokens) / self.rate
+                else:
+                    wait_seconds = self.paused_until - now
+            time.sleep(wait_seconds)
+
+    def backoff(self, seconds: float):
+        with self.lock:
+            now = time.monotonic()
+            if now >= self.paused_until:
+                # Other workers' requests from the same burst will see 429s
+                # too; only slow down once per pause.
+                self.rate = max(self.max_rate / 16, self.rate / 2)
+            self.paused_until = max(self.paused_until, now + seconds)
+            self.tokens = 0
+            self.updated_at = self.paused_until
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class ProgressCheckpoint:
+    """Append-only file of the keys (phone numbers) already upserted.
+
+    A rerun after a crash skips everything in the file, whatever order the
+    input query returns rows in this time. Delete the file to start over.
+    """
+
+    def __init__(self, path: str, flush_every: int = 100):
+        self.path = path
+        self.flush_every = flush_every
+        self.lock = threading.Lock()
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.done = set(line.strip() for line in f if line.strip())
+            print(f'Resuming from checkpoint {path}: {len(self.done)} already done')
+        self.file = open(path, 'a')
+        self.pending = 0
+
+    def is_done(self, key: str) -> bool:
+        return key in self.done
+
+    def mark_done(self, key: str):
+        with self.lock:
+            self.done.add(key)
+            self.file.write(key + '\n')
+            self.pending += 1
+            if self.pending >= self.flush_every:
+                self.file.flush()
+                self.pending = 0
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
 class MobileCommonsAPI(ShopifyAPI):
-    def __init__(self, api_username, api_password, schema, database):
+    def __init__(self, api_username, api_password, schema, database, pool_size=DEFAULT_CONCURRENCY):
         self.session = requests.Session()
         self.session.auth = (api_username, api_password)
+        # Enough keep-alive connections for every bulk upsert worker.
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
         self.database = database
         self.schema = schema
         self.base_url = API_BASE_URL
@@ -115,8 +224,103 @@ class MobileCommonsAPI(ShopifyAPI):
         url = self.base_url + 'profile_update'
         resp = self.session.post(url, data=payload)
 
+        if resp.status_code == 429:
+            retry_after = resp.headers.get('Retry-After')
+            raise MobileCommonsRateLimitException(
+                f'Rate limited by Mobile Commons API. Response: {resp.text}',
+                retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None,
+            )
+
         error = is_error_response(resp)
         if error:
             raise MobileCommonsAPIException(f'Error with Mobile Commons API. Error code {error}. Response: {resp.text}')
 
         #print(f'Created/update profile: {resp.text}')
+
+    def bulk_create_or_update_profiles(
+            self,
+            payloads: Iterable[Dict],
+            concurrency: int = DEFAULT_CONCURRENCY,
+            requests_per_second: float = DEFAULT_REQUESTS_PER_SECOND,
+            checkpoint_path: str = None,
+            on_error: Callable[[Dict, Exception], None] = None,
+            on_success: Callable[[Dict], None] = None,
+    ) -> Dict[str, int]:
+        """Creates or updates profiles concurrently.
+
+        payloads is consumed lazily, so a generator can stop the upload early
+        (e.g. at a row limit or outside allowed sending hours). At most
+        concurrency requests are in flight, and at most requests_per_second
+        are started each second; 429s pause all workers and are retried.
+
+        If checkpoint_path is given, the phone number of every finished
+        profile is recorded there and skipped when the upload is rerun.
+        Failed profiles aren't recorded, so a rerun retries them.
+
+        on_error is called with the payload and exception of each profile
+        that failed for good; by default the error is printed. on_success is
+        called with the payload of each profile that's done.
+
+        Returns counts of succeeded, failed and skipped profiles.
+        """
+        bucket = TokenBucket(requests_per_second)
+        checkpoint = ProgressCheckpoint(checkpoint_path) if checkpoint_path else None
+        counts = {'succeeded': 0, 'failed': 0, 'skipped': 0}
+
+        def upsert(payload):
+            for attempt in range(PROFILE_UPDATE_RETRY_LIMIT + 1):
+                bucket.acquire()
+                try:
+                    self.create_or_update_profile(payload)
+                    bucket.succeeded()
+                    return
+                except MobileCommonsRateLimitException as e:
+                    if attempt == PROFILE_UPDATE_RETRY_LIMIT:
+                        raise
+                    wait_seconds = e.retry_after or DEFAULT_RATE_LIMIT_WAIT_SECONDS * 2 ** attempt
+                    print(f'429: Rate limit - pausing all workers for {wait_seconds} seconds')
+                    bucket.backoff(wait_seconds)
+
+        def finished(future, payload):
+            try:
+                future.result()
+            except Exception as e:
+                if not any(error in str(e) for error in PERMANENT_PROFILE_ERRORS):
+                    counts['failed'] += 1
+                    if on_error:
+                        on_error(payload, e)
+                    else:
+                        print(e)
+                    return
+            counts['succeeded'] += 1
+            if checkpoint:
+                checkpoint.mark_done(payload['phone_number'])
+            if on_success:
+                on_success(payload)
+            total = counts['succeeded'] + counts['failed']
+            if total % 1000 == 0:
+                print(f'Upserted {total} profiles: {counts}')
+
+        in_flight = {}
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                for payload in payloads:
+                    if checkpoint and checkpoint.is_done(payload['phone_number']):
+                        counts['skipped'] += 1
+                        continue
+                    # Keep a bounded number of payloads queued so we never
+                    # read far ahead of what's been sent.
+                    while len(in_flight) >= concurrency * 2:
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            finished(future, in_flight.pop(future))
+                    in_flight[executor.submit(upsert, payload)] = payload
+
+                for future in list(in_flight):
+                    finished(future, in_flight.pop(future))
+        finally:
+            if checkpoint:
+                checkpoint.close()
+
+        print(f'Upserted profiles: {counts}')
+        return counts
@@ -0,0 +1,117 @@
+# Benchmark of cleaning export DataFrames a column at a time, with
+# ew_common.dataframes, against the per-row cleanup that profile_payload
+# used to do for every profile.
+#
+#   python normalize_benchmark.py [--rows 100000]
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from ew_common.dataframes import nulls_to_none, postal_codes, rounded_ints, yes_no
+
+INT_FIELDS = ["donation_hpc", "donation_num"]
+YESNO_FIELDS = ["is_recurring_donor"]
+CUSTOM_FIELDS = INT_FIELDS + YESNO_FIELDS + ["donation_last_dt"]
+
+
+def sample_df(rows):
+    rng = np.random.default_rng(0)
+    hpc = rng.uniform(1, 2800, rows).round(2)
+    hpc[rng.random(rows) < 0.1] = np.nan
+    postal = rng.integers(1000, 99999, rows).astype(float)
+    postal[rng.random(rows) < 0.1] = np.nan
+    return pd.DataFrame(
+        {
+            "phone_number": [f"1555{i:07d}" for i in range(rows)],
+            "postal_code": postal,
+            "donation_hpc": hpc,
+            "donation_num": rng.integers(1, 20, rows).astype(float),
+            "is_recurring_donor": rng.choice([0, 1, "0", "1", None], rows),
+            "donation_last_dt": rng.choice(["2019-10-01", "", None], rows),
+        }
+    )
+
+
+def row_wise(df):
+    payloads = []
+    for row in df.itertuples():
+        postal_code = row.postal_code
+        if pd.isnull(postal_code):
+            postal_code = ""
+        if not isinstance(postal_code, str):
+            postal_code = str(int(postal_code)).zfill(5)
+        payload = {"phone_number": row.phone_number, "postal_code": postal_code}
+        for custom_field in CUSTOM_FIELDS:
+            v = getattr(row, custom_field)
+            if pd.isnull(v) or v == "" or v is None:
+                continue
+            if custom_field in INT_FIELDS:
+                v = round(v)
+            if custom_field in YESNO_FIELDS:
+                if v in (0, "0", "No"):
+                    v = "No"
+                elif v in (1, "1", "Yes"):
+                    v = "Yes"
+            payload[custom_field] = v
+        payloads.append(payload)
+    return payloads
+
+
+def normalize(df):
+    df = df.copy()
+    df["postal_code"] = postal_codes(df["postal_code"])
+    for custom_field in CUSTOM_FIELDS:
+        values = nulls_to_none(df[custom_field], blank_strings=True)
+        if custom_field in INT_FIELDS:
+            values = rounded_ints(values)
+        if custom_field in YESNO_FIELDS:
+            values = yes_no(values)
+        df[custom_field] = values
+    return df
+
+
+def payloads_from_normalized(df):
+    payloads = []
+    for row in df.itertuples():
+        payload = {"phone_number": row.phone_number, "postal_code": row.postal_code}
+        for custom_field in CUSTOM_FIELDS:
+            v = getattr(row, custom_field)
+            if v is not None:
+                payload[custom_field] = v
+        payloads.append(payload)
+    return payloads
+
+
+def timed(f, df):
+    started = time.perf_counter()
+    result = f(df)
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args()
+
+    df = sample_df(args.rows)
+    row_wise_seconds, expected = timed(row_wise, df)
+    normalize_seconds, normalized = timed(normalize, df)
+    loop_seconds, actual = timed(payloads_from_normalized, normalized)
+    assert actual == expected, "Column-wise payloads differ from row-wise ones"
+    column_wise_seconds = normalize_seconds + loop_seconds
+
+    for name, seconds in [
+        ("Row-wise", row_wise_seconds),
+        ("Column-wise", column_wise_seconds),
+        ("  normalizing columns", normalize_seconds),
+        ("  building payloads", loop_seconds),
+    ]:
+        print(f"{name}: {seconds:.3f}s ({seconds / args.rows * 1e6:.1f}us per row)")
+    print(f"Speedup: {row_wise_seconds / column_wise_seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,12 @@
 import os
 
-import pandas as pd
 import civis
 
-from mobilecommons.client import MobileCommonsAPI
+from ew_common.dataframes import nulls_to_none, rounded_ints, yes_no
+from ew_common.sync_state import SyncState
+from mobilecommons.client import DEFAULT_CONCURRENCY, MobileCommonsAPI
+
+SYNC_STATE_NAMESPACE = 'mobile_commons_custom_fields'
 
 # Update fundraising-related custom fields in Mobile Commons profiles.
 class MobileCommonsUpdateCustomFields:
@@ -21,11 +24,19 @@ class MobileCommonsUpdateCustomFields:
             start,
             update_order,
             limit,
+            concurrency=DEFAULT_CONCURRENCY,
+            checkpoint_path=None,
+            sync_state_path=None,
     ):
         self.database = database
         self.schema = schema
-        self.mobilecommons_api = MobileCommonsAPI(api_username, api_password, schema, database)
+        self.mobilecommons_api = MobileCommonsAPI(api_username, api_password, schema, database, pool_size=concurrency)
         self.limit = limit
+        self.concurrency = concurrency
+        self.checkpoint_path = checkpoint_path
+        # Where we remember what we last pushed for each profile, so
+        # unchanged profiles can be skipped. None pushes every row.
+        self.sync_state_path = sync_state_path
         self.custom_fields = custom_fields
         self.custom_fields_ints_on_mobile_commons = custom_fields_ints_on_mobile_commons
         self.custom_fields_yesno_on_mobile_commons = custom_fields_yesno_on_mobile_commons
@@ -37,34 +48,49 @@ class MobileCommonsUpdateCustomFields:
     # Given DataFrame of profiles creates corresponding Mobile Commons profiles.
     def update_profiles(self):
         print(f'update_profiles()')
-        df = self.get_custom_fields_to_update()
+        df = self.normalize_custom_fields(self.get_custom_fields_to_update())
         print(f'Will update {len(df)} profiles.')
+        sync_state = SyncState(self.sync_state_path, SYNC_STATE_NAMESPACE) if self.sync_state_path else None
+        try:
+            self.mobilecommons_api.bulk_create_or_update_profiles(
+                self.profile_payloads(df, sync_state),
+                concurrency=self.concurrency,
+                checkpoint_path=self.checkpoint_path,
+                on_success=(lambda payload: sync_state.mark_synced(payload['phone_number'], payload)) if sync_state else None,
+            )
+        finally:
+            if sync_state:
+                sync_state.close()
+        print('Done.')
+
+    # Yields payloads for up to self.limit profiles. Only profiles handed to
+    # the uploader count towards the limit, not ones skipped as unchanged.
+    def profile_payloads(self, df, sync_state=None):
         i = 0
+        uploaded = 0
+        unchanged = 0
         for row in df.itertuples():
-            if self.limit and i >= self.limit:
+            if self.limit and uploaded >= self.limit:
                 print(f'Hit limit of {self.limit} rows')
                 break
             try:
                 profile_payload = self.profile_payload(row, self.custom_fields)
             except Exception as e:
-                profile_payload = None
                 print('Exception while preparing profile payload:')
                 print(e)
                 print(f'Row was: {row}')
                 raise e
             if profile_payload:
-                try:
-                    self.mobilecommons_api.create_or_update_profile(profile_payload)
-                except Exception as e:
-                    if 'Phone is not textable' in str(e):
-                        # This is mostly landline numbers, we don't need to see that error message.
-                        pass
-                    else:
-                        print(e)
+                if sync_state and not sync_state.has_changed(profile_payload['phone_number'], profile_payload):
+                    unchanged += 1
+                else:
+                    uploaded += 1
+                    yield profile_payload
             i += 1
             if i % 100 == 0:
                 print(f'Row #{i} was {row}')
-        print('Done.')
+        if sync_state:
+            print(f'Skipped {unchanged} profiles whose custom fields have not changed.')
 
     def prepare_query(self):
         query = f"SELECT * FROM {self.schema}.custom_fields_to_update_in_mobilecommons"
@@ -86,8 +112,27 @@ class MobileCommonsUpdateCustomFields:
         return df
 
 
+    # Converts the custom field columns of df to the values we send to Mobile
+    # Commons, a column at a time: None for values we don't send, ints
+    # rounded, and yes/no fields as 'Yes' or 'No'.
+    def normalize_custom_fields(self, df):
+        df = df.copy()
+        for custom_field in self.custom_fields:
+            if custom_field not in df.columns:
+                continue
+            values = nulls_to_none(df[custom_field], blank_strings=True)
+            if custom_field in self.custom_fields_ints_on_mobile_commons:
+                values = rounded_ints(values)
+            if custom_field in self.custom_fields_yesno_on_mobile_commons:
+                values = yes_no(values)
+            df[custom_field] = values
+
+        return df
+
     # Returns POST payload according to
     #   https://community.uplandsoftware.com/hc/en-us/articles/204494185-REST-API#ProfileUpdate
+    #
+    # row is from a DataFrame that has been through normalize_custom_fields.
     def profile_payload(self, row, custom_fields):
         payload = {
             'phone_number': f'1{row.phone_number}',
@@ -98,15 +143,8 @@ class MobileCommonsUpdateCustomFields:
                 print(f'Custom field {custom_field} not in row {row}')
                 continue
             v = getattr(row, custom_field)
-            if pd.isnull(v) or v == '' or v is None:
+            if v is None:
                 continue
-            if custom_field in self.custom_fields_ints_on_mobile_commons:
-                v = round(v)
-            if custom_field in self.custom_fields_yesno_on_mobile_commons:
-                if v in (0, '0', 'No'):
-                    v = 'No'
-                elif v in (1, '1', 'Yes'):
-                    v = 'Yes'
             payload[custom_field] = v
 
         return payload
@@ -2,12 +2,12 @@ from collections import defaultdict
 import datetime
 import os
 
-from nameparser import HumanName
-import pandas as pd
 import civis
 import jinja2
 
-from mobilecommons.client import MobileCommonsAPI
+from ew_common.dataframes import nulls_to_none, postal_codes
+from ew_common.input_validation import normalize_names_batch
+from mobilecommons.client import DEFAULT_CONCURRENCY, MobileCommonsAPI
 
 # For phone numbers which we are sure have recent SMS opt-in, exports profiles
 # from Civis to Mobile Commons using the Mobile Commons API.
@@ -29,10 +29,14 @@ class MobileCommonsExport:
             api_password,
             opt_in_path_ids_arg,
             limit_per_type,
+            concurrency=DEFAULT_CONCURRENCY,
+            checkpoint_path=None,
     ):
         self.database = database
         self.schema = schema
-        self.mobilecommons_api = MobileCommonsAPI(api_username, api_password, schema, database)
+        self.mobilecommons_api = MobileCommonsAPI(api_username, api_password, schema, database, pool_size=concurrency)
+        self.concurrency = concurrency
+        self.checkpoint_path = checkpoint_path
         self.opt_in_path_ids = self.parse_opt_in_path_ids_arg(opt_in_path_ids_arg)
         self.limit_per_type = limit_per_type
 
@@ -79,11 +83,25 @@ class MobileCommonsExport:
 
     # Given DataFrame of profiles creates corresponding Mobile Commons profiles.
     def export_profiles(self, df, opt_in_path_id, limit):
+        df = self.normalize_profiles(df)
+        self.mobilecommons_api.bulk_create_or_update_profiles(
+            self.profile_payloads(df, opt_in_path_id, limit),
+            concurrency=self.concurrency,
+            checkpoint_path=self.checkpoint_path,
+        )
+        print('Done.')
+
+    # Yields payloads for up to limit profiles. Only profiles handed to the
+    # uploader count towards the limit, not ones we couldn't build a payload
+    # for.
+    def profile_payloads(self, df, opt_in_path_id, limit):
         i = 0
         for profile in df.itertuples():
             if limit and i >= limit:
                 print(f'Hit limit of {limit} profiles')
                 break
+            # Checked as profiles are handed to the uploader, so we stop
+            # promptly even though uploads run concurrently.
             if not self.allowed_sending_time():
                 print('It is outside of allowed sending times (3pm-midnight UTC). Aborting profile creation.')
                 break
@@ -96,16 +114,8 @@ class MobileCommonsExport:
                 print(e)
                 print(f'Profile was: {profile}')
             if profile_payload:
-                try:
-                    self.mobilecommons_api.create_or_update_profile(profile_payload)
-                except Exception as e:
-                    if 'Phone is not textable' in str(e):
-                        # This is mostly landline numbers, we don't need to see that error message.
-                        pass
-                    else:
-                        print(e)
-            i += 1
-        print('Done.')
+                i += 1
+                yield profile_payload
 
 
     # Returns emails that are in various tables in Civis but not in any BSD
@@ -120,31 +130,35 @@ class MobileCommonsExport:
         return df
 
 
+    # Cleans up the columns of df that go into profile payloads, a column at
+    # a time: names capitalized, postal codes zero-padded, and None for
+    # nulls.
+    def normalize_profiles(self, df):
+        df = df.copy()
+
+        first_names = df['first_name'].astype(object).where(df['first_name'].notna(), '').astype(str)
+        last_names = df['last_name'].astype(object).where(df['last_name'].notna(), '').astype(str)
+        names = normalize_names_batch(zip(first_names, last_names))
+        df['first_name'] = [first_name for first_name, _ in names]
+        df['last_name'] = [last_name for _, last_name in names]
+
+        df['postal_code'] = postal_codes(df['postal_code'])
+        for column in ['phone_number', 'email', 'addr1', 'addr2', 'city', 'state', 'country']:
+            df[column] = nulls_to_none(df[column])
+
+        return df
+
     # Returns POST payload according to
     #   https://community.uplandsoftware.com/hc/en-us/articles/204494185-REST-API#ProfileUpdate
+    #
+    # profile is from a DataFrame that has been through normalize_profiles.
     def profile_payload(self, profile, opt_in_path_id):
-        first_name = profile.first_name
-        last_name = profile.last_name
-        if pd.isnull(first_name):
-            first_name = ''
-        if pd.isnull(last_name):
-            last_name = ''
-
-        postal_code = profile.postal_code
-        if pd.isnull(postal_code):
-            postal_code = ''
-        if not isinstance(postal_code, str):
-            # The dataframe sometimes turns e.g. 02145 into 2145.
-            # Or hallucinates floats... :-/
-            postal_code = str(int(postal_code)).zfill(5)
-
-        first_name, last_name = self.normalize_name(str(first_name), str(last_name))
         payload = {
             'phone_number': profile.phone_number,
             'email': profile.email,
-            'postal_code': postal_code,
-            'first_name': first_name,
-            'last_name': last_name,
+            'postal_code': profile.postal_code,
+            'first_name': profile.first_name,
+            'last_name': profile.last_name,
             'street1': profile.addr1,
             'street2': profile.addr2,
             'city': profile.city,
@@ -154,15 +168,8 @@ class MobileCommonsExport:
         }
 
         # Don't upload null or empty fields.
-        keys_to_delete = [k for k, v in payload.items() if not v or pd.isnull(v)]
+        keys_to_delete = [k for k, v in payload.items() if not v]
         for k in keys_to_delete:
             del payload[k]
 
         return payload
-
-    def normalize_name(self, first_name, last_name):
-        name = HumanName()
-        name.first = first_name
-        name.last = last_name
-        name.capitalize()
-        return (name.first, name.last)
@@ -6,28 +6,41 @@
 # 2. Uploads new phone numbers to Mobile Common profiles, to opt them
 #    into our text message list.
 #
+# By default every webhook is processed in its own Zappa task and written
+# to S3 as its own JSON object. With ACTBLUE_INGESTION_MODE=queue, webhooks
+# are instead buffered in a durable queue (see ingestion_queue.py) and
+# processed in micro-batches by drain_donation_queue, which runs on a
+# schedule and archives events as compressed segments (see archive.py).
+#
 # For reference, ActBlue webhook documentation is here:
 #   https://secure.actblue.com/docs/webhooks
 
 import datetime
 import json
 import logging
+import uuid
 
 import boto3
 import dateutil
 import pytz
 from flask import Blueprint, request
 from nameparser import HumanName
+from pynamodb.exceptions import UpdateError
 from zappa.asynchronous import task
 
+from actblue.archive import ArchiveWriter
+from actblue.badges import badge_calendar, eastern_date
+from actblue.ingestion_queue import (
+    EVENT_KIND_CANCELLATION,
+    EVENT_KIND_DONATION,
+    get_ingestion_queue,
+)
 from common.basic_auth import requires_auth
 from common.cloudwatch import cloudwatch_put_metric
-from common.settings import settings
+from common.profile_exists_cache import profile_exists_cache
+from common.settings import Settings, settings
 from ew_common.input_validation import extract_phone_number, normalize_name
-from ew_common.mobile_commons import (
-    create_or_update_mobile_commons_profile,
-    profile_exists,
-)
+from ew_common.mobile_commons import create_or_update_mobile_commons_profile
 from models.donor import Donor
 
 mod = Blueprint("actblue", __name__)
@@ -42,20 +55,22 @@ LOTS_OF_LAG_THRESHOLD_SECONDS = 5 * 60
 LATEST_SEND_HOUR_UTC = 1  # 9pm EDT
 EARLIEST_SEND_HOUR_UTC = 13  # 9am EDT
 
-DEBATE_DONOR_DAYS = [
-    datetime.date(2019, 6, 26),
-    datetime.date(2019, 6, 27),
-    datetime.date(2019, 7, 30),
-    datetime.date(2019, 7, 31),
-    datetime.date(2019, 9, 12),
-    datetime.date(2019, 9, 13),
-    datetime.date(2019, 10, 15),
-    datetime.date(2019, 10, 16),
-    datetime.date(2019, 11, 20),
-    datetime.date(2019, 11, 21),
-    datetime.date(2019, 12, 19),
-    datetime.date(2019, 12, 20),
-]
+# Stop draining the ingestion queue when the Lambda invocation has less
+# than this much time left, so we never get killed mid-batch.
+DRAIN_DEADLINE_BUFFER_MILLIS = 60 * 1000
+
+# How long the drain buffers events in a segment before archiving and
+# acknowledging them. Keep this well under the ingestion queue's
+# visibility timeout.
+DRAIN_MAX_SEGMENT_AGE_SECONDS = 60
+
+# Queued events too malformed to process are written here, in the
+# donations bucket, rather than failing (and blocking) their whole batch.
+DEAD_LETTER_PREFIX = "dead_letter/"
+
+# In atomic donor aggregation mode, how many times to try a donor's update
+# when other webhooks for the same donor keep getting there first.
+ATOMIC_DONOR_UPDATE_ATTEMPTS = 3
 
 Donor.Meta.table_name = settings.donors_table_name
 
@@ -70,7 +85,10 @@ def donation():
         logging.exception(f"ActBlue - Bad Donation Request - data: {req_body}")
         return ("Bad Request", 400)
 
-    process_donation(event)
+    if settings.actblue_ingestion_mode == Settings.ACTBLUE_INGESTION_MODE_QUEUE:
+        get_ingestion_queue().put(event, kind=EVENT_KIND_DONATION)
+    else:
+        process_donation(event)
     return ("", 204)
 
 
@@ -86,6 +104,156 @@ def process_donation(event):
         logging.exception("Got exception in create_donor_object", e)
 
 
+def drain_donation_queue(event=None, context=None):
+    """Processes queued webhooks in micro-batches until the queue is empty.
+
+    Invoked on a schedule by Zappa (see zappa_settings.json). Events are
+    only acknowledged once their batch is processed and archived to S3,
+    so if we crash they'll be redelivered.
+
+    One ArchiveWriter is kept open for the whole drain, so each segment
+    holds many batches. Segments are flushed, and the events in them
+    acknowledged, when the writer says a flush is due (on size, or once
+    a segment is DRAIN_MAX_SEGMENT_AGE_SECONDS old) and when the drain
+    ends. That age has to stay well under the queue's visibility
+    timeout, or held events would be redelivered during the same drain.
+    """
+    if settings.actblue_ingestion_mode != Settings.ACTBLUE_INGESTION_MODE_QUEUE:
+        return
+
+    queue = get_ingestion_queue()
+    archive = ArchiveWriter(
+        settings.actblue_donations_incoming_s3_bucket,
+        codec=settings.actblue_archive_codec,
+        max_segment_age_seconds=DRAIN_MAX_SEGMENT_AGE_SECONDS,
+    )
+    unacked_receipts = []
+    while True:
+        if (
+            context
+            and context.get_remaining_time_in_millis() < DRAIN_DEADLINE_BUFFER_MILLIS
+        ):
+            logging.info("Running out of time; leaving the rest for the next drain")
+            break
+
+        queued_events = queue.receive(settings.actblue_ingestion_batch_size)
+        if not queued_events:
+            break
+
+        logging.info(f"Processing batch of {len(queued_events)} webhooks")
+        valid_events = []
+        dead_letter_receipts = []
+        for q in queued_events:
+            if is_valid_or_dead_letter(q):
+                valid_events.append(q)
+            else:
+                dead_letter_receipts.append(q.receipt)
+        # Dead letters are already in S3, so they needn't wait for a flush.
+        if dead_letter_receipts:
+            queue.ack(dead_letter_receipts)
+
+        process_donation_batch(
+            [q.event for q in valid_events if q.kind == EVENT_KIND_DONATION],
+            archive,
+        )
+        for q in valid_events:
+            if q.kind == EVENT_KIND_CANCELLATION:
+                archive_cancellation(q.event, archive)
+        unacked_receipts.extend(q.receipt for q in valid_events)
+
+        if archive.flush_due():
+            flush_and_ack(archive, queue, unacked_receipts)
+
+    flush_and_ack(archive, queue, unacked_receipts)
+
+
+def flush_and_ack(archive, queue, receipts):
+    """Flushes archive, then acknowledges (and forgets) receipts."""
+    archive.flush()
+    if receipts:
+        queue.ack(list(receipts))
+        receipts.clear()
+
+
+def validate_queued_event(queued_event):
+    """Raises ValueError if the event lacks what drain_donation_queue needs.
+
+    A malformed event that got through would fail its whole batch, which
+    would then be redelivered forever.
+    """
+    event = queued_event.event
+    try:
+        event["contribution"]["orderNumber"]
+        if queued_event.kind == EVENT_KIND_DONATION:
+            if not event["donor"]["email"]:
+                raise ValueError("No donor email")
+            line_item = event["lineitems"][-1]
+            float(line_item["amount"])
+            dateutil.parser.parse(line_item["paidAt"])
+        elif queued_event.kind == EVENT_KIND_CANCELLATION:
+            dateutil.parser.parse(event["contribution"]["cancelledAt"])
+        else:
+            raise ValueError(f"Unknown event kind: {queued_event.kind}")
+    except (KeyError, IndexError, TypeError, ValueError, OverflowError) as e:
+        raise ValueError(f"Malformed {queued_event.kind} event: {e!r}") from e
+
+
+def is_valid_or_dead_letter(queued_event):
+    """Whether queued_event is valid; if not, writes it to the dead letters."""
+    try:
+        validate_queued_event(queued_event)
+        return True
+    except ValueError as e:
+        logging.exception(f"Moving malformed event to {DEAD_LETTER_PREFIX}")
+        write_dead_letter(queued_event, e)
+        return False
+
+
+def write_dead_letter(queued_event, error):
+    time_now = datetime.datetime.now(datetime.timezone.utc)
+    key = (
+        f"{DEAD_LETTER_PREFIX}{time_now.strftime('%Y-%m-%d_%H:%M:%S')}_"
+        f"{uuid.uuid4().hex}.json"
+    )
+    body = json.dumps(
+        {"kind": queued_event.kind, "error": str(error), "event": queued_event.event}
+    )
+    s3 = boto3.resource("s3")
+    s3.Bucket(settings.actblue_donations_incoming_s3_bucket).put_object(
+        Key=key, Body=body
+    )
+
+
+def process_donation_batch(events, archive):
+    """Batch version of process_donation.
+
+    Mobile Commons uploads are still per donation, but the batch makes a
+    single CloudWatch call and a single Dynamo batch write, and is
+    appended to archive rather than written to S3 object by object.
+
+    events should have been validated with validate_queued_event.
+    """
+    if not events:
+        return
+
+    for event in events:
+        try:
+            upload_to_mobilecommons(event)
+        except Exception:
+            logging.exception("Got exception in upload_to_mobilecommons")
+    try:
+        log_batch_metrics(events)
+    except Exception:
+        logging.exception("Got exception in log_batch_metrics")
+    for event in events:
+        archive_donation(event, archive)
+
+    try:
+        create_donor_objects(events)
+    except Exception:
+        logging.exception("Got exception in create_donor_objects")
+
+
 def upload_to_mobilecommons(event):
     """Given an incoming donation, creates new profile on Mobile Commons if appropriate.
 
@@ -116,7 +284,7 @@ def upload_to_mobilecommons(event):
         )
         return
 
-    if profile_exists(
+    if profile_exists_cache.profile_exists(
         settings.mobile_commons_username, settings.mobile_commons_password, phone_number
     ):
         logging.info(f"Profile already exists for number {phone_number}")
@@ -127,6 +295,7 @@ def upload_to_mobilecommons(event):
         settings.mobile_commons_password,
         profile_payload(phone_number, donor),
     )
+    profile_exists_cache.mark_profile_exists(phone_number)
 
 
 def log_metrics(event):
@@ -145,6 +314,29 @@ def lag_since_donation_in_seconds(event):
     return lag_in_seconds
 
 
+def log_batch_metrics(events):
+    """Logs lag of a whole batch of donations in one CloudWatch call."""
+    lags = [lag_since_donation_in_seconds(event) for event in events]
+    if not lags:
+        return
+    cloudwatch_put_metric(
+        [
+            {
+                "MetricName": "lag_between_donation_and_webhook",
+                "Dimensions": [],
+                "Unit": "Seconds",
+                "StatisticValues": {
+                    "SampleCount": len(lags),
+                    "Sum": sum(lags),
+                    "Minimum": min(lags),
+                    "Maximum": max(lags),
+                },
+            }
+        ]
+        + profile_exists_cache.metric_data()
+    )
+
+
 def log_lag(lag_in_seconds):
     cloudwatch_put_metric(
         [
@@ -155,6 +347,7 @@ def log_lag(lag_in_seconds):
                 "Value": lag_in_seconds,
             }
         ]
+        + profile_exists_cache.metric_data()
     )
 
 
@@ -208,6 +401,10 @@ def write_donation_to_s3(event):
     write_to_s3(event, event["lineitems"][-1]["paidAt"], "donations/")
 
 
+def archive_donation(event, archive):
+    archive.append(event, event["lineitems"][-1]["paidAt"], "donations/")
+
+
 @mod.route("/cancellation", methods=["POST"])
 @requires_auth("actblue_webhook")
 def cancellation():
@@ -218,7 +415,10 @@ def cancellation():
         logging.exception(f"ActBlue - Bad Cancellation Request - data: {req_body}")
         return ("Bad Request", 400)
 
-    process_cancellation(event)
+    if settings.actblue_ingestion_mode == Settings.ACTBLUE_INGESTION_MODE_QUEUE:
+        get_ingestion_queue().put(event, kind=EVENT_KIND_CANCELLATION)
+    else:
+        process_cancellation(event)
     return ("", 204)
 
 
@@ -231,6 +431,10 @@ def write_cancellation_to_s3(event):
     write_to_s3(event, event["contribution"]["cancelledAt"], "cancellations/")
 
 
+def archive_cancellation(event, archive):
+    archive.append(event, event["contribution"]["cancelledAt"], "cancellations/")
+
+
 def write_to_s3(event, comparison_timestamp, object_prefix):
     comparison_datetime_utc = dateutil.parser.parse(comparison_timestamp).astimezone(
         pytz.utc
@@ -254,20 +458,69 @@ def write_to_s3(event, comparison_timestamp, object_prefix):
 
 def create_donor_object(event):
     """Given an incoming donation, creates new Donor object in DynamoDB."""
+    if settings.actblue_donor_aggregation == Settings.ACTBLUE_DONOR_AGGREGATION_ATOMIC:
+        apply_donations_atomically(event["donor"]["email"], [event])
+        return
+
+    donor = Donor.get_or_create_donor(event["donor"]["email"])
+    if apply_donation_to_donor(donor, event):
+        donor.save()
+
+
+def create_donor_objects(events):
+    """Batch version of create_donor_object.
+
+    Reads all donors with one batch get and writes back the ones that
+    changed with one batch write. Donations from the same donor are
+    applied in paidAt order.
+
+    In atomic donor aggregation mode, each donor's donations in the batch
+    are instead coalesced into one conditional UpdateItem.
+    """
+    if settings.actblue_donor_aggregation == Settings.ACTBLUE_DONOR_AGGREGATION_ATOMIC:
+        events_by_email = {}
+        for event in events:
+            events_by_email.setdefault(event["donor"]["email"], []).append(event)
+        for email, donor_events in events_by_email.items():
+            try:
+                apply_donations_atomically(email, donor_events)
+            except Exception:
+                logging.exception(f"Got exception applying donations for {email}")
+        return
+
+    donors = Donor.get_or_create_donors(event["donor"]["email"] for event in events)
+
+    changed_donors = {}
+    for event in sorted(events, key=paid_at_of_donation):
+        donor = donors[event["donor"]["email"]]
+        if apply_donation_to_donor(donor, event):
+            changed_donors[donor.email] = donor
+
+    with Donor.batch_write() as batch:
+        for donor in changed_donors.values():
+            batch.save(donor)
+
+
+def paid_at_of_donation(event):
+    return dateutil.parser.parse(event["lineitems"][-1]["paidAt"])
+
+
+def apply_donation_to_donor(donor, event):
+    """Updates donor in place with an incoming donation.
+
+    Returns False if the donation was already applied, True otherwise.
+    """
     donor_ab = event["donor"]
-    email = donor_ab["email"]
     contribution = event["contribution"]
     line_item = event["lineitems"][-1]
 
-    donor = Donor.get_or_create_donor(email)
-
     paid_at = dateutil.parser.parse(line_item["paidAt"])
     if donor.last_donation_ts and paid_at <= donor.last_donation_ts:
         logging.warning(
             f"This seems like a duplicate webhook notification, with identical paidAt {paid_at} "
             f"compared to existing last_donation_ts {donor.last_donation_ts}"
         )
-        return
+        return False
 
     if not donor.donor_id:
         donor.set_donor_id(settings.donor_id_salt)
@@ -279,35 +532,119 @@ def create_donor_object(event):
     donor.state = donor_ab.get("state")
     donor.zip = donor_ab.get("zip")
 
-    if is_eom(paid_at):
-        donor.badges.add(Donor.BadgeId.EOM.value)
-    if is_eoq(paid_at):
-        donor.badges.add(Donor.BadgeId.EOQ.value)
-    if is_debate(paid_at):
-        donor.badges.add(Donor.BadgeId.DEBATE.value)
-    if is_recurring(contribution):
-        donor.badges.add(Donor.BadgeId.RECURRING.value)
+    donor.badges.update(donation_badges(paid_at, contribution))
 
-    donor.last_donation_ts = dateutil.parser.parse(line_item["paidAt"])
-    donor.last_donation_dt = str(
-        donor.last_donation_ts.astimezone(pytz.timezone("US/Eastern")).date()
-    )
+    donor.last_donation_ts = paid_at
+    donor.last_donation_dt = last_donation_dt(paid_at)
     donor.last_donation_amount = float(line_item["amount"])
     donor.last_donation_type = "actblue"
     donor.total_donation_amount += donor.last_donation_amount
-    donor.save()
+    return True
 
 
-def is_eom(paid_at):
-    return paid_at.day >= 26 and paid_at.month % 3 != 0
+def donation_badges(paid_at, contribution):
+    badges = set(badge_calendar().badges_at(paid_at))
+    if is_recurring(contribution):
+        badges.add(Donor.BadgeId.RECURRING.value)
+    return badges
+
 
+def last_donation_dt(paid_at):
+    return str(eastern_date(paid_at))
 
-def is_eoq(paid_at):
-    return paid_at.day >= 26 and paid_at.month % 3 == 0
 
+def newer_donations(events, last_donation_ts):
+    """The events (sorted by paidAt) that come after last_donation_ts.
 
-def is_debate(paid_at):
-    return paid_at.date() in DEBATE_DONOR_DAYS
+    Like apply_donation_to_donor, treats donations with a paidAt no later
+    than the last one applied as duplicate webhook notifications.
+    """
+    newer = []
+    for event in events:
+        paid_at = paid_at_of_donation(event)
+        if last_donation_ts and paid_at <= last_donation_ts:
+            logging.warning(
+                f"This seems like a duplicate webhook notification, with identical paidAt {paid_at} "
+                f"compared to existing last_donation_ts {last_donation_ts}"
+            )
+            continue
+        newer.append(event)
+        last_donation_ts = paid_at
+    return newer
+
+
+def apply_donations_atomically(email, events):
+    """Applies events, all donations by the donor with email, in one UpdateItem.
+
+    DynamoDB itself adds to the total and to the badges (ADD), rather than
+    us reading, changing and writing them back, so concurrent webhooks for
+    the same donor can't lose each other's updates. The update is
+    conditional on the donor's last_donation_ts being earlier than every
+    donation applied; if it isn't, we re-read it, drop the donations it
+    already covers, and try again.
+
+    Returns the number of donations applied.
+    """
+    events = sorted(events, key=paid_at_of_donation)
+    last_donation_ts = None
+    for _ in range(ATOMIC_DONOR_UPDATE_ATTEMPTS):
+        events = newer_donations(events, last_donation_ts)
+        if not events:
+            return 0
+
+        condition = Donor.last_donation_ts.does_not_exist() | (
+            Donor.last_donation_ts < paid_at_of_donation(events[0])
+        )
+        try:
+            Donor(email).update(
+                actions=donor_update_actions(email, events), condition=condition
+            )
+            return len(events)
+        except UpdateError as e:
+            if e.cause_response_code != "ConditionalCheckFailedException":
+                raise
+        last_donation_ts = Donor.get(email, consistent_read=True).last_donation_ts
+
+    raise RuntimeError(f"Gave up applying donations for {email}")
+
+
+def donor_update_actions(email, events):
+    """UpdateItem actions that apply events (sorted, all new) to a donor."""
+    latest_event = events[-1]
+    donor_ab = latest_event["donor"]
+    paid_at = paid_at_of_donation(latest_event)
+    amounts = [float(event["lineitems"][-1]["amount"]) for event in events]
+    badges = set()
+    for event in events:
+        badges |= donation_badges(paid_at_of_donation(event), event["contribution"])
+    first_name, last_name = normalize_name(
+        donor_ab.get("firstname", ""), donor_ab.get("lastname", "")
+    )
+    now = datetime.datetime.utcnow()
+
+    def set_or_remove(attribute, value):
+        return attribute.remove() if value is None else attribute.set(value)
+
+    actions = [
+        Donor.donor_id.set(
+            Donor.donor_id | Donor.compute_donor_id(email, settings.donor_id_salt)
+        ),
+        set_or_remove(Donor.first_name, first_name),
+        set_or_remove(Donor.last_name, last_name),
+        set_or_remove(Donor.city, donor_ab.get("city")),
+        set_or_remove(Donor.state, donor_ab.get("state")),
+        set_or_remove(Donor.zip, donor_ab.get("zip")),
+        Donor.last_donation_ts.set(paid_at),
+        Donor.last_donation_dt.set(last_donation_dt(paid_at)),
+        Donor.last_donation_amount.set(amounts[-1]),
+        Donor.last_donation_type.set("actblue"),
+        Donor.total_donation_amount.add(sum(amounts)),
+        Donor.created_at.set(Donor.created_at | now),
+        Donor.updated_at.set(now),
+    ]
+    if badges:
+        actions.append(Donor.badges.add(badges))
+    return actions
 
 
 def is_recurring(contribution):
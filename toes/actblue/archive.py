@@ -0,0 +1,254 @@
+# Rolling archive of ActBlue webhook events in S3.
+#
+# Rather than one tiny JSON object per donation, ArchiveWriter packs events
+# into compressed newline-delimited JSON segments, partitioned by the
+# hour of the event (paidAt for donations, cancelledAt for cancellations):
+#
+#   donations/segments/dt=2019-06-07/hour=19/<flushed at>_<first order number>_<count>.ndjson.gz
+#
+# A segment is a concatenation of independently compressed blocks of
+# records (concatenated gzip members and zstd frames are themselves valid
+# gzip/zstd streams, so the whole segment can also be decompressed in
+# one go). Next to every segment we write a JSON manifest listing each
+# block's byte offset, length, time range and order numbers, so readers
+# can fetch exactly the blocks they need with a single ranged GET instead
+# of listing and fetching thousands of objects.
+
+import datetime
+import gzip
+import json
+import logging
+import time
+
+import boto3
+import dateutil
+import pytz
+
+CODEC_GZIP = "gzip"
+CODEC_ZSTD = "zstd"
+
+CODEC_EXTENSIONS = {CODEC_GZIP: ".gz", CODEC_ZSTD: ".zst"}
+
+SEGMENTS_DIRECTORY = "segments/"
+MANIFEST_SUFFIX = ".manifest"
+
+# A segment is flushed once it holds this much uncompressed NDJSON...
+DEFAULT_MAX_SEGMENT_BYTES = 64 * 1024 * 1024
+# ...or once its oldest record has been buffered this long.
+DEFAULT_MAX_SEGMENT_AGE_SECONDS = 5 * 60
+# Records per independently compressed block.
+DEFAULT_RECORDS_PER_BLOCK = 500
+
+
+def compress(data, codec):
+    if codec == CODEC_GZIP:
+        # mtime=0 keeps output deterministic for identical input.
+        return gzip.compress(data, mtime=0)
+    if codec == CODEC_ZSTD:
+        # zstandard is optional; it's only needed for zstd archives.
+        import zstandard
+
+        return zstandard.ZstdCompressor().compress(data)
+    raise ValueError(f"Unknown archive codec: {codec}")
+
+
+def decompress(data, codec):
+    """Decompresses a single block written by compress()."""
+    if codec == CODEC_GZIP:
+        return gzip.decompress(data)
+    if codec == CODEC_ZSTD:
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unknown archive codec: {codec}")
+
+
+def partition_prefix(object_prefix, comparison_datetime_utc):
+    return (
+        f"{object_prefix}{SEGMENTS_DIRECTORY}"
+        f"dt={comparison_datetime_utc.strftime('%Y-%m-%d')}/"
+        f"hour={comparison_datetime_utc.strftime('%H')}/"
+    )
+
+
+class Segment:
+    def __init__(self, partition, codec, records_per_block):
+        self.partition = partition
+        self.codec = codec
+        self.records_per_block = records_per_block
+        self.created_at = time.monotonic()
+        self.uncompressed_bytes = 0
+        self.record_count = 0
+        self.first_order_number = None
+
+        # Compressed blocks and their manifest entries.
+        self.blocks = []
+        self.block_manifests = []
+        self.compressed_bytes = 0
+
+        self._pending_lines = []
+        self._pending_order_numbers = []
+        self._pending_timestamps = []
+
+    def add(self, line, order_number, comparison_timestamp_utc):
+        if self.first_order_number is None:
+            self.first_order_number = order_number
+        self._pending_lines.append(line)
+        self._pending_order_numbers.append(order_number)
+        self._pending_timestamps.append(comparison_timestamp_utc)
+        self.uncompressed_bytes += len(line) + 1
+        self.record_count += 1
+        if len(self._pending_lines) >= self.records_per_block:
+            self._close_block()
+
+    def body_and_manifest(self, key):
+        self._close_block()
+        manifest = {
+            "key": key,
+            "codec": self.codec,
+            "record_count": self.record_count,
+            "uncompressed_bytes": self.uncompressed_bytes,
+            "compressed_bytes": self.compressed_bytes,
+            "blocks": self.block_manifests,
+        }
+        return b"".join(self.blocks), manifest
+
+    def _close_block(self):
+        if not self._pending_lines:
+            return
+        data = ("\n".join(self._pending_lines) + "\n").encode("utf-8")
+        block = compress(data, self.codec)
+        self.block_manifests.append(
+            {
+                "offset": self.compressed_bytes,
+                "length": len(block),
+                "record_count": len(self._pending_lines),
+                "min_timestamp": min(self._pending_timestamps),
+                "max_timestamp": max(self._pending_timestamps),
+                "order_numbers": self._pending_order_numbers,
+            }
+        )
+        self.blocks.append(block)
+        self.compressed_bytes += len(block)
+        self._pending_lines = []
+        self._pending_order_numbers = []
+        self._pending_timestamps = []
+
+
+class ArchiveWriter:
+    """Buffers webhook events and writes them to S3 as compressed segments.
+
+    Call flush() before acknowledging the events' source (e.g. the
+    ingestion queue); events that haven't been flushed yet only exist in
+    memory.
+    """
+
+    def __init__(
+        self,
+        bucket,
+        s3_client=None,
+        codec=CODEC_GZIP,
+        max_segment_bytes=DEFAULT_MAX_SEGMENT_BYTES,
+        max_segment_age_seconds=DEFAULT_MAX_SEGMENT_AGE_SECONDS,
+        records_per_block=DEFAULT_RECORDS_PER_BLOCK,
+    ):
+        if codec not in CODEC_EXTENSIONS:
+            raise ValueError(f"Unknown archive codec: {codec}")
+        self.bucket = bucket
+        self.s3 = s3_client if s3_client else boto3.client("s3")
+        self.codec = codec
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age_seconds = max_segment_age_seconds
+        self.records_per_block = records_per_block
+        self.segments = {}
+
+    def append(self, event, comparison_timestamp, object_prefix):
+        comparison_datetime_utc = dateutil.parser.parse(
+            comparison_timestamp
+        ).astimezone(pytz.utc)
+        partition = partition_prefix(object_prefix, comparison_datetime_utc)
+
+        segment = self.segments.get(partition)
+        if not segment:
+            segment = Segment(partition, self.codec, self.records_per_block)
+            self.segments[partition] = segment
+
+        segment.add(
+            json.dumps(event),
+            event["contribution"]["orderNumber"],
+            comparison_datetime_utc.isoformat(),
+        )
+        if segment.uncompressed_bytes >= self.max_segment_bytes:
+            self._flush_segment(partition)
+
+    def flush_due(self):
+        """Whether the buffered segments should be flushed now.
+
+        That's when the oldest has been buffered max_segment_age_seconds,
+        or when together they hold max_segment_bytes. (A single segment
+        that big is flushed by append() straight away.)
+        """
+        now = time.monotonic()
+        if any(
+            now - segment.created_at >= self.max_segment_age_seconds
+            for segment in self.segments.values()
+        ):
+            return True
+        return (
+            sum(segment.uncompressed_bytes for segment in self.segments.values())
+            >= self.max_segment_bytes
+        )
+
+    def flush(self):
+        for partition in list(self.segments):
+            self._flush_segment(partition)
+
+    def _flush_segment(self, partition):
+        segment = self.segments.pop(partition)
+        flushed_at = datetime.datetime.now(datetime.timezone.utc).strftime(
+            "%Y-%m-%d_%H:%M:%S"
+        )
+        key = (
+            f"{partition}{flushed_at}_{segment.first_order_number}_"
+            f"{segment.record_count}.ndjson{CODEC_EXTENSIONS[self.codec]}"
+        )
+        body, manifest = segment.body_and_manifest(key)
+
+        logging.info(f"Writing {segment.record_count} events to s3: {key}")
+        self.s3.put_object(Bucket=self.bucket, Key=key, Body=body)
+        # The manifest goes last, so any segment readers can discover
+        # through its manifest is complete.
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=key + MANIFEST_SUFFIX,
+            Body=json.dumps(manifest),
+            ContentType="application/json",
+        )
+
+
+def read_segment_events(s3_client, bucket, manifest, block_filter=None):
+    """Reads events from an archived segment described by its manifest.
+
+    block_filter, if given, is called with each block's manifest entry and
+    should return whether to read that block. All selected blocks are
+    fetched with one ranged GET spanning them.
+    """
+    blocks = [b for b in manifest["blocks"] if block_filter is None or block_filter(b)]
+    if not blocks:
+        return []
+
+    range_start = blocks[0]["offset"]
+    range_end = blocks[-1]["offset"] + blocks[-1]["length"]
+    resp = s3_client.get_object(
+        Bucket=bucket, Key=manifest["key"], Range=f"bytes={range_start}-{range_end - 1}"
+    )
+    data = resp["Body"].read()
+
+    events = []
+    for block in blocks:
+        start = block["offset"] - range_start
+        block_data = decompress(
+            data[start : start + block["length"]], manifest["codec"]
+        )
+        events.extend(json.loads(line) for line in block_data.splitlines() if line)
+    return events
@@ -0,0 +1,190 @@
+# Re-badges donors from the ActBlue donations archive in S3.
+#
+# Webhooks badge each donation as it comes in, with the badge rules of the
+# time. After the rules change (see actblue/badges.py), run this to
+# recompute every archived donor's date-based and recurring badges:
+#
+#   python -m actblue.badge_backfill [--bucket ...] [--dry-run]
+#
+# It reads both the per-donation JSON objects and the compressed segments
+# (see actblue/archive.py), keeping just the email, paidAt and recurring
+# flag of each donation as columns. Badges are then computed for all
+# donations at once with numpy: each donation's US/Eastern day is found by
+# binary search over the UTC timestamps of Eastern midnights, its badges
+# are looked up in the BadgeCalendar as a bitmask, and bitmasks are OR'd
+# together per donor.
+#
+# Other badges (e.g. merch) are left alone, as are donors who have no
+# donations in the archive. numpy is only needed here, not by the webhook,
+# so it isn't in the Pipfile; pip install it before running this.
+
+import argparse
+import datetime
+import json
+import logging
+
+import boto3
+
+from actblue.actblue import is_recurring, paid_at_of_donation
+from actblue.archive import MANIFEST_SUFFIX, read_segment_events
+from actblue.badges import EASTERN, BadgeCalendar, badge_calendar, eastern_date
+from common.settings import settings
+from models.donor import Donor
+
+DONATIONS_PREFIX = "donations/"
+SEGMENTS_PREFIX = "donations/segments/"
+
+Donor.Meta.table_name = settings.donors_table_name
+
+
+def list_keys(s3_client, bucket, prefix):
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            yield obj["Key"]
+
+
+def read_archived_donations(s3_client, bucket):
+    """Yields every donation event archived in bucket, in either format."""
+    for key in list_keys(s3_client, bucket, DONATIONS_PREFIX):
+        if key.startswith(SEGMENTS_PREFIX):
+            if key.endswith(MANIFEST_SUFFIX):
+                body = s3_client.get_object(Bucket=bucket, Key=key)["Body"].read()
+                yield from read_segment_events(s3_client, bucket, json.loads(body))
+        elif key.endswith(".json"):
+            body = s3_client.get_object(Bucket=bucket, Key=key)["Body"].read()
+            yield json.loads(body)
+
+
+def donation_columns(events):
+    """Returns (emails, paid_at epoch seconds, is recurring) lists."""
+    emails = []
+    paid_at_seconds = []
+    recurring = []
+    for event in events:
+        email = event.get("donor", {}).get("email")
+        if not email:
+            continue
+        emails.append(email)
+        paid_at_seconds.append(int(paid_at_of_donation(event).timestamp()))
+        recurring.append(bool(is_recurring(event["contribution"])))
+    return emails, paid_at_seconds, recurring
+
+
+def compute_badges(rules, emails, paid_at_seconds, recurring):
+    """Returns dict of email to the set of badges from rules its donations earn.
+
+    Includes the recurring badge. The three arguments after rules are
+    columns, one entry per donation, as from donation_columns.
+    """
+    import numpy as np
+
+    if not emails:
+        return {}
+    paid_at_seconds = np.asarray(paid_at_seconds, dtype=np.int64)
+
+    def eastern_date_of_seconds(seconds):
+        return eastern_date(
+            datetime.datetime.fromtimestamp(int(seconds), datetime.timezone.utc)
+        )
+
+    calendar = BadgeCalendar(
+        rules,
+        eastern_date_of_seconds(paid_at_seconds.min()),
+        eastern_date_of_seconds(paid_at_seconds.max()) + datetime.timedelta(days=1),
+    )
+    badge_ids = sorted(rules.badge_ids() | {Donor.BadgeId.RECURRING.value})
+    bits = {badge: 1 << i for i, badge in enumerate(badge_ids)}
+
+    day_starts = np.array(
+        [
+            EASTERN.localize(
+                datetime.datetime.combine(
+                    calendar.start + datetime.timedelta(days=i), datetime.time()
+                )
+            ).timestamp()
+            for i in range(len(calendar.day_badges))
+        ],
+        dtype=np.int64,
+    )
+    day_masks = np.array(
+        [sum(bits[badge] for badge in badges) for badges in calendar.day_badges],
+        dtype=np.int64,
+    )
+
+    days = np.searchsorted(day_starts, paid_at_seconds, side="right") - 1
+    masks = day_masks[days] | np.where(
+        np.asarray(recurring, dtype=bool), bits[Donor.BadgeId.RECURRING.value], 0
+    )
+
+    donor_emails, donor_of_donation = np.unique(
+        np.asarray(emails, dtype=object), return_inverse=True
+    )
+    donor_masks = np.zeros(len(donor_emails), dtype=np.int64)
+    np.bitwise_or.at(donor_masks, donor_of_donation, masks)
+
+    return {
+        email: {badge for badge, bit in bits.items() if mask & bit}
+        for email, mask in zip(donor_emails.tolist(), donor_masks.tolist())
+    }
+
+
+def rebadge_donors(badges_by_email, recomputed_badges, dry_run=False):
+    """Replaces the recomputed_badges of each donor in badges_by_email.
+
+    Returns the number of donors whose badges changed. Donors are only
+    written if they did (see models/dirty_tracking.py).
+    """
+    changed = 0
+    for donor in Donor.batch_get(badges_by_email.keys()):
+        kept_badges = (donor.badges or set()) - recomputed_badges
+        donor.badges = kept_badges | badges_by_email[donor.email]
+        if not donor.is_dirty():
+            continue
+        changed += 1
+        if dry_run:
+            logging.info(f"Would set badges of {donor.email} to {donor.badges}")
+        else:
+            donor.save()
+    return changed
+
+
+def backfill_badges(bucket, rules=None, s3_client=None, dry_run=False):
+    """Re-badges every donor with donations archived in bucket.
+
+    rules defaults to the current badge rules. Returns the number of
+    donors whose badges changed.
+    """
+    if rules is None:
+        rules = badge_calendar().rules
+    s3_client = s3_client if s3_client else boto3.client("s3")
+
+    emails, paid_at_seconds, recurring = donation_columns(
+        read_archived_donations(s3_client, bucket)
+    )
+    logging.info(f"Read {len(emails)} archived donations")
+    badges_by_email = compute_badges(rules, emails, paid_at_seconds, recurring)
+    return rebadge_donors(
+        badges_by_email,
+        rules.badge_ids() | {Donor.BadgeId.RECURRING.value},
+        dry_run=dry_run,
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Re-badge donors from the ActBlue donations archive"
+    )
+    parser.add_argument(
+        "--bucket",
+        default=settings.actblue_donations_incoming_s3_bucket,
+        help="The ActBlue donations S3 bucket",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Log changes instead of saving them"
+    )
+    args = parser.parse_args()
+
+    changed = backfill_badges(args.bucket, dry_run=args.dry_run)
+    print(f"Changed badges of {changed} donors.")
@@ -0,0 +1,202 @@
+# Date-based donor badges.
+#
+# Which badges a donation earns from its date (end of month, end of
+# quarter, debate days, ...) is decided by BadgeRules. Rather than checking
+# every rule for every donation, BadgeCalendar precomputes the badges of
+# each day of the campaign, so looking them up is an index into a list.
+#
+# Days are US/Eastern days, like Donor.last_donation_dt: a donation at
+# 11:30pm Eastern on June 30 is an end of quarter donation, even though
+# it's July 1 in UTC.
+#
+# The rules can be changed without a deploy by putting JSON like this in
+# GenericKV under BADGE_RULES_KEY:
+#
+#   {
+#     "end_of_period_from_day": 26,
+#     "dates": {"debate": ["2019-06-26", "2019-06-27"]}
+#   }
+#
+# Donations are then badged with the new rules within a minute or so (see
+# models/generic_kv.py); use actblue/badge_backfill.py to re-badge past
+# donations.
+
+import datetime
+import json
+import logging
+import time
+from functools import lru_cache
+
+import pytz
+
+from models.donor import Donor
+from models.generic_kv import CACHE_TTL_SECONDS, GenericKV
+
+EASTERN = pytz.timezone("US/Eastern")
+
+BADGE_RULES_KEY = "actblue_badge_rules"
+
+DEFAULT_END_OF_PERIOD_FROM_DAY = 26
+
+DEBATE_DONOR_DAYS = [
+    datetime.date(2019, 6, 26),
+    datetime.date(2019, 6, 27),
+    datetime.date(2019, 7, 30),
+    datetime.date(2019, 7, 31),
+    datetime.date(2019, 9, 12),
+    datetime.date(2019, 9, 13),
+    datetime.date(2019, 10, 15),
+    datetime.date(2019, 10, 16),
+    datetime.date(2019, 11, 20),
+    datetime.date(2019, 11, 21),
+    datetime.date(2019, 12, 19),
+    datetime.date(2019, 12, 20),
+]
+
+# BadgeCalendar precomputes [CALENDAR_START, CALENDAR_END); days outside
+# it still work, they're just computed from the rules when asked for.
+CALENDAR_START = datetime.date(2019, 1, 1)
+CALENDAR_END = datetime.date(2021, 1, 1)
+
+
+def eastern_date(ts):
+    """The US/Eastern date of an aware datetime."""
+    return ts.astimezone(EASTERN).date()
+
+
+class BadgeRules:
+    """Which badges (Donor.BadgeId values) a donation on a given day earns.
+
+    Donations from day end_of_period_from_day of a month onwards earn
+    "eoq" in the last month of a quarter and "eom" in the others. dates
+    maps a badge to the days that earn it.
+    """
+
+    def __init__(
+        self, end_of_period_from_day=DEFAULT_END_OF_PERIOD_FROM_DAY, dates=None
+    ):
+        if not 1 <= end_of_period_from_day <= 31:
+            raise ValueError(
+                f"Invalid end_of_period_from_day: {end_of_period_from_day}"
+            )
+        self.end_of_period_from_day = end_of_period_from_day
+        self.dates = {}
+        valid_badges = {badge.value for badge in Donor.BadgeId}
+        for badge, days in (dates or {}).items():
+            if badge not in valid_badges:
+                raise ValueError(f"Unknown badge: {badge}")
+            self.dates[badge] = frozenset(days)
+
+    @staticmethod
+    def from_json(rules_json):
+        rules = json.loads(rules_json)
+        return BadgeRules(
+            end_of_period_from_day=rules.get(
+                "end_of_period_from_day", DEFAULT_END_OF_PERIOD_FROM_DAY
+            ),
+            dates={
+                badge: [datetime.date.fromisoformat(day) for day in days]
+                for badge, days in rules.get("dates", {}).items()
+            },
+        )
+
+    def badges_on(self, day):
+        badges = set()
+        if day.day >= self.end_of_period_from_day:
+            if day.month % 3 == 0:
+                badges.add(Donor.BadgeId.EOQ.value)
+            else:
+                badges.add(Donor.BadgeId.EOM.value)
+        for badge, days in self.dates.items():
+            if day in days:
+                badges.add(badge)
+        return frozenset(badges)
+
+    def badge_ids(self):
+        """Every badge these rules can give."""
+        return frozenset(
+            [Donor.BadgeId.EOM.value, Donor.BadgeId.EOQ.value, *self.dates]
+        )
+
+
+DEFAULT_BADGE_RULES = BadgeRules(dates={Donor.BadgeId.DEBATE.value: DEBATE_DONOR_DAYS})
+
+
+class BadgeCalendar:
+    """BadgeRules precomputed for every day in [start, end)."""
+
+    def __init__(self, rules, start=CALENDAR_START, end=CALENDAR_END):
+        self.rules = rules
+        self.start = start
+        self.end = end
+        self.day_badges = [
+            rules.badges_on(start + datetime.timedelta(days=i))
+            for i in range((end - start).days)
+        ]
+
+    def badges_on(self, day):
+        i = (day - self.start).days
+        if 0 <= i < len(self.day_badges):
+            return self.day_badges[i]
+        return self.rules.badges_on(day)
+
+    def badges_at(self, ts):
+        """Badges earned by a donation at ts, an aware datetime."""
+        return self.badges_on(eastern_date(ts))
+
+
+@lru_cache(maxsize=1)
+def default_badge_calendar():
+    return BadgeCalendar(DEFAULT_BADGE_RULES)
+
+
+# The calendar for the rules in GenericKV, their etag, and when to look
+# for new rules next. Like GenericKV's own cache, this also remembers for a
+# while that there are no rules, so donations don't each cost a read.
+_configured_calendar = (None, None, 0)
+
+
+def badge_calendar():
+    """The BadgeCalendar for the current rules.
+
+    Those are the rules in GenericKV if there are any (and they're valid),
+    or DEFAULT_BADGE_RULES otherwise. This is on the webhook's path, so if
+    GenericKV can't be read (e.g. we're throttled), we keep using the last
+    calendar we had rather than failing the donation.
+    """
+    global _configured_calendar
+    etag, calendar, expires_at = _configured_calendar
+    if time.time() < expires_at:
+        return calendar
+
+    try:
+        rules_json, new_etag = GenericKV.get_cached_value(BADGE_RULES_KEY)
+    except GenericKV.DoesNotExist:
+        rules_json, new_etag = None, None
+    except Exception:
+        logging.exception("Couldn't read badge rules from GenericKV")
+        if calendar is None:
+            calendar = default_badge_calendar()
+        # Try again once the usual TTL is up, rather than on every donation.
+        _configured_calendar = (etag, calendar, time.time() + CACHE_TTL_SECONDS)
+        return calendar
+    if calendar is None or new_etag != etag:
+        calendar = calendar_for_rules_json(rules_json)
+    _configured_calendar = (new_etag, calendar, time.time() + CACHE_TTL_SECONDS)
+    return calendar
+
+
+def calendar_for_rules_json(rules_json):
+    if not rules_json:
+        return default_badge_calendar()
+    try:
+        return BadgeCalendar(BadgeRules.from_json(rules_json))
+    except (ValueError, TypeError, AttributeError, KeyError):
+        logging.exception("Invalid badge rules in GenericKV; using the defaults")
+        return default_badge_calendar()
+
+
+def clear_badge_calendar_cache():
+    """Forgets the rules read from GenericKV, e.g. between tests."""
+    global _configured_calendar
+    _configured_calendar = (None, None, 0)
@@ -0,0 +1,183 @@
+# Durable buffer for incoming ActBlue webhook payloads.
+#
+# In "queue" ingestion mode, /actblue/donation and /actblue/cancellation
+# enqueue the raw webhook event instead of firing one Zappa task per
+# webhook. A scheduled drain (actblue.drain_donation_queue) then pulls
+# events off the queue and processes them in micro-batches.
+#
+# SqsIngestionQueue is what runs in the cloud. FileIngestionQueue is a
+# local stand-in backed by a directory of JSON files, so the whole flow
+# can be exercised offline in tests and on the dev server.
+
+import itertools
+import json
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from functools import lru_cache
+
+import boto3
+
+from common.settings import settings
+
+SQS_REGION_NAME = "us-east-2"
+
+# SQS limits for ReceiveMessage and DeleteMessageBatch.
+SQS_MAX_MESSAGES_PER_REQUEST = 10
+
+FILE_QUEUE_URL_PREFIX = "file://"
+
+EVENT_KIND_DONATION = "donation"
+EVENT_KIND_CANCELLATION = "cancellation"
+
+# Tie-breaker for events put within the same clock tick.
+_file_queue_sequence = itertools.count()
+
+
+@dataclass
+class QueuedEvent:
+    # Opaque handle used to acknowledge the event once it's processed.
+    receipt: str
+    kind: str
+    event: dict
+
+    @staticmethod
+    def from_message(receipt, message):
+        d = json.loads(message)
+        return QueuedEvent(receipt, d["kind"], d["event"])
+
+
+def _to_message(event, kind):
+    return json.dumps({"kind": kind, "event": event})
+
+
+class SqsIngestionQueue:
+    def __init__(self, queue_url, sqs_client=None):
+        self.queue_url = queue_url
+        self.sqs = (
+            sqs_client
+            if sqs_client
+            else boto3.client("sqs", region_name=SQS_REGION_NAME)
+        )
+
+    def put(self, event, kind=EVENT_KIND_DONATION):
+        self.sqs.send_message(
+            QueueUrl=self.queue_url, MessageBody=_to_message(event, kind)
+        )
+
+    def receive(self, max_events):
+        """Receives up to max_events events, stopping early if the queue is empty."""
+        queued_events = []
+        while len(queued_events) < max_events:
+            resp = self.sqs.receive_message(
+                QueueUrl=self.queue_url,
+                MaxNumberOfMessages=min(
+                    SQS_MAX_MESSAGES_PER_REQUEST, max_events - len(queued_events)
+                ),
+            )
+            messages = resp.get("Messages", [])
+            if not messages:
+                break
+            for message in messages:
+                queued_events.append(
+                    QueuedEvent.from_message(message["ReceiptHandle"], message["Body"])
+                )
+        return queued_events
+
+    def ack(self, receipts):
+        for i in range(0, len(receipts), SQS_MAX_MESSAGES_PER_REQUEST):
+            chunk = receipts[i : i + SQS_MAX_MESSAGES_PER_REQUEST]
+            resp = self.sqs.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    {"Id": str(j), "ReceiptHandle": receipt}
+                    for j, receipt in enumerate(chunk)
+                ],
+            )
+            for failure in resp.get("Failed", []):
+                # The message will become visible again and be re-processed.
+                # create_donor_object dedupes on paidAt, and the archive
+                # tolerates duplicates.
+                logging.warning(f"Failed to delete message from SQS: {failure}")
+
+
+class FileIngestionQueue:
+    """Queue backed by one JSON file per event in a local directory.
+
+    Received events are renamed to *.inflight until acknowledged. Like an
+    SQS visibility timeout, in-flight events that haven't been acked
+    within visibility_timeout_seconds are handed out again, so a crashed
+    drain never loses donations.
+    """
+
+    PENDING_SUFFIX = ".json"
+    INFLIGHT_SUFFIX = ".inflight"
+
+    def __init__(self, directory, visibility_timeout_seconds=5 * 60):
+        self.directory = directory
+        self.visibility_timeout_seconds = visibility_timeout_seconds
+        os.makedirs(self.directory, exist_ok=True)
+
+    def put(self, event, kind=EVENT_KIND_DONATION):
+        # Timestamp prefix keeps events roughly in arrival order.
+        name = f"{time.time_ns():020d}_{next(_file_queue_sequence):012d}_{uuid.uuid4().hex}"
+        tmp_path = os.path.join(self.directory, f".{name}.tmp")
+        with open(tmp_path, "w") as f:
+            f.write(_to_message(event, kind))
+        os.replace(tmp_path, os.path.join(self.directory, name + self.PENDING_SUFFIX))
+
+    def receive(self, max_events):
+        queued_events = []
+        for filename in sorted(os.listdir(self.directory)):
+            if len(queued_events) >= max_events:
+                break
+
+            path = os.path.join(self.directory, filename)
+            if filename.endswith(self.PENDING_SUFFIX):
+                name = filename[: -len(self.PENDING_SUFFIX)]
+            elif filename.endswith(self.INFLIGHT_SUFFIX) and self._lease_expired(path):
+                name = filename[: -len(self.INFLIGHT_SUFFIX)]
+            else:
+                continue
+
+            inflight_path = os.path.join(self.directory, name + self.INFLIGHT_SUFFIX)
+            try:
+                os.replace(path, inflight_path)
+                # Renaming doesn't touch mtime, so restart the lease explicitly.
+                os.utime(inflight_path)
+                with open(inflight_path) as f:
+                    message = f.read()
+            except FileNotFoundError:
+                # Another drain got to it first.
+                continue
+            queued_events.append(QueuedEvent.from_message(name, message))
+        return queued_events
+
+    def ack(self, receipts):
+        for name in receipts:
+            try:
+                os.remove(os.path.join(self.directory, name + self.INFLIGHT_SUFFIX))
+            except FileNotFoundError:
+                logging.warning(f"Acked event {name} that was not in flight")
+
+    def _lease_expired(self, path):
+        try:
+            leased_at = os.path.getmtime(path)
+        except FileNotFoundError:
+            return False
+        return time.time() - leased_at > self.visibility_timeout_seconds
+
+
+def get_ingestion_queue():
+    return _ingestion_queue(settings.actblue_ingestion_queue_url)
+
+
+@lru_cache(maxsize=None)
+def _ingestion_queue(queue_url):
+    # Every queued webhook needs the queue, so we only create it (and its
+    # SQS client) once per process.
+    if queue_url.startswith(FILE_QUEUE_URL_PREFIX):
+        return FileIngestionQueue(queue_url[len(FILE_QUEUE_URL_PREFIX) :])
+    return SqsIngestionQueue(queue_url)
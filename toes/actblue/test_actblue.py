@@ -9,9 +9,14 @@ import responses
 from flask import url_for
 from moto import mock_cloudwatch, mock_s3
 
+from actblue.actblue import apply_donations_atomically, drain_donation_queue
+from actblue.archive import read_segment_events
+from actblue.ingestion_queue import EVENT_KIND_CANCELLATION, FileIngestionQueue
 from common.basic_auth import mock_basic_auth, mock_wrong_auth
-from common.settings import settings
+from common.profile_exists_cache import profile_exists_cache
+from common.settings import Settings, settings
 from models.donor import Donor
+from models.mobile_commons_profile_cache import MobileCommonsProfileCache
 
 # In the sample, the donation was made at 2019-06-07T15:49:32-04:00
 LAGGED_ALLOWED_WEBHOOK_NOTIFICATION_TIME = "2019-06-07T20:32:24Z"
@@ -96,6 +101,12 @@ def mock_donor_id_salt():
     settings.override_cached_property("donor_id_salt", "salt")
 
 
+@pytest.fixture(autouse=True)
+def clear_profile_exists_cache():
+    # The DynamoDB tier is cleared along with every other table.
+    profile_exists_cache.clear()
+
+
 @pytest.fixture
 def sample_donation():
     with open(os.path.join(os.path.dirname(__file__), "sample_donation.json")) as f:
@@ -154,6 +165,32 @@ def mock_actblue_webhook_wrong_auth():
     return mock_wrong_auth("actblue_webhook")
 
 
+@pytest.fixture
+def queue_ingestion_mode(tmp_path):
+    settings.override_cached_property(
+        "actblue_ingestion_mode", Settings.ACTBLUE_INGESTION_MODE_QUEUE
+    )
+    settings.override_cached_property(
+        "actblue_ingestion_queue_url", f"file://{tmp_path}"
+    )
+    yield FileIngestionQueue(str(tmp_path))
+    settings.override_cached_property(
+        "actblue_ingestion_mode", Settings.ACTBLUE_INGESTION_MODE_TASK
+    )
+
+
+@pytest.fixture
+def atomic_donor_aggregation():
+    settings.override_cached_property(
+        "actblue_donor_aggregation", Settings.ACTBLUE_DONOR_AGGREGATION_ATOMIC
+    )
+    yield
+    settings.override_cached_property(
+        "actblue_donor_aggregation",
+        Settings.ACTBLUE_DONOR_AGGREGATION_READ_MODIFY_WRITE,
+    )
+
+
 def setup_mock_s3():
     settings.override_cached_property(
         "actblue_donations_incoming_s3_bucket", "ew-actblue-donations-incoming-dev"
@@ -313,6 +350,82 @@ def test_mobile_commons_profile_upload(
     assert len(responses.calls) == 2
     assert res.status_code == 204
 
+    # We just created the profile, so the next donation from this number
+    # doesn't need to ask Mobile Commons.
+    assert MobileCommonsProfileCache.get("15105016227").has_profile
+    res = client.post(
+        url_for("actblue.donation"),
+        headers={"Authorization": mock_actblue_webhook_auth},
+        data=sample_donation,
+    )
+    assert len(responses.calls) == 2
+    assert res.status_code == 204
+
+
+@mock_s3
+@mock_cloudwatch
+@responses.activate
+@freezegun.freeze_time(LAGGED_ALLOWED_WEBHOOK_NOTIFICATION_TIME)
+def test_mobile_commons_profile_exists_cached(
+    client, sample_donation, mock_actblue_webhook_auth
+):
+    setup_mock_s3()
+    responses.add(
+        responses.POST,
+        "https://secure.mcommons.com/api/profile",
+        body=MOBILE_COMMONS_PROFILE_RESPONSE,
+        match_querystring=True,
+    )
+
+    for _ in range(3):
+        res = client.post(
+            url_for("actblue.donation"),
+            headers={"Authorization": mock_actblue_webhook_auth},
+            data=sample_donation,
+        )
+        assert res.status_code == 204
+    assert len(responses.calls) == 1
+
+    # Another Lambda, with a cold in-process cache, still doesn't ask
+    # Mobile Commons thanks to the shared DynamoDB tier.
+    profile_exists_cache.clear()
+    res = client.post(
+        url_for("actblue.donation"),
+        headers={"Authorization": mock_actblue_webhook_auth},
+        data=sample_donation,
+    )
+    assert res.status_code == 204
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+@freezegun.freeze_time(LAGGED_ALLOWED_WEBHOOK_NOTIFICATION_TIME)
+def test_mobile_commons_profile_not_exists_cached_briefly():
+    responses.add(
+        responses.POST,
+        "https://secure.mcommons.com/api/profile",
+        body=MOBILE_COMMONS_PROFILE_NOT_EXIST_RESPONSE,
+        match_querystring=True,
+    )
+
+    assert profile_exists_cache.profile_exists("u", "p", "15105016227") is False
+    assert profile_exists_cache.profile_exists("u", "p", "15105016227") is False
+    assert len(responses.calls) == 1
+
+    with freezegun.freeze_time("2019-06-07T20:52:24Z"):
+        assert profile_exists_cache.profile_exists("u", "p", "15105016227") is False
+    assert len(responses.calls) == 2
+
+    metric_data = {
+        (m["MetricName"], tuple(d["Value"] for d in m["Dimensions"])): m["Value"]
+        for m in profile_exists_cache.metric_data()
+    }
+    assert metric_data == {
+        ("mobile_commons_profile_cache_hits", ("memory",)): 1,
+        ("mobile_commons_profile_cache_hits", ("dynamo",)): 0,
+        ("mobile_commons_profile_cache_misses", ()): 2,
+    }
+
 
 @mock_s3
 @mock_cloudwatch
@@ -527,3 +640,380 @@ def test_create_multiple_donors(
     assert d.total_donation_amount == 15.0
     assert d.badges == set()
     assert res.status_code == 204
+
+
+@mock_s3
+@mock_cloudwatch
+@responses.activate
+@freezegun.freeze_time(LAGGED_ALLOWED_WEBHOOK_NOTIFICATION_TIME)
+def test_queue_ingestion_mode_defers_processing(
+    client, sample_donation_no_phone, mock_actblue_webhook_auth, queue_ingestion_mode
+):
+    s3_resource = setup_mock_s3()
+    res = client.post(
+        url_for("actblue.donation"),
+        headers={"Authorization": mock_actblue_webhook_auth},
+        data=sample_donation_no_phone,
+    )
+    assert res.status_code == 204
+
+    # Nothing is processed until the queue is drained.
+    bucket = s3_resource.Bucket(settings.actblue_donations_incoming_s3_bucket)
+    assert list(bucket.objects.all()) == []
+    assert Donor.get_or_create_donor("marysmithexample@gmail.com").donor_id is None
+
+    queued_events = queue_ingestion_mode.receive(10)
+    assert [q.event for q in queued_events] == [json.loads(sample_donation_no_phone)]
+
+
+@mock_s3
+@mock_cloudwatch
+@responses.activate
+@freezegun.freeze_time(LAGGED_ALLOWED_WEBHOOK_NOTIFICATION_TIME)
+def test_drain_donation_queue(
+    client,
+    sample_donation_no_phone,
+    sample_donation_followup,
+    sample_donation_different_person,
+    mock_actblue_webhook_auth,
+    queue_ingestion_mode,
+):
+    s3_resource = setup_mock_s3()
+    donations = [
+        sample_donation_followup,
+        sample_donation_no_phone,
+        # Duplicate webhook notification is a no-op.
+        sample_donation_no_phone,
+        sample_donation_different_person,
+    ]
+    for donation in donations:
+        res = client.post(
+            url_for("actblue.donation"),
+            headers={"Authorization": mock_actblue_webhook_auth},
+            data=donation,
+        )
+        assert res.status_code == 204
+
+    drain_donation_queue()
+    assert queue_ingestion_mode.receive(10) == []
+
+    # Events are archived in compressed segments partitioned by paidAt
+    # hour, each with a manifest.
+    bucket = s3_resource.Bucket(settings.actblue_donations_incoming_s3_bucket)
+    assert sorted(o.key for o in bucket.objects.all()) == [
+        "donations/segments/dt=2019-06-07/hour=19/2019-06-07_20:32:24_AB999999_2.ndjson.gz",
+        "donations/segments/dt=2019-06-07/hour=19/2019-06-07_20:32:24_AB999999_2.ndjson.gz.manifest",
+        "donations/segments/dt=2019-06-10/hour=19/2019-06-07_20:32:24_AB999997_1.ndjson.gz",
+        "donations/segments/dt=2019-06-10/hour=19/2019-06-07_20:32:24_AB999997_1.ndjson.gz.manifest",
+        "donations/segments/dt=2019-06-26/hour=19/2019-06-07_20:32:24_AB999998_1.ndjson.gz",
+        "donations/segments/dt=2019-06-26/hour=19/2019-06-07_20:32:24_AB999998_1.ndjson.gz.manifest",
+    ]
+    manifest = json.loads(
+        bucket.Object(
+            "donations/segments/dt=2019-06-07/hour=19/2019-06-07_20:32:24_AB999999_2.ndjson.gz.manifest"
+        )
+        .get()["Body"]
+        .read()
+    )
+    assert manifest["record_count"] == 2
+    assert (
+        read_segment_events(
+            s3_resource.meta.client,
+            settings.actblue_donations_incoming_s3_bucket,
+            manifest,
+        )
+        == [json.loads(sample_donation_no_phone)] * 2
+    )
+
+    # Donations are applied in paidAt order even though the followup was
+    # queued first.
+    d = Donor.get_or_create_donor("marysmithexample@gmail.com")
+    assert d.donor_id == "auAhIJZkUafh"
+    assert d.last_donation_dt == "2019-06-26"
+    assert d.last_donation_amount == 75.0
+    assert d.total_donation_amount == 125.0
+    assert d.badges == {"debate", "eoq"}
+
+    d = Donor.get_or_create_donor("johnsmithexample@gmail.com")
+    assert d.donor_id == "vAIiTVlF8jOS"
+    assert d.total_donation_amount == 15.0
+
+
+@mock_s3
+@mock_cloudwatch
+@responses.activate
+@freezegun.freeze_time(LAGGED_ALLOWED_WEBHOOK_NOTIFICATION_TIME)
+def test_create_donor_object_atomically(
+    client,
+    sample_donation_no_phone,
+    sample_donation_followup,
+    sample_donation_followup_recurring,
+    mock_actblue_webhook_auth,
+    atomic_donor_aggregation,
+):
+    setup_mock_s3()
+    for donation in [
+        sample_donation_no_phone,
+        # Duplicate webhook notification is a no-op.
+        sample_donation_no_phone,
+    ]:
+        res = client.post(
+            url_for("actblue.donation"),
+            headers={"Authorization": mock_actblue_webhook_auth},
+            data=donation,
+        )
+        assert res.status_code == 204
+
+    d = Donor.get("marysmithexample@gmail.com")
+    assert d.first_name == "Mary"
+    assert d.last_name == "Smith"
+    assert d.donor_id == "auAhIJZkUafh"
+    assert d.city == "Richmond"
+    assert d.state == "CA"
+    assert d.zip == "94801"
+    assert d.last_donation_dt == "2019-06-07"
+    assert d.last_donation_ts == datetime.datetime(
+        2019, 6, 7, 19, 49, 39, tzinfo=datetime.timezone.utc
+    )
+    assert d.last_donation_amount == 50.0
+    assert d.last_donation_type == "actblue"
+    assert d.total_donation_amount == 50.0
+    assert d.badges == set()
+    assert d.created_at == datetime.datetime(
+        2019, 6, 7, 20, 32, 24, tzinfo=datetime.timezone.utc
+    )
+
+    res = client.post(
+        url_for("actblue.donation"),
+        headers={"Authorization": mock_actblue_webhook_auth},
+        data=sample_donation_followup,
+    )
+    d = Donor.get("marysmithexample@gmail.com")
+    assert d.donor_id == "auAhIJZkUafh"
+    assert d.last_donation_dt == "2019-06-26"
+    assert d.last_donation_amount == 75.0
+    assert d.total_donation_amount == 125.0
+    assert d.badges == {"debate", "eoq"}
+
+    res = client.post(
+        url_for("actblue.donation"),
+        headers={"Authorization": mock_actblue_webhook_auth},
+        data=sample_donation_followup_recurring,
+    )
+    d = Donor.get("marysmithexample@gmail.com")
+    assert d.donor_id == "auAhIJZkUafh"
+    assert d.last_donation_dt == "2019-07-26"
+    assert d.last_donation_amount == 5.0
+    assert d.total_donation_amount == 130.0
+    assert d.badges == {"debate", "eoq", "eom", "recurring"}
+
+
+def test_apply_donations_atomically_drops_older_donations(
+    sample_donation_no_phone, sample_donation_followup
+):
+    email = "marysmithexample@gmail.com"
+    assert (
+        apply_donations_atomically(email, [json.loads(sample_donation_followup)]) == 1
+    )
+
+    # Lost the race to a newer donation: the conditional update fails, and
+    # on retry there's nothing left to apply.
+    assert (
+        apply_donations_atomically(email, [json.loads(sample_donation_no_phone)]) == 0
+    )
+
+    d = Donor.get(email)
+    assert d.last_donation_dt == "2019-06-26"
+    assert d.last_donation_amount == 75.0
+    assert d.total_donation_amount == 75.0
+
+
+@mock_s3
+@mock_cloudwatch
+@responses.activate
+@freezegun.freeze_time(LAGGED_ALLOWED_WEBHOOK_NOTIFICATION_TIME)
+def test_drain_donation_queue_atomically(
+    client,
+    sample_donation_no_phone,
+    sample_donation_followup,
+    sample_donation_followup_recurring,
+    sample_donation_different_person,
+    mock_actblue_webhook_auth,
+    queue_ingestion_mode,
+    atomic_donor_aggregation,
+):
+    setup_mock_s3()
+    donations = [
+        sample_donation_followup,
+        sample_donation_no_phone,
+        sample_donation_no_phone,
+        sample_donation_different_person,
+        sample_donation_followup_recurring,
+    ]
+    for donation in donations:
+        res = client.post(
+            url_for("actblue.donation"),
+            headers={"Authorization": mock_actblue_webhook_auth},
+            data=donation,
+        )
+        assert res.status_code == 204
+
+    drain_donation_queue()
+    assert queue_ingestion_mode.receive(10) == []
+
+    # Mary's three distinct donations are coalesced into one update, as of
+    # the latest one.
+    d = Donor.get("marysmithexample@gmail.com")
+    assert d.donor_id == "auAhIJZkUafh"
+    assert d.last_donation_dt == "2019-07-26"
+    assert d.last_donation_amount == 5.0
+    assert d.total_donation_amount == 130.0
+    assert d.badges == {"debate", "eoq", "eom", "recurring"}
+
+    d = Donor.get("johnsmithexample@gmail.com")
+    assert d.donor_id == "vAIiTVlF8jOS"
+    assert d.total_donation_amount == 15.0
+
+
+@mock_s3
+@mock_cloudwatch
+@responses.activate
+@freezegun.freeze_time(LAGGED_ALLOWED_WEBHOOK_NOTIFICATION_TIME)
+def test_drain_donation_queue_dead_letters_malformed_events(
+    client, sample_donation_no_phone, queue_ingestion_mode
+):
+    s3_resource = setup_mock_s3()
+    malformed = json.loads(sample_donation_no_phone)
+    del malformed["lineitems"][-1]["paidAt"]
+    queue_ingestion_mode.put(malformed)
+    queue_ingestion_mode.put(json.loads(sample_donation_no_phone))
+    queue_ingestion_mode.put({"contribution": {}}, EVENT_KIND_CANCELLATION)
+
+    drain_donation_queue()
+    assert queue_ingestion_mode.receive(10) == []
+
+    bucket = s3_resource.Bucket(settings.actblue_donations_incoming_s3_bucket)
+    dead_letters = [
+        json.loads(o.get()["Body"].read())
+        for o in bucket.objects.filter(Prefix="dead_letter/")
+    ]
+    assert sorted(d["kind"] for d in dead_letters) == ["cancellation", "donation"]
+    assert malformed in [d["event"] for d in dead_letters]
+
+    # The rest of the batch is processed as usual.
+    assert Donor.get("marysmithexample@gmail.com").total_donation_amount == 50.0
+    assert [o.key for o in bucket.objects.filter(Prefix="donations/")] == [
+        "donations/segments/dt=2019-06-07/hour=19/2019-06-07_20:32:24_AB999999_1.ndjson.gz",
+        "donations/segments/dt=2019-06-07/hour=19/2019-06-07_20:32:24_AB999999_1.ndjson.gz.manifest",
+    ]
+
+
+class RecordingQueue(FileIngestionQueue):
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.calls = []
+
+    def receive(self, max_events):
+        queued_events = super().receive(max_events)
+        self.calls.append(("receive", len(queued_events)))
+        return queued_events
+
+    def ack(self, receipts):
+        self.calls.append(("ack", len(receipts)))
+        super().ack(receipts)
+
+
+def drain_into_recording_queue(monkeypatch, tmp_path, events):
+    queue = RecordingQueue(str(tmp_path))
+    for event in events:
+        queue.put(json.loads(event))
+    monkeypatch.setattr("actblue.actblue.get_ingestion_queue", lambda: queue)
+    settings.override_cached_property("actblue_ingestion_batch_size", 1)
+    try:
+        drain_donation_queue()
+    finally:
+        settings.override_cached_property("actblue_ingestion_batch_size", 100)
+    return queue
+
+
+@mock_s3
+@mock_cloudwatch
+@responses.activate
+@freezegun.freeze_time(LAGGED_ALLOWED_WEBHOOK_NOTIFICATION_TIME)
+def test_drain_donation_queue_archives_batches_together(
+    monkeypatch, tmp_path, sample_donation_no_phone, queue_ingestion_mode
+):
+    s3_resource = setup_mock_s3()
+    # A duplicate webhook, so both land in the same hour partition.
+    queue = drain_into_recording_queue(
+        monkeypatch, tmp_path, [sample_donation_no_phone, sample_donation_no_phone]
+    )
+
+    # Both batches went into one segment, written and acked at the end.
+    assert queue.calls == [
+        ("receive", 1),
+        ("receive", 1),
+        ("receive", 0),
+        ("ack", 2),
+    ]
+    bucket = s3_resource.Bucket(settings.actblue_donations_incoming_s3_bucket)
+    assert [o.key for o in bucket.objects.all()] == [
+        "donations/segments/dt=2019-06-07/hour=19/2019-06-07_20:32:24_AB999999_2.ndjson.gz",
+        "donations/segments/dt=2019-06-07/hour=19/2019-06-07_20:32:24_AB999999_2.ndjson.gz.manifest",
+    ]
+
+
+@mock_s3
+@mock_cloudwatch
+@responses.activate
+@freezegun.freeze_time(LAGGED_ALLOWED_WEBHOOK_NOTIFICATION_TIME)
+def test_drain_donation_queue_flushes_old_segments(
+    monkeypatch,
+    tmp_path,
+    sample_donation_no_phone,
+    sample_donation_different_person,
+    queue_ingestion_mode,
+):
+    setup_mock_s3()
+    monkeypatch.setattr("actblue.actblue.DRAIN_MAX_SEGMENT_AGE_SECONDS", 0)
+    queue = drain_into_recording_queue(
+        monkeypatch,
+        tmp_path,
+        [sample_donation_no_phone, sample_donation_different_person],
+    )
+
+    # Receipts aren't held once their segment is due, so they can't
+    # outlive the queue's visibility timeout.
+    assert queue.calls == [
+        ("receive", 1),
+        ("ack", 1),
+        ("receive", 1),
+        ("ack", 1),
+        ("receive", 0),
+    ]
+
+
+@mock_s3
+@freezegun.freeze_time(LAGGED_ALLOWED_WEBHOOK_NOTIFICATION_TIME)
+def test_drain_cancellation_queue(
+    client, sample_cancellation, mock_actblue_webhook_auth, queue_ingestion_mode
+):
+    s3_resource = setup_mock_s3()
+    res = client.post(
+        url_for("actblue.cancellation"),
+        headers={"Authorization": mock_actblue_webhook_auth},
+        data=sample_cancellation,
+    )
+    assert res.status_code == 204
+    queued_events = queue_ingestion_mode.receive(10)
+    assert [q.kind for q in queued_events] == [EVENT_KIND_CANCELLATION]
+    queue_ingestion_mode.ack([q.receipt for q in queued_events])
+    queue_ingestion_mode.put(json.loads(sample_cancellation), EVENT_KIND_CANCELLATION)
+
+    drain_donation_queue()
+
+    bucket = s3_resource.Bucket(settings.actblue_donations_incoming_s3_bucket)
+    assert sorted(o.key for o in bucket.objects.all()) == [
+        "cancellations/segments/dt=2019-06-10/hour=17/2019-06-07_20:32:24_AB999999_1.ndjson.gz",
+        "cancellations/segments/dt=2019-06-10/hour=17/2019-06-07_20:32:24_AB999999_1.ndjson.gz.manifest",
+    ]
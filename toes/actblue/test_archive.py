@@ -0,0 +1,169 @@
+import gzip
+import importlib.util
+import json
+
+import boto3
+import freezegun
+import pytest
+from moto import mock_s3
+
+from actblue.archive import (
+    CODEC_GZIP,
+    MANIFEST_SUFFIX,
+    ArchiveWriter,
+    read_segment_events,
+)
+from common.settings import Settings
+
+BUCKET = "ew-actblue-donations-incoming-dev"
+
+
+def make_donation(order_number, paid_at):
+    return {
+        "contribution": {"orderNumber": order_number},
+        "lineitems": [{"paidAt": paid_at}],
+    }
+
+
+@pytest.fixture
+def s3_client():
+    with mock_s3():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def list_keys(s3_client):
+    return [o["Key"] for o in s3_client.list_objects(Bucket=BUCKET).get("Contents", [])]
+
+
+def get_manifest(s3_client, key):
+    body = s3_client.get_object(Bucket=BUCKET, Key=key + MANIFEST_SUFFIX)["Body"]
+    return json.loads(body.read())
+
+
+@freezegun.freeze_time("2019-06-07T20:32:24Z")
+def test_segments_partitioned_by_hour(s3_client):
+    archive = ArchiveWriter(BUCKET, s3_client=s3_client)
+    archive.append(
+        make_donation("AB1", "2019-06-07T15:49:39-04:00"),
+        "2019-06-07T15:49:39-04:00",
+        "donations/",
+    )
+    archive.append(
+        make_donation("AB2", "2019-06-07T15:59:39-04:00"),
+        "2019-06-07T15:59:39-04:00",
+        "donations/",
+    )
+    archive.append(
+        make_donation("AB3", "2019-06-07T16:00:00-04:00"),
+        "2019-06-07T16:00:00-04:00",
+        "donations/",
+    )
+    assert list_keys(s3_client) == []
+
+    archive.flush()
+    key_19 = (
+        "donations/segments/dt=2019-06-07/hour=19/2019-06-07_20:32:24_AB1_2.ndjson.gz"
+    )
+    key_20 = (
+        "donations/segments/dt=2019-06-07/hour=20/2019-06-07_20:32:24_AB3_1.ndjson.gz"
+    )
+    assert sorted(list_keys(s3_client)) == sorted(
+        [key_19, key_19 + MANIFEST_SUFFIX, key_20, key_20 + MANIFEST_SUFFIX]
+    )
+
+    # The whole segment is a valid gzip file of NDJSON.
+    body = s3_client.get_object(Bucket=BUCKET, Key=key_19)["Body"].read()
+    lines = gzip.decompress(body).decode("utf-8").splitlines()
+    assert [json.loads(l)["contribution"]["orderNumber"] for l in lines] == [
+        "AB1",
+        "AB2",
+    ]
+
+    manifest = get_manifest(s3_client, key_19)
+    assert manifest["key"] == key_19
+    assert manifest["codec"] == CODEC_GZIP
+    assert manifest["record_count"] == 2
+    assert manifest["blocks"] == [
+        {
+            "offset": 0,
+            "length": len(body),
+            "record_count": 2,
+            "min_timestamp": "2019-06-07T19:49:39+00:00",
+            "max_timestamp": "2019-06-07T19:59:39+00:00",
+            "order_numbers": ["AB1", "AB2"],
+        }
+    ]
+
+
+@freezegun.freeze_time("2019-06-07T20:32:24Z")
+def test_ranged_read_of_selected_blocks(s3_client):
+    archive = ArchiveWriter(BUCKET, s3_client=s3_client, records_per_block=2)
+    for i in range(5):
+        paid_at = f"2019-06-07T19:0{i}:00Z"
+        archive.append(make_donation(f"AB{i}", paid_at), paid_at, "donations/")
+    archive.flush()
+
+    key = "donations/segments/dt=2019-06-07/hour=19/2019-06-07_20:32:24_AB0_5.ndjson.gz"
+    manifest = get_manifest(s3_client, key)
+    assert [b["order_numbers"] for b in manifest["blocks"]] == [
+        ["AB0", "AB1"],
+        ["AB2", "AB3"],
+        ["AB4"],
+    ]
+
+    events = read_segment_events(
+        s3_client,
+        BUCKET,
+        manifest,
+        block_filter=lambda b: b["max_timestamp"] >= "2019-06-07T19:03:00+00:00",
+    )
+    assert [e["contribution"]["orderNumber"] for e in events] == ["AB2", "AB3", "AB4"]
+
+    events = read_segment_events(s3_client, BUCKET, manifest)
+    assert len(events) == 5
+
+
+def test_flush_on_size(s3_client):
+    archive = ArchiveWriter(BUCKET, s3_client=s3_client, max_segment_bytes=1)
+    paid_at = "2019-06-07T19:00:00Z"
+    archive.append(make_donation("AB1", paid_at), paid_at, "donations/")
+    # Already over max_segment_bytes, so flushed right away.
+    assert len(list_keys(s3_client)) == 2
+    assert archive.segments == {}
+
+
+def test_flush_due_on_age(s3_client):
+    archive = ArchiveWriter(BUCKET, s3_client=s3_client, max_segment_age_seconds=0)
+    assert not archive.flush_due()
+    paid_at = "2019-06-07T19:00:00Z"
+    archive.append(make_donation("AB1", paid_at), paid_at, "donations/")
+    assert archive.flush_due()
+
+
+def test_flush_due_on_total_size(s3_client):
+    archive = ArchiveWriter(BUCKET, s3_client=s3_client)
+    for order_number, paid_at in [
+        ("AB1", "2019-06-07T19:00:00Z"),
+        ("AB2", "2019-06-07T20:00:00Z"),
+    ]:
+        archive.append(make_donation(order_number, paid_at), paid_at, "donations/")
+    one_segment_bytes = max(s.uncompressed_bytes for s in archive.segments.values())
+
+    # Neither segment is big enough to flush by itself, but together they are.
+    archive.max_segment_bytes = one_segment_bytes + 1
+    assert archive.flush_due()
+    assert list_keys(s3_client) == []
+
+
+def test_zstd_codec_needs_zstandard(monkeypatch):
+    monkeypatch.setenv("ACTBLUE_ARCHIVE_CODEC", "zstd")
+    monkeypatch.setattr(importlib.util, "find_spec", lambda name: None)
+    with pytest.raises(ValueError, match="zstandard"):
+        Settings().actblue_archive_codec
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        ArchiveWriter(BUCKET, s3_client=object(), codec="lz4")
@@ -0,0 +1,103 @@
+import datetime
+import json
+
+import boto3
+import pytest
+from moto import mock_s3
+
+from actblue.archive import ArchiveWriter
+from actblue.badge_backfill import backfill_badges, compute_badges
+from actblue.badges import DEFAULT_BADGE_RULES, BadgeRules
+from models.donor import Donor
+
+# The backfill needs numpy, which the webhook (and so Pipfile) doesn't.
+pytest.importorskip("numpy")
+
+BUCKET = "ew-actblue-donations-incoming-dev"
+
+
+def make_donation(email, order_number, paid_at, is_recurring=False):
+    return {
+        "donor": {"email": email},
+        "contribution": {"orderNumber": order_number, "isRecurring": is_recurring},
+        "lineitems": [{"amount": "10.0", "paidAt": paid_at}],
+    }
+
+
+@pytest.fixture
+def s3_client():
+    with mock_s3():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def seconds(paid_at):
+    return int(datetime.datetime.fromisoformat(paid_at).timestamp())
+
+
+def test_compute_badges():
+    donations = [
+        ("mary@example.com", "2019-06-07T15:49:39-04:00", False),
+        # 11:30pm on June 30 Eastern is the end of the quarter.
+        ("mary@example.com", "2019-06-30T23:30:00-04:00", False),
+        ("john@example.com", "2019-07-26T00:30:00-04:00", True),
+        # 9pm on July 25 Eastern isn't the end of the month yet.
+        ("jane@example.com", "2019-07-26T01:00:00+00:00", False),
+        ("jane@example.com", "2019-09-12T12:00:00-04:00", False),
+    ]
+    emails, paid_at_seconds, recurring = zip(*donations)
+    badges = compute_badges(
+        DEFAULT_BADGE_RULES,
+        list(emails),
+        [seconds(paid_at) for paid_at in paid_at_seconds],
+        list(recurring),
+    )
+    assert badges == {
+        "mary@example.com": {"eoq"},
+        "john@example.com": {"eom", "recurring"},
+        "jane@example.com": {"debate"},
+    }
+    assert compute_badges(DEFAULT_BADGE_RULES, [], [], []) == {}
+
+
+def test_backfill_badges(s3_client):
+    # Queue ingestion mode segments...
+    archive = ArchiveWriter(BUCKET, s3_client=s3_client)
+    for event in [
+        make_donation("mary@example.com", "AB1", "2019-06-07T15:49:39-04:00"),
+        make_donation("mary@example.com", "AB2", "2019-06-30T23:30:00-04:00"),
+        make_donation("nobody@example.com", "AB3", "2019-06-26T12:00:00-04:00"),
+    ]:
+        archive.append(event, event["lineitems"][-1]["paidAt"], "donations/")
+    archive.flush()
+    # ...and per-donation objects.
+    s3_client.put_object(
+        Bucket=BUCKET,
+        Key="donations/2019-07-26_20:32:24_2019-07-26_19:49:39_AB4.json",
+        Body=json.dumps(
+            make_donation("john@example.com", "AB4", "2019-07-26T15:49:39-04:00", True)
+        ),
+    )
+
+    # Badged with the old UTC dates, plus a badge we don't compute.
+    mary = Donor("mary@example.com")
+    mary.set_created_at()
+    mary.badges = {"merch"}
+    mary.save()
+    john = Donor("john@example.com")
+    john.set_created_at()
+    john.badges = {"eom", "recurring"}
+    john.save()
+
+    rules = BadgeRules(dates={"hqwall": [datetime.date(2019, 6, 7)]})
+    assert backfill_badges(BUCKET, rules=rules, s3_client=s3_client) == 1
+
+    assert Donor.get("mary@example.com").badges == {"merch", "hqwall", "eoq"}
+    assert Donor.get("john@example.com").badges == {"eom", "recurring"}
+    # Donors are only re-badged, not created.
+    with pytest.raises(Donor.DoesNotExist):
+        Donor.get("nobody@example.com")
+
+    # Nothing changes the second time around.
+    assert backfill_badges(BUCKET, rules=rules, s3_client=s3_client) == 0
@@ -0,0 +1,125 @@
+import datetime
+from unittest import mock
+
+import freezegun
+import pytest
+from pynamodb.exceptions import GetError
+
+from actblue.badges import (
+    BADGE_RULES_KEY,
+    DEFAULT_BADGE_RULES,
+    BadgeCalendar,
+    BadgeRules,
+    badge_calendar,
+    clear_badge_calendar_cache,
+    default_badge_calendar,
+)
+from models.generic_kv import CACHE_TTL_SECONDS, GenericKV, generic_kv_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    generic_kv_cache.clear()
+    clear_badge_calendar_cache()
+    yield
+    generic_kv_cache.clear()
+    clear_badge_calendar_cache()
+
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=datetime.timezone.utc)
+
+
+def test_default_rules():
+    rules = DEFAULT_BADGE_RULES
+    assert rules.badges_on(datetime.date(2019, 6, 7)) == set()
+    assert rules.badges_on(datetime.date(2019, 6, 25)) == set()
+    assert rules.badges_on(datetime.date(2019, 6, 26)) == {"eoq", "debate"}
+    assert rules.badges_on(datetime.date(2019, 7, 26)) == {"eom"}
+    assert rules.badges_on(datetime.date(2019, 9, 12)) == {"debate"}
+    assert rules.badge_ids() == {"eom", "eoq", "debate"}
+
+
+def test_calendar_matches_rules():
+    calendar = default_badge_calendar()
+    day = calendar.start - datetime.timedelta(days=10)
+    while day < calendar.end + datetime.timedelta(days=10):
+        assert calendar.badges_on(day) == DEFAULT_BADGE_RULES.badges_on(day)
+        day += datetime.timedelta(days=1)
+
+
+def test_badges_at_uses_eastern_dates():
+    calendar = default_badge_calendar()
+    # 11:30pm EDT on June 30, but July 1 in UTC.
+    assert calendar.badges_at(utc(2019, 7, 1, 3, 30)) == {"eoq"}
+    # 10pm EDT on July 25, but July 26 in UTC.
+    assert calendar.badges_at(utc(2019, 7, 26, 2, 0)) == set()
+    assert calendar.badges_at(utc(2019, 7, 26, 4, 0)) == {"eom"}
+
+
+def test_rules_from_json():
+    rules = BadgeRules.from_json(
+        '{"end_of_period_from_day": 28, "dates": {"founding": ["2019-02-09"]}}'
+    )
+    assert rules.badges_on(datetime.date(2019, 2, 9)) == {"founding"}
+    assert rules.badges_on(datetime.date(2019, 2, 27)) == set()
+    assert rules.badges_on(datetime.date(2019, 3, 28)) == {"eoq"}
+    assert rules.badge_ids() == {"eom", "eoq", "founding"}
+
+    with pytest.raises(ValueError):
+        BadgeRules.from_json('{"dates": {"gold_star": ["2019-02-09"]}}')
+    with pytest.raises(ValueError):
+        BadgeRules.from_json('{"end_of_period_from_day": 32}')
+
+
+def test_badge_calendar_from_generic_kv():
+    with freezegun.freeze_time("2019-06-07T20:32:24Z") as frozen_time:
+        assert badge_calendar() is default_badge_calendar()
+
+        GenericKV.put_value(BADGE_RULES_KEY, '{"dates": {"hqwall": ["2019-06-07"]}}')
+        # GenericKV is only checked for new rules once a minute.
+        assert badge_calendar() is default_badge_calendar()
+
+        frozen_time.tick(CACHE_TTL_SECONDS)
+        calendar = badge_calendar()
+        assert calendar.badges_at(utc(2019, 6, 7, 19, 49)) == {"hqwall"}
+        # Not a debate day any more.
+        assert calendar.badges_at(utc(2019, 6, 27, 19, 49)) == {"eoq"}
+
+        # Unchanged rules aren't compiled again.
+        generic_kv_cache.clear()
+        frozen_time.tick(CACHE_TTL_SECONDS)
+        assert badge_calendar() is calendar
+
+
+def test_invalid_rules_in_generic_kv_use_defaults():
+    GenericKV.put_value(BADGE_RULES_KEY, '{"dates": {"debate": ["June 26"]}}')
+    assert badge_calendar() is default_badge_calendar()
+
+
+def test_calendar_outside_precomputed_days():
+    calendar = BadgeCalendar(
+        DEFAULT_BADGE_RULES, datetime.date(2019, 6, 1), datetime.date(2019, 7, 1)
+    )
+    assert len(calendar.day_badges) == 30
+    assert calendar.badges_on(datetime.date(2019, 6, 26)) == {"eoq", "debate"}
+    assert calendar.badges_on(datetime.date(2019, 7, 30)) == {"eom", "debate"}
+
+
+def test_badge_calendar_when_generic_kv_fails():
+    with freezegun.freeze_time("2019-06-07T20:32:24Z") as frozen_time:
+        GenericKV.put_value(BADGE_RULES_KEY, '{"dates": {"hqwall": ["2019-06-07"]}}')
+        calendar = badge_calendar()
+        assert calendar is not default_badge_calendar()
+
+        generic_kv_cache.clear()
+        frozen_time.tick(CACHE_TTL_SECONDS)
+        with mock.patch.object(
+            GenericKV, "get", side_effect=GetError("Throughput exceeded")
+        ):
+            # The last good calendar is kept.
+            assert badge_calendar() is calendar
+
+    clear_badge_calendar_cache()
+    with mock.patch.object(GenericKV, "get", side_effect=GetError("Timed out")):
+        assert badge_calendar() is default_badge_calendar()
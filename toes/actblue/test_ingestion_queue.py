@@ -0,0 +1,69 @@
+import os
+
+import boto3
+from moto import mock_sqs
+
+from actblue.ingestion_queue import (
+    FileIngestionQueue,
+    SqsIngestionQueue,
+    get_ingestion_queue,
+)
+from common.settings import settings
+
+
+def test_file_queue_receive_and_ack(tmp_path):
+    queue = FileIngestionQueue(str(tmp_path))
+    for i in range(5):
+        queue.put({"i": i})
+
+    first = queue.receive(3)
+    assert [q.event for q in first] == [{"i": 0}, {"i": 1}, {"i": 2}]
+
+    # In-flight events aren't handed out again before their lease expires.
+    second = queue.receive(10)
+    assert [q.event for q in second] == [{"i": 3}, {"i": 4}]
+    assert queue.receive(10) == []
+
+    queue.ack([q.receipt for q in first + second])
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_file_queue_redelivers_unacked_events(tmp_path):
+    queue = FileIngestionQueue(str(tmp_path), visibility_timeout_seconds=-1)
+    queue.put({"i": 0})
+
+    assert [q.event for q in queue.receive(10)] == [{"i": 0}]
+    # Lease is already expired, as if the drain crashed before acking.
+    redelivered = queue.receive(10)
+    assert [q.event for q in redelivered] == [{"i": 0}]
+
+    queue.ack([q.receipt for q in redelivered])
+    assert queue.receive(10) == []
+
+
+def test_get_ingestion_queue_file_url(tmp_path):
+    settings.override_cached_property(
+        "actblue_ingestion_queue_url", f"file://{tmp_path}"
+    )
+    queue = get_ingestion_queue()
+    assert isinstance(queue, FileIngestionQueue)
+    assert queue.directory == str(tmp_path)
+    # Created once per process, not once per webhook.
+    assert get_ingestion_queue() is queue
+
+
+@mock_sqs
+def test_sqs_queue_receive_and_ack():
+    sqs = boto3.client("sqs", region_name="us-east-2")
+    queue_url = sqs.create_queue(QueueName="actblue-ingestion")["QueueUrl"]
+    queue = SqsIngestionQueue(queue_url, sqs_client=sqs)
+    for i in range(15):
+        queue.put({"i": i})
+
+    received = queue.receive(12)
+    assert len(received) == 12
+
+    queue.ack([q.receipt for q in received])
+    remaining = queue.receive(100)
+    assert len(remaining) == 3
+    assert {q.event["i"] for q in received + remaining} == set(range(15))
@@ -0,0 +1,155 @@
+# Benchmark of mdata's ReferFlow over simulated conversations, with the
+# state table compiled once per class (as now) against it being rebuilt
+# from dir() for every Flow instance (as before).
+#
+# Like /mdata/refer, every incoming message gets a new ReferFlow, starting
+# from the state saved on the profile. Referral texts and ChatReferral
+# writes are replaced with no-ops, so this only measures our own code.
+#
+#   python benchmarks/mdata_flow_benchmark.py [--conversations 10000]
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mdata.mdata as mdata  # noqa: E402
+from mdata.mdata import ReferFlow  # noqa: E402
+
+MESSAGES = [
+    "",
+    "She has a plan for that",
+    "Jason Katz-Brown",
+    "94801",
+    "Richard Katz",
+    "5102194255",
+    "Fort Dodge IA",
+    "Mary Smith",
+]
+
+PROFILE_FIELDS = [
+    "phone_number",
+    "email",
+    "first_and_last_name",
+    "first_name",
+    "last_name",
+    "last_state",
+    "postal_code",
+    "refer_personal_reason",
+    "refer_referee_first_and_last_name",
+    "refer_referee_first_name",
+    "refer_referee_last_name",
+    "refer_referee_phone_number",
+    "refer_referee_city",
+    "refer_referee_state",
+]
+
+
+class LegacyReferFlow(ReferFlow):
+    """ReferFlow with the old per-instance state table."""
+
+    def __init__(self, initial_state="state_initial"):
+        self.legacy_state_to_processor = {}
+        for processor_method_name in dir(self):
+            if processor_method_name.startswith("_state_"):
+                state = processor_method_name.replace("_state_", "state_")
+                self.legacy_state_to_processor[state] = getattr(
+                    self, processor_method_name
+                )
+        self.current_state = initial_state
+        assert self.current_state in self.legacy_state_to_processor
+
+    def process_message(self, incoming_message, profile):
+        message = ""
+        while True:
+            result = self.legacy_state_to_processor[self.current_state](
+                incoming_message, profile
+            )
+            if result.get("next_state"):
+                print(
+                    f"Transitioning from {self.current_state} to {result['next_state']}"
+                )
+                self.current_state = result["next_state"]
+            if result.get("start_message"):
+                message += result.get("start_message")
+            if result.get("send_message"):
+                message += result.get("send_message")
+                return message
+            incoming_message = result["incoming_message"]
+
+
+class NoopReferral:
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def stub_out_side_effects():
+    mdata.send_referral_messages = lambda phone_number, messages: None
+    mdata.ChatReferral = SimpleNamespace(
+        get_or_create_referral=lambda *args: NoopReferral()
+    )
+
+
+def converse(flow_class, conversations):
+    replies = []
+    for i in range(conversations):
+        profile = SimpleNamespace(**{field: None for field in PROFILE_FIELDS})
+        profile.phone_number = f"1555{i:07d}"
+        for incoming_message in MESSAGES:
+            # As in mdata.refer().
+            if incoming_message and profile.last_state:
+                flow = flow_class(profile.last_state)
+            else:
+                flow = flow_class()
+            replies.append(flow.process_message(incoming_message, profile))
+            profile.last_state = flow.current_state
+    return replies
+
+
+def timed(f, *args):
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = f(*args)
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversations", type=int, default=10000)
+    args = parser.parse_args()
+
+    stub_out_side_effects()
+    messages = args.conversations * len(MESSAGES)
+
+    # Warm up caches (e.g. name parsing) so both runs see the same inputs.
+    timed(converse, ReferFlow, 10)
+    legacy_seconds, expected = timed(converse, LegacyReferFlow, args.conversations)
+    compiled_seconds, actual = timed(converse, ReferFlow, args.conversations)
+    assert actual == expected, "Compiled flow replies differ from legacy ones"
+
+    legacy_init_seconds, _ = timed(
+        lambda: [LegacyReferFlow("state_receive_name") for _ in range(messages)]
+    )
+    compiled_init_seconds, _ = timed(
+        lambda: [ReferFlow("state_receive_name") for _ in range(messages)]
+    )
+
+    print(f"{args.conversations} conversations, {messages} messages")
+    for name, seconds in [
+        ("Legacy conversations", legacy_seconds),
+        ("Compiled conversations", compiled_seconds),
+        ("Legacy flow creation", legacy_init_seconds),
+        ("Compiled flow creation", compiled_init_seconds),
+    ]:
+        print(f"{name}: {seconds:.3f}s ({seconds / messages * 1e6:.1f}us per message)")
+    print(f"Speedup: {legacy_seconds / compiled_seconds:.2f}x overall")
+    print(f"Speedup: {legacy_init_seconds / compiled_init_seconds:.1f}x flow creation")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+# Benchmark of how long toes takes to serve the first request to each
+# blueprint after a cold start, and subsequent (warm) requests.
+#
+# For every route, each run spawns a fresh interpreter that imports
+# toes_app and sends the route one cold request and then --warm-requests
+# warm ones, through the Flask test client. AWS is stood in for by a moto
+# server started here, and Mobile Commons, Mobilize America and BSD by
+# responses mocks like the ones in the tests. The moto server is the
+# pinned moto's own moto_server, serving every service on localhost (it
+# tells them apart by the request's credential scope). The Pipfile's boto3
+# predates AWS_ENDPOINT_URL, so children point botocore at it from an
+# import hook instead, without importing botocore before the clock starts.
+#
+# Cold latency is the time from the interpreter being ready to the first
+# response: importing toes_app plus the first request, which imports the
+# route's blueprint. Importing responses, which the children need before
+# they start the clock, preloads requests; test_toes_app.py covers what
+# importing toes_app itself pulls in.
+#
+#   python benchmarks/startup_benchmark.py --budget my_budget.json
+#       [--runs 10] [--routes donors ...] [--tolerance 0.25] [--write-budget]
+#
+# Exits non-zero if any route's p50 or p90 goes over its budget by more
+# than --tolerance. Budgets depend on the machine, so none is checked in:
+# record one on the machine you'll compare on with --write-budget first.
+
+import argparse
+import importlib.abc
+import importlib.util
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import time
+
+TOES_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MOTO_PORT = 8025
+# moto_server only works out which service a request is for when it's
+# addressed to localhost.
+MOTO_ENDPOINT_URL = f"http://localhost:{MOTO_PORT}"
+MOTO_STARTUP_TIMEOUT_SECONDS = 30
+
+STANDIN_ENVIRONMENT = {
+    "STAGE": "dev",
+    "AWS_ACCESS_KEY_ID": "benchmark",
+    "AWS_SECRET_ACCESS_KEY": "benchmark",
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "ACTBLUE_WEBHOOK_USERNAME": "benchmark",
+    "ACTBLUE_WEBHOOK_PASSWORD": "benchmark",
+    "GENERIC_KV_READ_USERNAME": "benchmark",
+    "GENERIC_KV_READ_PASSWORD": "benchmark",
+    "MOBILE_COMMONS_USERNAME": "benchmark",
+    "MOBILE_COMMONS_PASSWORD": "benchmark",
+    "BSD_API_USERNAME": "benchmark",
+    "BSD_API_PASSWORD": "benchmark",
+    "DONOR_ID_SALT": "benchmark",
+}
+
+BASIC_AUTH = "Basic YmVuY2htYXJrOmJlbmNobWFyaw=="  # benchmark:benchmark
+
+GENERIC_KV_KEY = "startup_benchmark"
+
+MOBILIZE_AMERICA_PARAMS = (
+    "ts_start=1564567200&ts_end=1564545600&event_types=COMMUNITY,HOUSE_PARTY"
+    "&zipcode=94801&max_dist=30&utm_source=SMSMdata"
+)
+
+# Blueprint name -> the request each run sends it, as test client kwargs.
+ROUTES = {
+    "actblue": lambda: {
+        "method": "POST",
+        "path": "/actblue/donation",
+        "data": _read("actblue", "sample_donation.json"),
+        "headers": {"Authorization": BASIC_AUTH},
+    },
+    "mdata": lambda: {
+        "method": "GET",
+        "path": "/mdata/refer?phone=15105016227&args=",
+    },
+    "generic_kv": lambda: {
+        "method": "GET",
+        "path": f"/generic_kv/value?k={GENERIC_KV_KEY}",
+        "headers": {"Authorization": BASIC_AUTH},
+    },
+    "donors": lambda: {
+        "method": "POST",
+        "path": "/donors/resend_donor_wall_link",
+        "data": json.dumps({"email": "benchmark@example.com"}),
+    },
+    "mobilize_america": lambda: {
+        "method": "GET",
+        "path": f"/mobilize_america/events?{MOBILIZE_AMERICA_PARAMS}",
+    },
+}
+
+
+def _read(*path):
+    with open(os.path.join(TOES_DIR, *path)) as f:
+        return f.read()
+
+
+def percentile(values, p):
+    """Nearest-rank percentile."""
+    values = sorted(values)
+    return values[max(1, math.ceil(len(values) * p / 100)) - 1]
+
+
+def summarize(values):
+    return {f"p{p}_ms": round(percentile(values, p), 1) for p in (50, 90, 99)}
+
+
+# Child: runs in a fresh interpreter for each run.
+
+
+class StandInEndpointFinder(importlib.abc.MetaPathFinder):
+    """Makes botocore clients default to the moto server, once it's imported.
+
+    boto3 and pynamodb both create their clients through
+    botocore.session.Session.create_client, passing endpoint_url=None
+    unless they've been told otherwise (pynamodb passes Meta.host).
+    """
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname != "botocore.session":
+            return None
+        sys.meta_path.remove(self)
+        spec = importlib.util.find_spec(fullname)
+        exec_module = spec.loader.exec_module
+
+        def exec_and_patch(module):
+            exec_module(module)
+            create_client = module.Session.create_client
+
+            def create_stand_in_client(self, *args, **kwargs):
+                if kwargs.get("endpoint_url") is None:
+                    kwargs["endpoint_url"] = MOTO_ENDPOINT_URL
+                return create_client(self, *args, **kwargs)
+
+            module.Session.create_client = create_stand_in_client
+
+        spec.loader.exec_module = exec_and_patch
+        return spec
+
+
+def mock_external_apis():
+    import re
+
+    import responses
+
+    responses.start()
+    responses.add(
+        responses.POST,
+        re.compile(r"https://secure\.mcommons\.com/api/.*"),
+        body='<response success="false"><error id="5" message="Invalid phone number"/></response>',
+    )
+    responses.add(
+        responses.GET,
+        re.compile(r"https://events\.mobilizeamerica\.io/.*"),
+        body=_read(
+            "mobilize_america",
+            "mock_mobilize_america_debate_watch_party_response_94801.json",
+        ),
+    )
+    responses.add(
+        responses.POST,
+        re.compile(r"https://warren\.cp\.bsd\.net/.*"),
+        body="",
+    )
+
+
+def run_child(route, warm_requests):
+    sys.meta_path.insert(0, StandInEndpointFinder())
+    mock_external_apis()
+    request_kwargs = ROUTES[route]()
+
+    started = time.perf_counter()
+    from toes_app import app
+
+    imported = time.perf_counter()
+    client = app.test_client()
+    latencies = []
+    for _ in range(1 + warm_requests):
+        request_started = time.perf_counter()
+        res = client.open(**request_kwargs)
+        latencies.append((time.perf_counter() - request_started) * 1000)
+        if res.status_code >= 400:
+            raise RuntimeError(f"{route} returned {res.status_code}: {res.data}")
+
+    print(
+        json.dumps(
+            {
+                "import_ms": (imported - started) * 1000,
+                "cold_ms": (imported - started) * 1000 + latencies[0],
+                "warm_ms": latencies[1:],
+            }
+        )
+    )
+
+
+# Parent: sets up the stand-ins, spawns the children and checks budgets.
+
+
+def start_moto_server():
+    server = subprocess.Popen(
+        [sys.executable, "-m", "moto.server", "-H", "localhost", "-p", str(MOTO_PORT)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + MOTO_STARTUP_TIMEOUT_SECONDS
+    while True:
+        try:
+            socket.create_connection(("localhost", MOTO_PORT), timeout=1).close()
+            return server
+        except OSError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.kill()
+                raise RuntimeError("moto server didn't start")
+            time.sleep(0.1)
+
+
+def set_up_aws():
+    import boto3
+
+    server = start_moto_server()
+    os.environ.update(STANDIN_ENVIRONMENT)
+
+    sys.path.insert(0, TOES_DIR)
+    from common.settings import settings
+    from models.donor import Donor
+    from models.generic_kv import GenericKV
+    from models.models import MODELS
+
+    Donor.Meta.table_name = settings.donors_table_name
+    for model in MODELS:
+        model.Meta.host = MOTO_ENDPOINT_URL
+        model.setup()
+    GenericKV.put_value(GENERIC_KV_KEY, json.dumps({"benchmark": True}))
+    boto3.resource("s3", endpoint_url=MOTO_ENDPOINT_URL).create_bucket(
+        Bucket=settings.actblue_donations_incoming_s3_bucket
+    )
+    return server
+
+
+def run_route(route, runs, warm_requests):
+    env = {
+        **os.environ,
+        **STANDIN_ENVIRONMENT,
+        "PYTHONPATH": os.pathsep.join([TOES_DIR, os.environ.get("PYTHONPATH", "")]),
+    }
+    cold_ms = []
+    warm_ms = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--child",
+                route,
+                "--warm-requests",
+                str(warm_requests),
+            ],
+            cwd=TOES_DIR,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        if result.returncode:
+            raise RuntimeError(f"Benchmarking {route} failed:\n{result.stderr}")
+        child_result = json.loads(result.stdout.strip().splitlines()[-1])
+        cold_ms.append(child_result["cold_ms"])
+        warm_ms.extend(child_result["warm_ms"])
+
+    return {"cold": summarize(cold_ms), "warm": summarize(warm_ms)}
+
+
+def over_budget(results, budget, tolerance):
+    """Returns a description of each percentile over budget."""
+    regressions = []
+    for route, result in results.items():
+        for kind, percentiles in result.items():
+            for name in ("p50_ms", "p90_ms"):
+                limit = budget.get(route, {}).get(kind, {}).get(name)
+                if limit is None:
+                    continue
+                if percentiles[name] > limit * (1 + tolerance):
+                    regressions.append(
+                        f"{route} {kind} {name}: {percentiles[name]} > {limit}"
+                        f" (+{tolerance:.0%})"
+                    )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--warm-requests", type=int, default=20)
+    parser.add_argument("--routes", nargs="+", choices=ROUTES, default=list(ROUTES))
+    parser.add_argument(
+        "--budget",
+        required="--child" not in sys.argv,
+        help="Budget JSON file for this machine, as written by --write-budget.",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument(
+        "--write-budget",
+        action="store_true",
+        help="Record these results as the budget instead of checking them.",
+    )
+    parser.add_argument("--child", choices=ROUTES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.warm_requests)
+        return
+
+    server = set_up_aws()
+    try:
+        results = {}
+        for route in args.routes:
+            results[route] = run_route(route, args.runs, args.warm_requests)
+            print(f"{route}: cold {results[route]['cold']}")
+            print(f"{' ' * len(route)}  warm {results[route]['warm']}")
+    finally:
+        server.terminate()
+        server.wait()
+
+    if args.write_budget:
+        budget = {}
+        if os.path.exists(args.budget):
+            with open(args.budget) as f:
+                budget = json.load(f)
+        budget.update(results)
+        with open(args.budget, "w") as f:
+            json.dump(budget, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Wrote budget to {args.budget}")
+        return
+
+    if not os.path.exists(args.budget):
+        sys.exit(f"No budget at {args.budget}; record one with --write-budget.")
+    with open(args.budget) as f:
+        budget = json.load(f)
+    regressions = over_budget(results, budget, args.tolerance)
+    if regressions:
+        print("Over budget:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print("Within budget.")
+
+
+if __name__ == "__main__":
+    main()
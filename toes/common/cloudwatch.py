@@ -1,13 +1,20 @@
-import boto3
+from functools import lru_cache
 
 from common.settings import settings
 
 CLOUDWATCH_REGION_NAME = "us-east-2"
 
-cloudwatch = boto3.client("cloudwatch", region_name=CLOUDWATCH_REGION_NAME)
+
+@lru_cache(maxsize=None)
+def cloudwatch_client():
+    # boto3 is slow to import and to create clients with, so we wait until
+    # we first put a metric rather than paying for it on every cold start.
+    import boto3
+
+    return boto3.client("cloudwatch", region_name=CLOUDWATCH_REGION_NAME)
 
 
 def cloudwatch_put_metric(metric_data):
-    cloudwatch.put_metric_data(
+    cloudwatch_client().put_metric_data(
         MetricData=metric_data, Namespace=f"toes/actblue-{settings.stage}"
     )
@@ -0,0 +1,100 @@
+# Lazily imported blueprints.
+#
+# Importing every blueprint up front pulls in pynamodb, boto3, phonenumbers
+# and friends before a Lambda can answer its first request, even though any
+# one request only needs one blueprint. LazyBlueprints is WSGI middleware
+# that imports a blueprint, and mounts it on its own small Flask app, the
+# first time a request comes in under its URL prefix. Everything else goes
+# to the main app as usual.
+#
+# url_for() on the main app still works for lazy endpoints: build errors
+# for them are handed to the blueprint's app (loading it if need be).
+
+from importlib import import_module
+from threading import Lock
+
+from flask import Flask, has_request_context, request
+from flask_cors import CORS
+from werkzeug.routing import BuildError
+
+
+class LazyBlueprints:
+    def __init__(self, app, blueprints):
+        """blueprints maps blueprint names to (url_prefix, "module:attribute").
+
+        Installs itself as app.wsgi_app.
+        """
+        self.app = app
+        self.blueprints = blueprints
+        self.blueprint_apps = {}
+        self.lock = Lock()
+        self.main_wsgi_app = app.wsgi_app
+        app.wsgi_app = self
+        app.url_build_error_handlers.append(self.handle_url_build_error)
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        for name, (url_prefix, _) in self.blueprints.items():
+            if path == url_prefix or path.startswith(url_prefix + "/"):
+                return self.blueprint_app(name)(environ, start_response)
+        return self.main_wsgi_app(environ, start_response)
+
+    def blueprint_app(self, name):
+        blueprint_app = self.blueprint_apps.get(name)
+        if blueprint_app is None:
+            with self.lock:
+                blueprint_app = self.blueprint_apps.get(name)
+                if blueprint_app is None:
+                    blueprint_app = self._create_blueprint_app(name)
+                    self.blueprint_apps[name] = blueprint_app
+        return blueprint_app
+
+    def _create_blueprint_app(self, name):
+        url_prefix, import_name = self.blueprints[name]
+        module_name, attribute = import_name.split(":")
+        blueprint = getattr(import_module(module_name), attribute)
+
+        # Blueprint apps are configured like the main app at the time they
+        # are created; configure the main app before loading blueprints.
+        blueprint_app = Flask(self.app.import_name)
+        blueprint_app.config.update(self.app.config)
+        blueprint_app.debug = self.app.debug
+        blueprint_app.testing = self.app.testing
+        blueprint_app.response_class = self.app.response_class
+        CORS(blueprint_app)
+        blueprint_app.register_blueprint(blueprint, url_prefix=url_prefix)
+        return blueprint_app
+
+    def load_all(self):
+        """Loads every blueprint, e.g. to warm up a container."""
+        for name in self.blueprints:
+            self.blueprint_app(name)
+
+    def handle_url_build_error(self, error, endpoint, values):
+        name = endpoint.split(".", 1)[0]
+        if name not in self.blueprints:
+            return None
+
+        values = dict(values)
+        external = values.pop("_external", False)
+        anchor = values.pop("_anchor", None)
+        method = values.pop("_method", None)
+        scheme = values.pop("_scheme", None)
+
+        blueprint_app = self.blueprint_app(name)
+        url_adapter = blueprint_app.create_url_adapter(
+            request._get_current_object() if has_request_context() else None
+        )
+        if url_adapter is None:
+            return None
+        if scheme is not None:
+            url_adapter.url_scheme = scheme
+        try:
+            rv = url_adapter.build(
+                endpoint, values, method=method, force_external=external
+            )
+        except BuildError:
+            return None
+        if anchor is not None:
+            rv += f"#{anchor}"
+        return rv
@@ -1,10 +1,16 @@
-import boto3
+from functools import lru_cache
 
 PARAMETER_STORE_REGION_NAME = "us-east-2"
 
-ssm = boto3.client("ssm", region_name=PARAMETER_STORE_REGION_NAME)
+
+@lru_cache(maxsize=None)
+def ssm_client():
+    # Created on first use; see common.cloudwatch.cloudwatch_client.
+    import boto3
+
+    return boto3.client("ssm", region_name=PARAMETER_STORE_REGION_NAME)
 
 
 def get_parameter(name, with_decryption=False):
-    resp = ssm.get_parameter(Name=name, WithDecryption=with_decryption)
+    resp = ssm_client().get_parameter(Name=name, WithDecryption=with_decryption)
     return resp["Parameter"]["Value"]
@@ -0,0 +1,140 @@
+# Cache in front of ew_common.mobile_commons.profile_exists.
+#
+# Checking whether a phone number already has a Mobile Commons profile is a
+# synchronous round trip to secure.mcommons.com, made for every ActBlue
+# donation with a phone number. Repeat donors are very common, so we cache
+# the answer in two tiers:
+#
+# 1. An in-process LRU, which survives across warm Lambda invocations.
+# 2. The MobileCommonsProfileCache DynamoDB table, shared by all Lambdas.
+#
+# Profiles rarely go away once they exist, so positive answers are cached
+# for a long time. Negative answers are cached only briefly, and are
+# overwritten as soon as we create the profile ourselves (see
+# mark_profile_exists).
+
+import logging
+import time
+from collections import OrderedDict
+
+from ew_common.mobile_commons import profile_exists
+from models.mobile_commons_profile_cache import MobileCommonsProfileCache
+
+POSITIVE_TTL_SECONDS = 7 * 24 * 60 * 60
+NEGATIVE_TTL_SECONDS = 10 * 60
+MAX_LOCAL_ENTRIES = 10000
+
+TIER_MEMORY = "memory"
+TIER_DYNAMO = "dynamo"
+
+
+class ProfileExistsCache:
+    def __init__(
+        self,
+        positive_ttl_seconds=POSITIVE_TTL_SECONDS,
+        negative_ttl_seconds=NEGATIVE_TTL_SECONDS,
+        max_local_entries=MAX_LOCAL_ENTRIES,
+    ):
+        self.positive_ttl_seconds = positive_ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.max_local_entries = max_local_entries
+        # phone number -> (exists, expires at in epoch seconds)
+        self._local = OrderedDict()
+        self._hits = {TIER_MEMORY: 0, TIER_DYNAMO: 0}
+        self._misses = 0
+
+    def profile_exists(self, username, password, phone_number):
+        """Drop-in replacement for ew_common.mobile_commons.profile_exists."""
+        exists = self._get_local(phone_number)
+        if exists is not None:
+            self._hits[TIER_MEMORY] += 1
+            return exists
+
+        exists = self._get_dynamo(phone_number)
+        if exists is not None:
+            self._hits[TIER_DYNAMO] += 1
+            return exists
+
+        self._misses += 1
+        exists = profile_exists(username, password, phone_number)
+        if exists is not None:
+            # None means we couldn't parse Mobile Commons' response, which
+            # isn't worth remembering.
+            self._put(phone_number, exists)
+        return exists
+
+    def mark_profile_exists(self, phone_number):
+        """Records that we just created a profile for phone_number."""
+        self._put(phone_number, True)
+
+    def clear(self):
+        """Drops the in-process tier, e.g. between tests."""
+        self._local.clear()
+
+    def metric_data(self):
+        """Returns CloudWatch MetricData for hits/misses since the last call."""
+        metric_data = [
+            {
+                "MetricName": "mobile_commons_profile_cache_hits",
+                "Dimensions": [{"Name": "tier", "Value": tier}],
+                "Unit": "Count",
+                "Value": hits,
+            }
+            for tier, hits in self._hits.items()
+        ]
+        metric_data.append(
+            {
+                "MetricName": "mobile_commons_profile_cache_misses",
+                "Dimensions": [],
+                "Unit": "Count",
+                "Value": self._misses,
+            }
+        )
+        self._hits = {tier: 0 for tier in self._hits}
+        self._misses = 0
+        return metric_data
+
+    def _get_local(self, phone_number):
+        entry = self._local.get(phone_number)
+        if not entry:
+            return None
+        exists, expires_at = entry
+        if expires_at <= time.time():
+            del self._local[phone_number]
+            return None
+        self._local.move_to_end(phone_number)
+        return exists
+
+    def _put_local(self, phone_number, exists, expires_at):
+        self._local[phone_number] = (exists, expires_at)
+        self._local.move_to_end(phone_number)
+        while len(self._local) > self.max_local_entries:
+            self._local.popitem(last=False)
+
+    def _get_dynamo(self, phone_number):
+        try:
+            entry = MobileCommonsProfileCache.get(phone_number)
+        except MobileCommonsProfileCache.DoesNotExist:
+            return None
+        except Exception:
+            # The cache is only an optimization; fall back to Mobile Commons.
+            logging.exception("Failed to read MobileCommonsProfileCache")
+            return None
+
+        expires_at = entry.expires_at.timestamp()
+        if expires_at <= time.time():
+            return None
+        self._put_local(phone_number, entry.has_profile, expires_at)
+        return entry.has_profile
+
+    def _put(self, phone_number, exists):
+        ttl_seconds = self.positive_ttl_seconds if exists else self.negative_ttl_seconds
+        self._put_local(phone_number, exists, time.time() + ttl_seconds)
+        try:
+            MobileCommonsProfileCache.put_entry(phone_number, exists, ttl_seconds)
+        except Exception:
+            logging.exception("Failed to write MobileCommonsProfileCache")
+
+
+# Module-level so it's shared across warm invocations of the same Lambda.
+profile_exists_cache = ProfileExistsCache()
@@ -1,3 +1,4 @@
+import importlib.util
 import os
 
 from werkzeug.utils import cached_property
@@ -16,6 +17,17 @@ class Settings:
 
     DONORS_TABLE_NAMES = {STAGE_DEV: "donors-dev", STAGE_PROD: "donors"}
 
+    # "task" processes each ActBlue webhook in its own Zappa task; "queue"
+    # buffers webhooks in a durable queue that's drained in micro-batches.
+    ACTBLUE_INGESTION_MODE_TASK = "task"
+    ACTBLUE_INGESTION_MODE_QUEUE = "queue"
+
+    # "read_modify_write" reads each Donor, applies donations in Python and
+    # saves it; "atomic" applies them with a single conditional UpdateItem
+    # per donor, which is safe under concurrent webhooks for the same donor.
+    ACTBLUE_DONOR_AGGREGATION_READ_MODIFY_WRITE = "read_modify_write"
+    ACTBLUE_DONOR_AGGREGATION_ATOMIC = "atomic"
+
     @cached_property
     def stage(self):
         # Return default 'dev' if no env variable set.
@@ -88,6 +100,40 @@ class Settings:
     def actblue_donations_incoming_s3_bucket(self):
         return self.ACTBLUE_DONATIONS_INCOMING_S3_BUCKETS[self.stage]
 
+    @cached_property
+    def actblue_ingestion_mode(self):
+        return os.environ.get(
+            "ACTBLUE_INGESTION_MODE", self.ACTBLUE_INGESTION_MODE_TASK
+        )
+
+    @cached_property
+    def actblue_ingestion_queue_url(self):
+        # Either an SQS queue URL or file:///some/dir for a local queue.
+        return os.environ["ACTBLUE_INGESTION_QUEUE_URL"]
+
+    @cached_property
+    def actblue_ingestion_batch_size(self):
+        return int(os.environ.get("ACTBLUE_INGESTION_BATCH_SIZE", 100))
+
+    @cached_property
+    def actblue_donor_aggregation(self):
+        return os.environ.get(
+            "ACTBLUE_DONOR_AGGREGATION",
+            self.ACTBLUE_DONOR_AGGREGATION_READ_MODIFY_WRITE,
+        )
+
+    @cached_property
+    def actblue_archive_codec(self):
+        # "gzip" or "zstd"; see actblue/archive.py. zstd needs the zstandard
+        # package, which isn't in the Pipfile, so check for it here rather
+        # than failing once a drain has events to archive.
+        codec = os.environ.get("ACTBLUE_ARCHIVE_CODEC", "gzip")
+        if codec == "zstd" and importlib.util.find_spec("zstandard") is None:
+            raise ValueError(
+                "ACTBLUE_ARCHIVE_CODEC is zstd, but zstandard isn't installed"
+            )
+        return codec
+
     @cached_property
     def donors_table_name(self):
         return self.DONORS_TABLE_NAMES[self.stage]
@@ -6,15 +6,22 @@ from moto import mock_s3  # This must come before including models
 
 from models.models import MODELS
 from toes_app import app as toes_app
+from toes_app import lazy_blueprints
 
+# Blueprint apps copy the main app's settings when they're loaded, so
+# configure it first.
+toes_app.debug = True
+toes_app.response_class = Response
+
+# Import every blueprint now, before pytest puts test directories (like
+# models/, with its generic_kv.py) on sys.path.
+lazy_blueprints.load_all()
 
 os.environ["INFRASTRUCTURE"] = "test"  # used by CaucusAppEvent
 
 
 @pytest.fixture
 def app():
-    toes_app.debug = True
-    toes_app.response_class = Response
     return toes_app
 
 
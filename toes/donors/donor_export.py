@@ -0,0 +1,301 @@
+# Exports the Donor table to S3 for the grassroots donor wall and analytics.
+#
+# A plain Donor.scan() reads the table one page at a time on one thread.
+# Instead, DonorExport splits the table into DynamoDB scan segments
+# (Segment/TotalSegments) and scans them in parallel on a thread pool,
+# streaming each segment's donors into its own numbered shards:
+#
+#   donors/cut=2019-06-07T20:32:24Z/part-0003-0001.ndjson.gz
+#
+# as gzipped (or zstd) newline-delimited JSON, or as Parquet. A manifest
+# listing every shard is written last, both next to the shards and as
+# donors/latest.json, so readers only ever see complete snapshots.
+#
+# A scan isn't a point-in-time read, so each snapshot has a cut timestamp,
+# taken when the export starts. Donors created after the cut are left out
+# of every segment, so the set of donors is the set as of the cut. Donors
+# updated after the cut are exported as they are when scanned; the
+# manifest counts them in updated_after_cut.
+#
+# To keep the export from using up the table's provisioned capacity, give
+# it a budget of read capacity units per second, shared by the segments.
+# Scans are eventually consistent, at half the cost of consistent reads;
+# the cut already defines the snapshot, so --consistent-read is rarely
+# worth it.
+#
+#   python -m donors.donor_export --bucket ... [--segments 8] [--format parquet]
+
+import argparse
+import datetime
+import importlib.util
+import io
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from pynamodb.attributes import (
+    NumberAttribute,
+    UnicodeAttribute,
+    UnicodeSetAttribute,
+    UTCDateTimeAttribute,
+)
+
+from actblue.archive import CODEC_EXTENSIONS, CODEC_GZIP, compress
+from common.settings import settings
+from models.donor import Donor
+
+FORMAT_NDJSON = "ndjson"
+FORMAT_PARQUET = "parquet"
+
+DEFAULT_PREFIX = "donors/"
+MANIFEST_NAME = "manifest.json"
+LATEST_MANIFEST_NAME = "latest.json"
+
+DEFAULT_TOTAL_SEGMENTS = 8
+DEFAULT_RECORDS_PER_SHARD = 100000
+DEFAULT_PAGE_SIZE = 1000
+
+Donor.Meta.table_name = settings.donors_table_name
+
+
+def donor_to_record(donor):
+    """Donor as a dict of plain values: sets become sorted lists."""
+    record = {}
+    for name in Donor.get_attributes():
+        value = getattr(donor, name)
+        if isinstance(value, (set, frozenset)):
+            value = sorted(value)
+        record[name] = value
+    return record
+
+
+def json_default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f"Can't serialize {value!r}")
+
+
+def parquet_type(attribute):
+    import pyarrow as pa
+
+    if isinstance(attribute, UTCDateTimeAttribute):
+        return pa.timestamp("us", tz="UTC")
+    if isinstance(attribute, UnicodeSetAttribute):
+        return pa.list_(pa.string())
+    if isinstance(attribute, NumberAttribute):
+        return pa.float64()
+    if isinstance(attribute, UnicodeAttribute):
+        return pa.string()
+    raise TypeError(f"No Parquet type for {type(attribute).__name__}")
+
+
+def parquet_schema():
+    """Donor's attributes as a Parquet schema, so new ones get exported too."""
+    import pyarrow as pa
+
+    return pa.schema(
+        [
+            (name, parquet_type(attribute))
+            for name, attribute in Donor.get_attributes().items()
+        ]
+    )
+
+
+def encode_records(records, output_format, codec):
+    if output_format == FORMAT_NDJSON:
+        data = "".join(
+            json.dumps(record, default=json_default) + "\n" for record in records
+        )
+        return compress(data.encode("utf-8"), codec)
+    if output_format == FORMAT_PARQUET:
+        # pyarrow is optional; it's only needed for Parquet exports.
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        buf = io.BytesIO()
+        table = pa.Table.from_pylist(records, schema=parquet_schema())
+        pq.write_table(table, buf, compression="zstd")
+        return buf.getvalue()
+    raise ValueError(f"Unknown export format: {output_format}")
+
+
+def shard_extension(output_format, codec):
+    if output_format == FORMAT_PARQUET:
+        return ".parquet"
+    return f".ndjson{CODEC_EXTENSIONS[codec]}"
+
+
+class ShardWriter:
+    """Writes one scan segment's records to S3, records_per_shard at a time."""
+
+    def __init__(self, export, snapshot_prefix, segment):
+        self.export = export
+        self.snapshot_prefix = snapshot_prefix
+        self.segment = segment
+        self.records = []
+        self.shards = []
+
+    def add(self, record):
+        self.records.append(record)
+        if len(self.records) >= self.export.records_per_shard:
+            self.flush()
+
+    def flush(self):
+        if not self.records:
+            return
+        key = (
+            f"{self.snapshot_prefix}part-{self.segment:04d}-{len(self.shards):04d}"
+            f"{shard_extension(self.export.output_format, self.export.codec)}"
+        )
+        body = encode_records(
+            self.records, self.export.output_format, self.export.codec
+        )
+        logging.info(f"Writing {len(self.records)} donors to s3: {key}")
+        self.export.s3.put_object(Bucket=self.export.bucket, Key=key, Body=body)
+        self.shards.append(
+            {"key": key, "record_count": len(self.records), "bytes": len(body)}
+        )
+        self.records = []
+
+
+class DonorExport:
+    def __init__(
+        self,
+        bucket,
+        prefix=DEFAULT_PREFIX,
+        total_segments=DEFAULT_TOTAL_SEGMENTS,
+        max_workers=None,
+        output_format=FORMAT_NDJSON,
+        codec=CODEC_GZIP,
+        records_per_shard=DEFAULT_RECORDS_PER_SHARD,
+        page_size=DEFAULT_PAGE_SIZE,
+        read_capacity_per_second=None,
+        consistent_read=False,
+        s3_client=None,
+    ):
+        if output_format not in (FORMAT_NDJSON, FORMAT_PARQUET):
+            raise ValueError(f"Unknown export format: {output_format}")
+        if codec not in CODEC_EXTENSIONS:
+            raise ValueError(f"Unknown export codec: {codec}")
+        # Rather than finding out once the first shard is written.
+        if output_format == FORMAT_PARQUET and not importlib.util.find_spec("pyarrow"):
+            raise ValueError("Parquet exports need pyarrow; pip install it first")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.total_segments = total_segments
+        self.max_workers = max_workers if max_workers else total_segments
+        self.output_format = output_format
+        self.codec = codec
+        self.records_per_shard = records_per_shard
+        self.page_size = page_size
+        self.consistent_read = consistent_read
+        # pynamodb rate limits each scan separately, so split the budget.
+        self.segment_rate_limit = (
+            read_capacity_per_second / total_segments
+            if read_capacity_per_second
+            else None
+        )
+        self.s3 = s3_client if s3_client else boto3.client("s3")
+
+    def run(self, cut_at=None):
+        """Exports a snapshot of the Donor table as of cut_at (default now).
+
+        Returns the snapshot's manifest.
+        """
+        if cut_at is None:
+            cut_at = datetime.datetime.now(datetime.timezone.utc)
+        cut_at = cut_at.replace(microsecond=0)
+        snapshot_prefix = f"{self.prefix}cut={cut_at.strftime('%Y-%m-%dT%H:%M:%SZ')}/"
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(
+                executor.map(
+                    lambda segment: self.export_segment(
+                        segment, cut_at, snapshot_prefix
+                    ),
+                    range(self.total_segments),
+                )
+            )
+
+        shards = [shard for segment_shards, _ in results for shard in segment_shards]
+        manifest = {
+            "cut_at": cut_at.isoformat(),
+            "format": self.output_format,
+            "codec": self.codec if self.output_format == FORMAT_NDJSON else None,
+            "total_segments": self.total_segments,
+            "record_count": sum(shard["record_count"] for shard in shards),
+            "updated_after_cut": sum(updated for _, updated in results),
+            "shards": shards,
+        }
+        body = json.dumps(manifest)
+        # The manifests go last, so readers only find complete snapshots.
+        for key in [
+            snapshot_prefix + MANIFEST_NAME,
+            self.prefix + LATEST_MANIFEST_NAME,
+        ]:
+            self.s3.put_object(
+                Bucket=self.bucket, Key=key, Body=body, ContentType="application/json"
+            )
+        logging.info(f"Exported {manifest['record_count']} donors to {snapshot_prefix}")
+        return manifest
+
+    def export_segment(self, segment, cut_at, snapshot_prefix):
+        """Scans one segment into shards.
+
+        Returns (shard manifests, number of donors updated after cut_at).
+        """
+        writer = ShardWriter(self, snapshot_prefix, segment)
+        updated_after_cut = 0
+        donors = Donor.scan(
+            filter_condition=Donor.created_at.does_not_exist()
+            | (Donor.created_at <= cut_at),
+            segment=segment,
+            total_segments=self.total_segments,
+            page_size=self.page_size,
+            consistent_read=self.consistent_read,
+            rate_limit=self.segment_rate_limit,
+        )
+        for donor in donors:
+            if donor.updated_at and donor.updated_at > cut_at:
+                updated_after_cut += 1
+            writer.add(donor_to_record(donor))
+        writer.flush()
+        return writer.shards, updated_after_cut
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Export the Donor table to S3")
+    parser.add_argument("--bucket", required=True, help="S3 bucket to export to")
+    parser.add_argument("--prefix", default=DEFAULT_PREFIX)
+    parser.add_argument("--segments", type=int, default=DEFAULT_TOTAL_SEGMENTS)
+    parser.add_argument(
+        "--format", choices=[FORMAT_NDJSON, FORMAT_PARQUET], default=FORMAT_NDJSON
+    )
+    parser.add_argument("--codec", choices=list(CODEC_EXTENSIONS), default=CODEC_GZIP)
+    parser.add_argument(
+        "--records-per-shard", type=int, default=DEFAULT_RECORDS_PER_SHARD
+    )
+    parser.add_argument(
+        "--read-capacity",
+        type=float,
+        help="Read capacity units per second to use, across all segments",
+    )
+    parser.add_argument(
+        "--consistent-read",
+        action="store_true",
+        help="Scan with consistent reads, which cost twice the read capacity",
+    )
+    args = parser.parse_args()
+
+    DonorExport(
+        args.bucket,
+        prefix=args.prefix,
+        total_segments=args.segments,
+        output_format=args.format,
+        codec=args.codec,
+        records_per_shard=args.records_per_shard,
+        read_capacity_per_second=args.read_capacity,
+        consistent_read=args.consistent_read,
+    ).run()
@@ -0,0 +1,108 @@
+import datetime
+import gzip
+import importlib.util
+import io
+import json
+
+import boto3
+import pytest
+from moto import mock_s3
+
+from donors.donor_export import FORMAT_PARQUET, DonorExport, parquet_schema
+from models.donor import Donor
+
+BUCKET = "ew-donor-exports-dev"
+
+CUT_AT = datetime.datetime(2019, 6, 7, 20, 32, 24, tzinfo=datetime.timezone.utc)
+
+
+@pytest.fixture
+def s3_client():
+    with mock_s3():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def create_donor(i, created_at, updated_at=None):
+    donor = Donor(f"donor{i}@example.com")
+    donor.donor_id = f"id{i}"
+    donor.first_name = "Mary"
+    donor.total_donation_amount = i
+    donor.badges = {"eom", "debate"} if i % 2 else set()
+    donor.created_at = created_at
+    donor.updated_at = updated_at if updated_at else created_at
+    donor.save()
+
+
+def get_json(s3_client, key):
+    return json.loads(s3_client.get_object(Bucket=BUCKET, Key=key)["Body"].read())
+
+
+def test_export_ndjson(s3_client):
+    before_cut = CUT_AT - datetime.timedelta(days=1)
+    for i in range(20):
+        create_donor(i, before_cut)
+    create_donor(20, before_cut, updated_at=CUT_AT + datetime.timedelta(minutes=1))
+    # Created after the cut, so not in the snapshot.
+    create_donor(21, CUT_AT + datetime.timedelta(minutes=1))
+
+    manifest = DonorExport(
+        BUCKET, total_segments=4, records_per_shard=3, s3_client=s3_client
+    ).run(cut_at=CUT_AT)
+
+    assert manifest["cut_at"] == "2019-06-07T20:32:24+00:00"
+    assert manifest["record_count"] == 21
+    assert manifest["updated_after_cut"] == 1
+    assert get_json(s3_client, "donors/latest.json") == manifest
+    assert (
+        get_json(s3_client, "donors/cut=2019-06-07T20:32:24Z/manifest.json") == manifest
+    )
+
+    records = []
+    for shard in manifest["shards"]:
+        assert shard["key"].startswith("donors/cut=2019-06-07T20:32:24Z/part-")
+        assert shard["key"].endswith(".ndjson.gz")
+        assert 1 <= shard["record_count"] <= 3
+        body = s3_client.get_object(Bucket=BUCKET, Key=shard["key"])["Body"].read()
+        lines = gzip.decompress(body).decode("utf-8").splitlines()
+        assert len(lines) == shard["record_count"]
+        records.extend(json.loads(line) for line in lines)
+
+    assert sorted(r["email"] for r in records) == sorted(
+        f"donor{i}@example.com" for i in range(21)
+    )
+    donor1 = next(r for r in records if r["email"] == "donor1@example.com")
+    assert donor1["donor_id"] == "id1"
+    assert donor1["total_donation_amount"] == 1
+    assert donor1["badges"] == ["debate", "eom"]
+    assert donor1["created_at"] == "2019-06-06T20:32:24+00:00"
+
+
+def test_export_parquet(s3_client):
+    pq = pytest.importorskip("pyarrow.parquet")
+    for i in range(5):
+        create_donor(i, CUT_AT - datetime.timedelta(days=1))
+
+    manifest = DonorExport(
+        BUCKET, total_segments=2, output_format=FORMAT_PARQUET, s3_client=s3_client
+    ).run(cut_at=CUT_AT)
+
+    rows = []
+    for shard in manifest["shards"]:
+        assert shard["key"].endswith(".parquet")
+        body = s3_client.get_object(Bucket=BUCKET, Key=shard["key"])["Body"].read()
+        rows.extend(pq.read_table(io.BytesIO(body)).to_pylist())
+    assert sorted(r["total_donation_amount"] for r in rows) == [0, 1, 2, 3, 4]
+    assert all(r["badges"] in ([], ["debate", "eom"]) for r in rows)
+
+
+def test_parquet_schema_has_every_donor_attribute():
+    pytest.importorskip("pyarrow")
+    assert parquet_schema().names == list(Donor.get_attributes())
+
+
+def test_export_parquet_needs_pyarrow(monkeypatch):
+    monkeypatch.setattr(importlib.util, "find_spec", lambda name: None)
+    with pytest.raises(ValueError, match="pyarrow"):
+        DonorExport(BUCKET, output_format=FORMAT_PARQUET, s3_client=object())
@@ -1,4 +1,4 @@
-from flask import Blueprint, Response, request
+from flask import Blueprint, Response, jsonify, request
 
 from common.basic_auth import requires_auth
 from models.generic_kv import GenericKV
@@ -13,10 +13,17 @@ def value_get():
     if not k:
         return ("Generic KV requires a key", 400)
     try:
-        generic_kv = GenericKV.get(k)
+        v, etag = GenericKV.get_cached_value(k)
     except GenericKV.DoesNotExist:
         return (f"Key {k} not found", 404)
-    return Response(response=generic_kv.v, mimetype="application/json")
+
+    # Clients that already have this value can skip downloading it again.
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(response=v, mimetype="application/json")
+    response.set_etag(etag)
+    return response
 
 
 @mod.route("/value", methods=["POST", "PUT"])
@@ -28,3 +35,44 @@ def value_put():
         return ("Generic KV requires a key", 400)
     GenericKV.put_value(k, v)
     return ("", 204)
+
+
+# Batch versions of the above, so clients that need dozens of keys can get
+# or set them all in one request.
+MAX_BATCH_KEYS = 1000
+
+
+@mod.route("/values", methods=["GET"])
+@requires_auth("generic_kv_read")
+def values_get():
+    """Returns {"values": {k: v}, "missing": [k]} for every k param."""
+    ks = list(dict.fromkeys(k.strip() for k in request.args.getlist("k")))
+    if not ks or not all(ks):
+        return ("Generic KV requires keys", 400)
+    if len(ks) > MAX_BATCH_KEYS:
+        return (f"Generic KV can get at most {MAX_BATCH_KEYS} keys at once", 400)
+
+    values = GenericKV.get_cached_values(ks)
+    return jsonify(
+        {
+            "values": {k: v for k, (v, _) in values.items()},
+            "missing": [k for k in ks if k not in values],
+        }
+    )
+
+
+@mod.route("/values", methods=["POST", "PUT"])
+@requires_auth("generic_kv_write")
+def values_put():
+    """Sets every key in a JSON object body to its (string) value."""
+    values = request.get_json(force=True, silent=True)
+    if not isinstance(values, dict) or not values:
+        return ("Generic KV requires a JSON object of keys to values", 400)
+    values = {k.strip(): v for k, v in values.items()}
+    if not all(values) or not all(isinstance(v, str) for v in values.values()):
+        return ("Generic KV requires non-empty keys and string values", 400)
+    if len(values) > MAX_BATCH_KEYS:
+        return (f"Generic KV can put at most {MAX_BATCH_KEYS} keys at once", 400)
+
+    GenericKV.put_values(values)
+    return ("", 204)
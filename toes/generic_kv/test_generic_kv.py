@@ -1,9 +1,18 @@
 import json
+from unittest import mock
 
+import freezegun
 import pytest
 from flask import url_for
 
 from common.basic_auth import mock_basic_auth
+from models.generic_kv import GenericKV, GenericKVCache, generic_kv_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_generic_kv_cache():
+    # Tests share the process, and so the cache.
+    generic_kv_cache.clear()
 
 
 @pytest.fixture
@@ -42,3 +51,128 @@ def test_put_get(client, mock_generic_kv_read_auth, mock_generic_kv_write_auth):
     )
     assert res.status_code == 200
     assert res.data == b"test value"
+
+
+def test_get_not_modified(
+    client, mock_generic_kv_read_auth, mock_generic_kv_write_auth
+):
+    client.put(
+        url_for("generic_kv.value_put", k="test key"),
+        headers={"Authorization": mock_generic_kv_write_auth},
+        data=b"test value",
+    )
+    res = client.get(
+        url_for("generic_kv.value_get", k="test key"),
+        headers={"Authorization": mock_generic_kv_read_auth},
+    )
+    etag = res.headers["ETag"]
+
+    res = client.get(
+        url_for("generic_kv.value_get", k="test key"),
+        headers={"Authorization": mock_generic_kv_read_auth, "If-None-Match": etag},
+    )
+    assert res.status_code == 304
+    assert res.data == b""
+    assert res.headers["ETag"] == etag
+
+    client.put(
+        url_for("generic_kv.value_put", k="test key"),
+        headers={"Authorization": mock_generic_kv_write_auth},
+        data=b"new value",
+    )
+    res = client.get(
+        url_for("generic_kv.value_get", k="test key"),
+        headers={"Authorization": mock_generic_kv_read_auth, "If-None-Match": etag},
+    )
+    assert res.status_code == 200
+    assert res.data == b"new value"
+    assert res.headers["ETag"] != etag
+
+
+def test_get_cached_value_reads_through():
+    GenericKV.put_value("test key", "test value")
+    generic_kv_cache.clear()
+
+    with mock.patch.object(GenericKV, "get", wraps=GenericKV.get) as get:
+        assert GenericKV.get_cached_value("test key")[0] == "test value"
+        assert GenericKV.get_cached_value("test key")[0] == "test value"
+        assert get.call_count == 1
+
+        GenericKV.put_value("test key", "new value")
+        get.reset_mock()
+        assert GenericKV.get_cached_value("test key")[0] == "new value"
+        assert get.call_count == 0
+
+
+def test_get_cached_value_missing():
+    with pytest.raises(GenericKV.DoesNotExist):
+        GenericKV.get_cached_value("missing key")
+
+
+def test_cache_expires():
+    cache = GenericKVCache(ttl_seconds=60)
+    with freezegun.freeze_time("2019-06-07T20:00:00Z") as frozen_time:
+        cache.put("k", "v")
+        frozen_time.tick(59)
+        assert cache.get("k")[0] == "v"
+        frozen_time.tick(2)
+        assert cache.get("k") is None
+
+
+def test_cache_evicts_least_recently_used():
+    cache = GenericKVCache(max_entries=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.get("a")
+    cache.put("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a")[0] == "1"
+    assert cache.get("c")[0] == "3"
+
+
+def test_batch_put_get(client, mock_generic_kv_read_auth, mock_generic_kv_write_auth):
+    # More keys than fit in one BatchGetItem (100) or BatchWriteItem (25).
+    values = {f"key {i}": f"value {i}" for i in range(130)}
+    res = client.put(
+        url_for("generic_kv.values_put"),
+        headers={"Authorization": mock_generic_kv_write_auth},
+        data=json.dumps(values),
+    )
+    assert res.status_code == 204
+
+    generic_kv_cache.clear()
+    res = client.get(
+        url_for("generic_kv.values_get", k=list(values) + ["missing key"]),
+        headers={"Authorization": mock_generic_kv_read_auth},
+    )
+    assert res.status_code == 200
+    assert res.json == {"values": values, "missing": ["missing key"]}
+
+
+def test_batch_put_keeps_created_at():
+    GenericKV.put_value("test key", "test value")
+    created_at = GenericKV.get("test key").created_at
+
+    GenericKV.put_values({"test key": "new value", "other key": "other value"})
+    generic_kv = GenericKV.get("test key")
+    assert generic_kv.v == "new value"
+    assert generic_kv.created_at == created_at
+    assert GenericKV.get("other key").v == "other value"
+
+
+def test_batch_put_invalid(client, mock_generic_kv_write_auth):
+    for data in [b"not json", b"[]", b"{}", b'{"k": 1}', b'{"": "v"}']:
+        res = client.put(
+            url_for("generic_kv.values_put"),
+            headers={"Authorization": mock_generic_kv_write_auth},
+            data=data,
+        )
+        assert res.status_code == 400
+
+
+def test_batch_get_requires_keys(client, mock_generic_kv_read_auth):
+    res = client.get(
+        url_for("generic_kv.values_get"),
+        headers={"Authorization": mock_generic_kv_read_auth},
+    )
+    assert res.status_code == 400
@@ -1,4 +1,8 @@
+import logging
+from types import MappingProxyType
+
 from flask import Blueprint, jsonify, request
+from zappa.asynchronous import task
 
 from common.input_validation import extract_personal_reason
 from common.settings import settings
@@ -20,14 +24,83 @@ ERROR_RESPONSE = {"message": "Sorry, I've hiccupped! Try writing to me tomorrow.
 
 
 class Flow:
-    state_to_processor = {}
-
-    def __init__(self, initial_state="state_initial"):
-        for processor_method_name in dir(self):
+    """A conversation, as states that each process one incoming message.
+
+    Subclasses define a _state_foo method for each state_foo, and declare
+    in TRANSITIONS the states each state may go to. When a subclass is
+    created, its methods are compiled into state_to_processor (an
+    immutable state -> function table) and checked against TRANSITIONS:
+    every state must be declared, every declared next state must exist,
+    every state must be reachable from INITIAL_STATE, and only
+    TERMINAL_STATES may lead nowhere. At runtime, process_message logs
+    transitions that aren't declared, and replies with ERROR_RESPONSE's
+    message rather than go to a state that doesn't exist.
+    """
+
+    INITIAL_STATE = "state_initial"
+    TERMINAL_STATES = frozenset()
+    TRANSITIONS = {}
+
+    state_to_processor = MappingProxyType({})
+    state_transitions = MappingProxyType({})
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        state_to_processor = {}
+        for processor_method_name in dir(cls):
             if processor_method_name.startswith("_state_"):
                 state = processor_method_name.replace("_state_", "state_")
-                self.state_to_processor[state] = getattr(self, processor_method_name)
-        self.current_state = initial_state
+                state_to_processor[state] = getattr(cls, processor_method_name)
+        undeclared_states = state_to_processor.keys() - cls.TRANSITIONS.keys()
+        if undeclared_states:
+            raise TypeError(
+                f"{cls.__name__} has {sorted(undeclared_states)} not in TRANSITIONS"
+            )
+        state_transitions = {
+            state: frozenset(next_states)
+            for state, next_states in cls.TRANSITIONS.items()
+        }
+        cls._check_state_graph(state_to_processor, state_transitions)
+        cls.state_to_processor = MappingProxyType(state_to_processor)
+        cls.state_transitions = MappingProxyType(state_transitions)
+
+    @classmethod
+    def _check_state_graph(cls, state_to_processor, state_transitions):
+        if cls.INITIAL_STATE not in state_to_processor:
+            raise TypeError(f"{cls.__name__} has no {cls.INITIAL_STATE}")
+        for state, next_states in state_transitions.items():
+            unknown_states = ({state} | next_states) - state_to_processor.keys()
+            if unknown_states:
+                raise TypeError(
+                    f"{cls.__name__}.{state} goes to unknown {sorted(unknown_states)}"
+                )
+
+        reachable = {cls.INITIAL_STATE}
+        to_visit = [cls.INITIAL_STATE]
+        while to_visit:
+            for next_state in state_transitions[to_visit.pop()] - reachable:
+                reachable.add(next_state)
+                to_visit.append(next_state)
+        unreachable_states = state_to_processor.keys() - reachable
+        if unreachable_states:
+            raise TypeError(
+                f"{cls.__name__} has unreachable {sorted(unreachable_states)}"
+            )
+
+        terminal_states = {
+            state
+            for state, next_states in state_transitions.items()
+            if not next_states - {state}
+        }
+        unexpected_terminal_states = terminal_states - cls.TERMINAL_STATES
+        if unexpected_terminal_states:
+            raise TypeError(
+                f"{cls.__name__} has terminal {sorted(unexpected_terminal_states)}"
+                " not in TERMINAL_STATES"
+            )
+
+    def __init__(self, initial_state=None):
+        self.current_state = initial_state or self.INITIAL_STATE
         assert self.current_state in self.state_to_processor
 
     def result_transition(self, next_state, incoming_message):
@@ -56,10 +129,20 @@ class Flow:
         message = ""
         while True:
             result = self.state_to_processor[self.current_state](
-                incoming_message, profile
+                self, incoming_message, profile
             )
 
             if result.get("next_state"):
+                if (
+                    result["next_state"]
+                    not in self.state_transitions[self.current_state]
+                ):
+                    logging.error(
+                        f"{type(self).__name__}.{self.current_state} went to"
+                        f" undeclared {result['next_state']}"
+                    )
+                    if result["next_state"] not in self.state_to_processor:
+                        return ERROR_RESPONSE["message"]
                 print(
                     f"Transitioning from {self.current_state} to {result['next_state']}"
                 )
@@ -78,6 +161,17 @@ class Flow:
 
 
 class ReferFlow(Flow):
+    TRANSITIONS = {
+        "state_initial": ["state_receive_personal_reason"],
+        "state_receive_personal_reason": ["state_receive_name"],
+        "state_receive_name": ["state_receive_postal_code"],
+        "state_receive_postal_code": ["state_receive_referee_name"],
+        "state_receive_referee_name": ["state_receive_referee_phone_number"],
+        "state_receive_referee_phone_number": ["state_receive_referee_city_state"],
+        "state_receive_referee_city_state": ["state_send_referral"],
+        "state_send_referral": ["state_receive_referee_name"],
+    }
+
     def _state_initial(self, incoming_message, profile):
         self.reset_referee(profile)
         return self.result_start_message_and_transition(
@@ -141,9 +235,11 @@ class ReferFlow(Flow):
 
     def _state_receive_referee_name(self, incoming_message, profile):
         if incoming_message:
-            referee_first_and_last_name, referee_first_name, referee_last_name = extract_name(
-                incoming_message
-            )
+            (
+                referee_first_and_last_name,
+                referee_first_name,
+                referee_last_name,
+            ) = extract_name(incoming_message)
             if not referee_first_name or not referee_last_name:
                 return self.result_send_message(
                     "Reply with your friend's first and last name."
@@ -202,20 +298,10 @@ class ReferFlow(Flow):
 
     def _state_send_referral(self, incoming_message, profile):
         referral_message = f"Your friend {profile.first_name} {profile.last_name} invited you to join the fight with Elizabeth Warren. {profile.refer_referee_first_name}, we need you in this fight too. Reply FIGHT to join."
-        send_sms(
-            settings.mobile_commons_username,
-            settings.mobile_commons_password,
-            TECH_SANDBOX_CAMPAIGN_ID,
-            profile.refer_referee_phone_number,
-            referral_message,
-        )
         followup_referral_message = f'{profile.first_name} supports Elizabeth because: "{profile.refer_personal_reason}"'
-        send_sms(
-            settings.mobile_commons_username,
-            settings.mobile_commons_password,
-            TECH_SANDBOX_CAMPAIGN_ID,
+        send_referral_messages(
             profile.refer_referee_phone_number,
-            followup_referral_message,
+            [referral_message, followup_referral_message],
         )
 
         result = self.result_send_message_and_transition(
@@ -257,6 +343,37 @@ class ReferFlow(Flow):
         profile.refer_referee_state = None
 
 
+@task
+def send_referral_messages(phone_number, messages):
+    """Texts messages to phone_number, in order.
+
+    Mobile Commons gives mdata very little time to respond, so referral
+    texts are sent from their own asynchronous Lambda invocation rather than
+    while the user waits for our reply. Sending them one after another
+    within the task keeps a follow-up from arriving before its invite.
+
+    Lambda retries a task that raises, so we only raise if nothing has
+    been sent yet. Once a text has gone out, a retry would send it again,
+    so a later failure is logged and the rest of the messages dropped.
+    """
+    for i, message in enumerate(messages):
+        try:
+            send_sms(
+                settings.mobile_commons_username,
+                settings.mobile_commons_password,
+                TECH_SANDBOX_CAMPAIGN_ID,
+                phone_number,
+                message,
+            )
+        except Exception:
+            if i == 0:
+                raise
+            logging.exception(
+                f"Couldn't send referral message {i + 1} of {len(messages)}"
+            )
+            return
+
+
 @mod.route("/refer")
 def refer():
     incoming_message = request.args.get("args", "").strip()
@@ -300,9 +417,11 @@ def refer():
     message = flow.process_message(incoming_message, profile)
     profile.last_state = flow.current_state
 
-    # TODO: Use profile.update()? Only save if actual modified?
-    profile.set_updated_at()
-    profile.save()
+    # Re-prompts often leave the profile as it was; then there's nothing to
+    # save (see models/dirty_tracking.py).
+    if profile.is_dirty():
+        profile.set_updated_at()
+        profile.save()
 
     return jsonify({"message": message})
 
@@ -346,13 +465,7 @@ def debt():
             message = "Great, sent! If you know others still with student loan debt, reply with their phone number."
             referral_message = f"Hi! Your friend {first_name} thought you'd be interested in Elizabeth Warren's plan to cancel student loan debt. Reply SANDBOXDEBT to see how much you'd save."
 
-            send_sms(
-                settings.mobile_commons_username,
-                settings.mobile_commons_password,
-                TECH_SANDBOX_CAMPAIGN_ID,
-                phone_number,
-                referral_message,
-            )
+            send_referral_messages(phone_number, [referral_message])
         else:
             message = "To share the student debt calculator with a friend, reply with their phone number! (including area code)"
 
@@ -1,10 +1,14 @@
 import datetime
 import json
+from unittest import mock
 
 import pytest
 import responses
 from flask import url_for
 
+from common.settings import settings
+from mdata.mdata import ERROR_RESPONSE, Flow, ReferFlow, send_referral_messages
+from models.chat_profile import ChatProfile
 from models.chat_referral import ChatReferral
 
 DEFAULT_PROFILE = {"phone": "15105016227", "profile_email": "jasonkatzbrown@gmail.com"}
@@ -77,21 +81,14 @@ def test_refer(client):
         == "What city and state does Richard live in? For example: Reno NV"
     )
 
+    sent_bodies = []
+
     def check_mobile_commons_request_body(request):
         body = json.loads(request.body)
-        expected = {
-            "campaign_id": 189718,
-            "phone_number": "15102194255",
-            "body": [
-                "Your friend Jason Katz-Brown invited you to join the fight with Elizabeth Warren. Richard, we need you in this fight too. Reply FIGHT to join.",
-                'Jason supports Elizabeth because: "The system is rigged *for* me in so many ways; now it\'s time For big structural change!"',
-            ],
-        }
+        expected = {"campaign_id": 189718, "phone_number": "15102194255"}
         for k, v in expected.items():
-            if isinstance(v, list):
-                assert body[k] in v
-            else:
-                assert body[k] == v
+            assert body[k] == v
+        sent_bodies.append(body["body"])
         return (200, {}, MOBILE_COMMONS_SEND_MESSAGE_RESPONSE)
 
     responses.add_callback(
@@ -107,6 +104,11 @@ def test_refer(client):
         res.json["message"]
         == "Great, sent an invite to Richard. What's the name of another person you'd like to invite to join the fight?"
     )
+    # The invite always goes out before the follow-up.
+    assert sent_bodies == [
+        "Your friend Jason Katz-Brown invited you to join the fight with Elizabeth Warren. Richard, we need you in this fight too. Reply FIGHT to join.",
+        'Jason supports Elizabeth because: "The system is rigged *for* me in so many ways; now it\'s time For big structural change!"',
+    ]
 
     referral = ChatReferral.get_or_create_referral("15102194255", "15105016227")
     assert referral.first_and_last_name == "Richard Katz"
@@ -139,6 +141,17 @@ def test_refer(client):
     assert res.json["message"] == "Cool, what's Francis Starlite's phone number?"
 
 
+@responses.activate
+def test_refer_reprompt_does_not_save(client):
+    for args in ["", "Because she has a plan"]:
+        client.get(url_for("mdata.refer", **DEFAULT_PROFILE, args=args))
+
+    with mock.patch.object(ChatProfile, "update") as update:
+        res = client.get(url_for("mdata.refer", **DEFAULT_PROFILE, args="Jason"))
+    assert res.json["message"] == "Reply with your first and last name."
+    assert not update.called
+
+
 @responses.activate
 def test_debt_calculation(client):
     params = {**DEFAULT_PROFILE_WITH_LOTS_INFO, "args": "120000"}
@@ -175,3 +188,118 @@ def test_debt_referral(client):
         res.json["message"]
         == "Great, sent! If you know others still with student loan debt, reply with their phone number."
     )
+
+
+def test_flow_states_compiled_per_class():
+    class OtherFlow(Flow):
+        TERMINAL_STATES = frozenset(["state_initial"])
+        TRANSITIONS = {"state_initial": []}
+
+        def _state_initial(self, incoming_message, profile):
+            return self.result_send_message("Hi")
+
+    assert set(OtherFlow.state_to_processor) == {"state_initial"}
+    assert "state_send_referral" in ReferFlow.state_to_processor
+    assert Flow.state_to_processor == {}
+    with pytest.raises(TypeError):
+        ReferFlow.state_to_processor["state_initial"] = None
+
+    assert ReferFlow.state_transitions["state_send_referral"] == {
+        "state_receive_referee_name"
+    }
+
+
+def test_flow_unknown_state():
+    with pytest.raises(TypeError, match="unknown"):
+
+        class BadFlow(Flow):
+            TRANSITIONS = {"state_initial": ["state_nope"]}
+
+            def _state_initial(self, incoming_message, profile):
+                return self.result_transition("state_nope", incoming_message)
+
+
+def test_flow_undeclared_state():
+    with pytest.raises(TypeError, match="not in TRANSITIONS"):
+
+        class BadFlow(Flow):
+            TERMINAL_STATES = frozenset(["state_initial"])
+
+            def _state_initial(self, incoming_message, profile):
+                return self.result_send_message("Hi")
+
+
+def test_flow_undeclared_transition():
+    class SneakyFlow(Flow):
+        TRANSITIONS = {
+            "state_initial": ["state_hello"],
+            "state_hello": ["state_bye"],
+            "state_bye": [],
+        }
+        TERMINAL_STATES = frozenset(["state_bye"])
+
+        def _state_initial(self, incoming_message, profile):
+            if incoming_message == "nope":
+                return self.result_transition("state_nope", incoming_message)
+            return self.result_transition("state_bye", incoming_message)
+
+        def _state_hello(self, incoming_message, profile):
+            return self.result_transition("state_bye", incoming_message)
+
+        def _state_bye(self, incoming_message, profile):
+            return self.result_send_message("Bye")
+
+    # Logged, but the user still gets a reply.
+    with mock.patch("mdata.mdata.logging") as logging:
+        assert SneakyFlow().process_message("hi", None) == "Bye"
+    assert "undeclared state_bye" in logging.error.call_args[0][0]
+
+    assert SneakyFlow().process_message("nope", None) == ERROR_RESPONSE["message"]
+
+
+def test_flow_unreachable_state():
+    with pytest.raises(TypeError, match="unreachable"):
+
+        class BadFlow(Flow):
+            TRANSITIONS = {"state_initial": [], "state_orphan": ["state_initial"]}
+
+            def _state_initial(self, incoming_message, profile):
+                return self.result_send_message("Hi")
+
+            def _state_orphan(self, incoming_message, profile):
+                return self.result_transition("state_initial", incoming_message)
+
+
+def test_flow_terminal_state():
+    class Goodbye:
+        TRANSITIONS = {"state_initial": ["state_goodbye"], "state_goodbye": []}
+
+        def _state_initial(self, incoming_message, profile):
+            return self.result_transition("state_goodbye", incoming_message)
+
+        def _state_goodbye(self, incoming_message, profile):
+            return self.result_send_message("Bye")
+
+    with pytest.raises(TypeError, match="terminal"):
+
+        class BadFlow(Goodbye, Flow):
+            pass
+
+    class GoodFlow(Goodbye, Flow):
+        TERMINAL_STATES = frozenset(["state_goodbye"])
+
+    assert GoodFlow("state_goodbye").current_state == "state_goodbye"
+
+
+def test_send_referral_messages_never_resends():
+    settings.override_cached_property("mobile_commons_username", "test_mc_user")
+    settings.override_cached_property("mobile_commons_password", "test_mc_password")
+    with mock.patch("mdata.mdata.send_sms", side_effect=[None, RuntimeError()]) as sms:
+        # The invite went out, so Lambda mustn't retry the task.
+        send_referral_messages("15102194255", ["Invite", "Followup", "More"])
+    assert [c[0][4] for c in sms.call_args_list] == ["Invite", "Followup"]
+
+    with mock.patch("mdata.mdata.send_sms", side_effect=RuntimeError()):
+        # Nothing was sent, so a retry is safe.
+        with pytest.raises(RuntimeError):
+            send_referral_messages("15102194255", ["Invite", "Followup"])
@@ -4,9 +4,11 @@ from pynamodb.attributes import UnicodeAttribute, UTCDateTimeAttribute
 from pynamodb.models import Model
 
 from ew_common.input_validation import extract_phone_number
+from models.dirty_tracking import DirtyTrackingMixin
+from models.upsert import upsert
 
 
-class ChatProfile(Model):
+class ChatProfile(DirtyTrackingMixin, Model):
     class Meta:
         table_name = "ChatProfile"
 
@@ -49,6 +51,19 @@ class ChatProfile(Model):
 
         return chat_state
 
+    @staticmethod
+    def upsert_profile(phone_number_input, **values):
+        """Sets values on a profile without reading it first.
+
+        For when we don't need the rest of the profile; see models/upsert.py.
+        """
+        phone_number = extract_phone_number(phone_number_input)
+        if not phone_number:
+            raise ValueError(
+                f"Invalid phone number in upsert_profile: {phone_number_input}"
+            )
+        return upsert(ChatProfile, phone_number, **values)
+
     def set_created_at(self):
         self.created_at = datetime.datetime.utcnow()
 
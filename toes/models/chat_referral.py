@@ -4,9 +4,10 @@ from pynamodb.attributes import UnicodeAttribute, UTCDateTimeAttribute
 from pynamodb.models import Model
 
 from ew_common.input_validation import extract_phone_number
+from models.dirty_tracking import DirtyTrackingMixin
 
 
-class ChatReferral(Model):
+class ChatReferral(DirtyTrackingMixin, Model):
     class Meta:
         table_name = "ChatReferral"
 
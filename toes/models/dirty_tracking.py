@@ -0,0 +1,93 @@
+# Saves that only write what changed.
+#
+# Model.save() puts the whole item, even if nothing about it changed since
+# we read it, e.g. when a chat flow just re-prompts. DirtyTrackingMixin
+# remembers each attribute's value as read from DynamoDB, and its save()
+# sends an UpdateItem of just the attributes that differ, or nothing at
+# all if none do. Values are compared, not assignments tracked, so in-place
+# changes (like donor.badges.add(...)) count too.
+
+import copy
+
+
+def _is_empty(value):
+    # DynamoDB doesn't store empty sets, so those are as good as None.
+    return value is None or (isinstance(value, (set, frozenset)) and not value)
+
+
+class DirtyTrackingMixin:
+    """Mix in before Model, e.g. class ChatProfile(DirtyTrackingMixin, Model)."""
+
+    def __init__(self, *args, _user_instantiated=True, **kwargs):
+        super().__init__(*args, _user_instantiated=_user_instantiated, **kwargs)
+        if _user_instantiated:
+            # Not read from DynamoDB (as far as we know), so every attribute
+            # that's set needs writing.
+            self._saved_values = None
+        else:
+            self._mark_saved()
+
+    def _mark_saved(self):
+        self._saved_values = {
+            name: copy.deepcopy(getattr(self, name)) for name in self.get_attributes()
+        }
+
+    def dirty_attributes(self):
+        """Names of the non-key attributes that need writing."""
+        dirty = []
+        for name, attribute in self.get_attributes().items():
+            if attribute.is_hash_key or attribute.is_range_key:
+                continue
+            value = getattr(self, name)
+            if self._saved_values is None:
+                if not _is_empty(value):
+                    dirty.append(name)
+                continue
+            saved = self._saved_values[name]
+            if _is_empty(value) and _is_empty(saved):
+                continue
+            if value != saved:
+                dirty.append(name)
+        return dirty
+
+    def is_dirty(self):
+        return self._saved_values is None or bool(self.dirty_attributes())
+
+    def save(self, condition=None):
+        """Writes the dirty attributes with UpdateItem.
+
+        Does nothing, and returns None, if the item was read from DynamoDB
+        and hasn't changed since.
+        """
+        dirty = self.dirty_attributes()
+        if not dirty:
+            if self._saved_values is not None:
+                return None
+            # UpdateItem needs something to update; a bare key is rare.
+            data = super().save(condition=condition)
+            self._mark_saved()
+            return data
+
+        model = type(self)
+        actions = []
+        for name in dirty:
+            attribute = getattr(model, name)
+            value = getattr(self, name)
+            if _is_empty(value):
+                actions.append(attribute.remove())
+            else:
+                actions.append(attribute.set(value))
+        data = self.update(actions=actions, condition=condition)
+
+        # update() sets attributes that aren't in the item to None; put
+        # defaults back, as reading the item would.
+        for name, attribute in self.get_attributes().items():
+            if getattr(self, name) is None and attribute.default is not None:
+                default = attribute.default
+                setattr(self, name, default() if callable(default) else default)
+        self._mark_saved()
+        return data
+
+    def refresh(self, consistent_read=False):
+        super().refresh(consistent_read=consistent_read)
+        self._mark_saved()
@@ -0,0 +1,94 @@
+from unittest import mock
+
+from common.settings import settings
+from models.chat_profile import ChatProfile
+from models.chat_referral import ChatReferral
+from models.donor import Donor
+
+Donor.Meta.table_name = settings.donors_table_name
+
+
+def saved_profile():
+    profile = ChatProfile.get_or_create_profile("5105016227")
+    profile.first_name = "Jason"
+    profile.last_state = "state_receive_name"
+    profile.set_updated_at()
+    profile.save()
+    return ChatProfile.get("15105016227")
+
+
+def test_new_item_is_dirty():
+    profile = ChatProfile.get_or_create_profile("5105016227")
+    assert profile.is_dirty()
+    profile.save()
+    assert not profile.is_dirty()
+    assert ChatProfile.get("15105016227").created_at == profile.created_at
+
+
+def test_unchanged_item_not_saved():
+    profile = saved_profile()
+    assert not profile.is_dirty()
+    with mock.patch.object(ChatProfile, "_get_connection") as get_connection:
+        assert profile.save() is None
+    assert not get_connection.called
+
+
+def test_only_changed_attributes_written():
+    profile = saved_profile()
+    profile.last_state = "state_receive_postal_code"
+    assert profile.dirty_attributes() == ["last_state"]
+
+    # Written by someone else since we read the profile.
+    ChatProfile.upsert_profile("5105016227", email="jason@example.com")
+
+    profile.save()
+    assert not profile.is_dirty()
+    saved = ChatProfile.get("15105016227")
+    assert saved.last_state == "state_receive_postal_code"
+    assert saved.first_name == "Jason"
+    assert saved.email == "jason@example.com"
+
+
+def test_removed_attribute():
+    profile = saved_profile()
+    profile.first_name = None
+    profile.save()
+    assert ChatProfile.get("15105016227").first_name is None
+
+
+def test_in_place_set_changes_are_dirty():
+    donor = Donor.get_or_create_donor("donor@example.com")
+    donor.save()
+    donor = Donor.get("donor@example.com")
+    assert donor.badges == set()
+
+    donor.badges.add(Donor.BadgeId.EOM.value)
+    assert donor.dirty_attributes() == ["badges"]
+    donor.save()
+    assert Donor.get("donor@example.com").badges == {Donor.BadgeId.EOM.value}
+
+    donor.badges.clear()
+    donor.save()
+    assert donor.badges == set()
+    assert Donor.get("donor@example.com").badges == set()
+
+
+def test_empty_set_and_none_are_the_same():
+    donor = Donor.get_or_create_donor("donor@example.com")
+    donor.save()
+    donor = Donor.get("donor@example.com")
+    assert donor.badges == set()
+
+    # Neither is stored in DynamoDB, so there's nothing to write.
+    donor.badges = None
+    assert not donor.is_dirty()
+
+
+def test_range_key_model():
+    referral = ChatReferral.get_or_create_referral("5102194255", "5105016227")
+    referral.first_name = "Richard"
+    referral.save()
+
+    referral = ChatReferral.get("15102194255", "15105016227")
+    assert referral.first_name == "Richard"
+    assert not referral.is_dirty()
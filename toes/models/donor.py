@@ -14,8 +14,11 @@ from pynamodb.attributes import (
 )
 from pynamodb.models import Model
 
+from models.dirty_tracking import DirtyTrackingMixin
+from models.upsert import upsert
 
-class Donor(Model):
+
+class Donor(DirtyTrackingMixin, Model):
     class BadgeId(Enum):
         EOM = "eom"
         EOQ = "eoq"
@@ -67,6 +70,30 @@ class Donor(Model):
 
         return donor
 
+    @staticmethod
+    def get_or_create_donors(emails):
+        """Batch version of get_or_create_donor. Returns dict of email to Donor."""
+        emails = set(emails)
+        if not all(emails):
+            raise ValueError(f"Invalid email in get_or_create_donors: {emails}")
+        donors = {donor.email: donor for donor in Donor.batch_get(emails)}
+        for email in emails - donors.keys():
+            donor = Donor(email)
+            donor.set_created_at()
+            donors[email] = donor
+
+        return donors
+
+    @staticmethod
+    def upsert_donor(email, **values):
+        """Sets values on a donor without reading it first.
+
+        For when we don't need the rest of the donor; see models/upsert.py.
+        """
+        if not email:
+            raise ValueError(f"Invalid email in upsert_donor: {email}")
+        return upsert(Donor, email, **values)
+
     DONOR_ID_LENGTH = 12
 
     @staticmethod
@@ -1,8 +1,65 @@
 import datetime
+import hashlib
+import time
+from collections import OrderedDict
 
 from pynamodb.attributes import UnicodeAttribute, UTCDateTimeAttribute
 from pynamodb.models import Model
 
+from models.upsert import upsert
+
+# GenericKV mostly holds dashboard and config blobs that are read far more
+# often than they're written, so reads go through an in-process cache.
+# Writes through this process update it right away; writes from other
+# Lambdas show up once the cached value expires.
+CACHE_TTL_SECONDS = 60
+CACHE_MAX_ENTRIES = 1000
+
+
+def etag_of(v):
+    return hashlib.sha1((v or "").encode("utf-8")).hexdigest()
+
+
+class GenericKVCache:
+    """Size-bounded LRU of k -> (v, etag), with a TTL per key."""
+
+    def __init__(self, ttl_seconds=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # k -> (v, etag, expires at in epoch seconds)
+        self._entries = OrderedDict()
+
+    def get(self, k):
+        """Returns (v, etag) for k, or None if it isn't cached."""
+        entry = self._entries.get(k)
+        if not entry:
+            return None
+        v, etag, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[k]
+            return None
+        self._entries.move_to_end(k)
+        return v, etag
+
+    def put(self, k, v):
+        etag = etag_of(v)
+        self._entries[k] = (v, etag, time.time() + self.ttl_seconds)
+        self._entries.move_to_end(k)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return v, etag
+
+    def invalidate(self, k):
+        self._entries.pop(k, None)
+
+    def clear(self):
+        """Drops every entry, e.g. between tests."""
+        self._entries.clear()
+
+
+# Module-level so it's shared across warm invocations of the same Lambda.
+generic_kv_cache = GenericKVCache()
+
 
 class GenericKV(Model):
     class Meta:
@@ -32,12 +89,81 @@ class GenericKV(Model):
 
         return generic_kv
 
+    @staticmethod
+    def get_cached_value(k):
+        """Returns (v, etag) for k, reading through generic_kv_cache.
+
+        Raises GenericKV.DoesNotExist if there's no such key.
+        """
+        cached = generic_kv_cache.get(k)
+        if cached is not None:
+            return cached
+        return generic_kv_cache.put(k, GenericKV.get(k).v)
+
+    @staticmethod
+    def get_cached_values(ks):
+        """Returns {k: (v, etag)} for those of ks that exist.
+
+        Keys that aren't cached are read with BatchGetItem; pynamodb splits
+        them into pages of 100 and retries unprocessed keys.
+        """
+        values = {}
+        to_get = set()
+        for k in ks:
+            cached = generic_kv_cache.get(k)
+            if cached is None:
+                to_get.add(k)
+            else:
+                values[k] = cached
+        for generic_kv in GenericKV.batch_get(to_get):
+            values[generic_kv.k] = generic_kv_cache.put(generic_kv.k, generic_kv.v)
+        return values
+
+    @staticmethod
+    def put_values(values):
+        """Sets each k in values to values[k], with BatchWriteItem.
+
+        BatchWriteItem can only put whole items, so we read the keys that
+        already exist first (in one batch too) to keep their created_at.
+        pynamodb writes in chunks of 25 and retries unprocessed items,
+        raising PutError if some still don't go through.
+        """
+        existing = {
+            generic_kv.k: generic_kv
+            for generic_kv in GenericKV.batch_get(
+                values.keys(), attributes_to_get=["k", "created_at"]
+            )
+        }
+        try:
+            with GenericKV.batch_write() as batch:
+                for k, v in values.items():
+                    generic_kv = existing.get(k)
+                    if generic_kv is None:
+                        generic_kv = GenericKV(k)
+                        generic_kv.set_created_at()
+                    generic_kv.v = v
+                    generic_kv.set_updated_at()
+                    batch.save(generic_kv)
+        except Exception:
+            for k in values:
+                generic_kv_cache.invalidate(k)
+            raise
+        for k, v in values.items():
+            generic_kv_cache.put(k, v)
+
     @staticmethod
     def put_value(k, v):
-        generic_kv = GenericKV.get_or_create(k)
-        generic_kv.v = v
-        generic_kv.set_updated_at()
-        return generic_kv.save()
+        """Sets k to v with a single UpdateItem; see models/upsert.py."""
+        if not k:
+            raise ValueError("No key specified.")
+        try:
+            generic_kv = upsert(GenericKV, k, v=v)
+        except Exception:
+            # We don't know whether the write made it.
+            generic_kv_cache.invalidate(k)
+            raise
+        generic_kv_cache.put(k, v)
+        return generic_kv
 
     def set_created_at(self):
         self.created_at = datetime.datetime.utcnow()
@@ -0,0 +1,47 @@
+import datetime
+
+from pynamodb.attributes import (
+    BooleanAttribute,
+    TTLAttribute,
+    UnicodeAttribute,
+    UTCDateTimeAttribute,
+)
+from pynamodb.models import Model
+
+
+class MobileCommonsProfileCache(Model):
+    """Whether a phone number has a Mobile Commons profile, as of checked_at.
+
+    Backs common.profile_exists_cache; see there for how it's used.
+    """
+
+    class Meta:
+        table_name = "MobileCommonsProfileCache"
+
+    phone_number = UnicodeAttribute(hash_key=True)
+    has_profile = BooleanAttribute()
+    checked_at = UTCDateTimeAttribute()
+    # DynamoDB deletes expired items on its own, but only eventually, so
+    # readers must still check expires_at themselves.
+    expires_at = TTLAttribute()
+
+    @staticmethod
+    def setup():
+        if not MobileCommonsProfileCache.exists():
+            # DynamoDB Local doesn't always support enabling TTL.
+            MobileCommonsProfileCache.create_table(
+                read_capacity_units=1,
+                write_capacity_units=1,
+                wait=True,
+                ignore_update_ttl_errors=True,
+            )
+
+    @staticmethod
+    def put_entry(phone_number, has_profile, ttl_seconds):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        MobileCommonsProfileCache(
+            phone_number,
+            has_profile=has_profile,
+            checked_at=now,
+            expires_at=now + datetime.timedelta(seconds=ttl_seconds),
+        ).save()
@@ -4,5 +4,14 @@ from models.chat_profile import ChatProfile
 from models.chat_referral import ChatReferral
 from models.donor import Donor
 from models.generic_kv import GenericKV
+from models.mobile_commons_profile_cache import MobileCommonsProfileCache
 
-MODELS = [CaucusAppCaptain, CaucusAppEvent, ChatProfile, ChatReferral, Donor, GenericKV]
+MODELS = [
+    CaucusAppCaptain,
+    CaucusAppEvent,
+    ChatProfile,
+    ChatReferral,
+    Donor,
+    GenericKV,
+    MobileCommonsProfileCache,
+]
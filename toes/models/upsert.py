@@ -0,0 +1,32 @@
+# Writes to a model without reading the item first.
+#
+# The get_or_create-then-save() pattern costs a (usually strongly
+# consistent) GetItem plus a PutItem of the whole item. When we already
+# know which attributes to set, a single UpdateItem does the same job:
+# it creates the item if need be, only sends the attributes that change,
+# and keeps an existing created_at via if_not_exists.
+
+import datetime
+
+
+def upsert(model, hash_key, range_key=None, **values):
+    """Sets values on the item with the given key, creating it if need be.
+
+    Values of None remove the attribute. updated_at (if model has one) is
+    set to now, and created_at is set to now only if the item is new.
+    Returns the item as it is after the update.
+    """
+    now = datetime.datetime.utcnow()
+    attributes = model.get_attributes()
+    actions = []
+    for name, value in values.items():
+        attribute = getattr(model, name)
+        actions.append(attribute.remove() if value is None else attribute.set(value))
+    if "updated_at" in attributes and "updated_at" not in values:
+        actions.append(model.updated_at.set(now))
+    if "created_at" in attributes:
+        actions.append(model.created_at.set(model.created_at | now))
+
+    item = model(hash_key, range_key) if range_key is not None else model(hash_key)
+    item.update(actions=actions)
+    return item
@@ -0,0 +1,58 @@
+from unittest import mock
+
+import freezegun
+
+from common.settings import settings
+from models.chat_profile import ChatProfile
+from models.donor import Donor
+from models.generic_kv import GenericKV
+
+Donor.Meta.table_name = settings.donors_table_name
+
+
+def test_put_value_does_not_read():
+    with mock.patch.object(GenericKV, "get") as get:
+        with freezegun.freeze_time("2019-06-07T20:00:00Z"):
+            GenericKV.put_value("test key", "test value")
+        with freezegun.freeze_time("2019-06-08T20:00:00Z"):
+            GenericKV.put_value("test key", "new value")
+    assert not get.called
+
+    generic_kv = GenericKV.get("test key")
+    assert generic_kv.v == "new value"
+    assert generic_kv.created_at.isoformat() == "2019-06-07T20:00:00+00:00"
+    assert generic_kv.updated_at.isoformat() == "2019-06-08T20:00:00+00:00"
+
+
+def test_upsert_profile():
+    profile = ChatProfile.get_or_create_profile("5105016227")
+    profile.first_name = "Jason"
+    profile.last_name = "Katz-Brown"
+    profile.set_updated_at()
+    profile.save()
+
+    profile = ChatProfile.upsert_profile(
+        "(510) 501-6227", last_state="state_initial", last_name=None
+    )
+    assert profile.first_name == "Jason"
+    assert profile.last_name is None
+    assert profile.last_state == "state_initial"
+
+    saved = ChatProfile.get("15105016227")
+    assert saved.first_name == "Jason"
+    assert saved.last_name is None
+    assert saved.last_state == "state_initial"
+    assert saved.created_at == profile.created_at
+
+
+def test_upsert_donor():
+    with freezegun.freeze_time("2019-06-07T20:00:00Z"):
+        Donor.upsert_donor("donor@example.com", first_name="Mary")
+    with freezegun.freeze_time("2019-06-08T20:00:00Z"):
+        Donor.upsert_donor("donor@example.com", city="Richmond")
+
+    donor = Donor.get("donor@example.com")
+    assert donor.first_name == "Mary"
+    assert donor.city == "Richmond"
+    assert donor.created_at.isoformat() == "2019-06-07T20:00:00+00:00"
+    assert donor.updated_at.isoformat() == "2019-06-08T20:00:00+00:00"
@@ -0,0 +1,67 @@
+import os
+import subprocess
+import sys
+
+# Modules that are slow to import and that only some blueprints need. None
+# of them should be imported just to start the app; see
+# common/lazy_blueprints.py.
+HEAVY_MODULES = [
+    "boto3",
+    "botocore",
+    "pynamodb",
+    "nameparser",
+    "phonenumbers",
+    "dateutil",
+    "pytz",
+    "bsdapi",
+    "zappa",
+    "requests",
+]
+
+
+def _import_times(code):
+    """Runs code with -X importtime; returns {module: cumulative us}."""
+    toes_dir = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=toes_dir,
+        env={
+            **os.environ,
+            "PYTHONPATH": os.pathsep.join([toes_dir, os.environ.get("PYTHONPATH", "")]),
+        },
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+
+    import_times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.split("|")
+        import_times[module.strip()] = int(cumulative)
+    return import_times
+
+
+def _heavy_imports(import_times):
+    heavy = {
+        module: us
+        for module, us in import_times.items()
+        if module.split(".")[0] in HEAVY_MODULES
+    }
+    slowest = sorted(import_times.items(), key=lambda item: -item[1])[:15]
+    return heavy, "\n".join(f"{us:>10}us  {module}" for module, us in slowest)
+
+
+def test_import_toes_app_is_light():
+    heavy, slowest = _heavy_imports(_import_times("import toes_app"))
+    assert not heavy, f"Importing toes_app imported {sorted(heavy)}:\n{slowest}"
+
+
+def test_index_request_is_light():
+    code = (
+        "from toes_app import app\n"
+        "assert app.test_client().get('/').status_code == 200\n"
+    )
+    heavy, slowest = _heavy_imports(_import_times(code))
+    assert not heavy, f"GET / imported {sorted(heavy)}:\n{slowest}"
@@ -1,25 +1,22 @@
-from flask import Flask, jsonify, request
+from flask import Flask
 from flask_cors import CORS
-from werkzeug.exceptions import HTTPException
-
-from actblue.actblue import mod as actblue_module
-from bling.api import mod as bling_module
-from caucus_app.api import mod as caucus_module
-from contentful_webhook.api import mod as contentful_module
-from donors.donors import mod as donors_module
-from generic_kv.generic_kv import mod as generic_kv_module
-from help_scout_contact_us.api import mod as help_scout_contact_us
-from mdata.mdata import mod as mdata_module
-from mobilize_america.mobilize_america import mod as mobilize_america_module
-from mobilizeio.webhook_handler import mod as mobilizeio_module
+
+from common.lazy_blueprints import LazyBlueprints
+
+# Blueprint name -> (URL prefix, "module:attribute"). Each blueprint is
+# only imported when the first request for it comes in; see
+# common/lazy_blueprints.py.
+BLUEPRINTS = {
+    "actblue": ("/actblue", "actblue.actblue:mod"),
+    "generic_kv": ("/generic_kv", "generic_kv.generic_kv:mod"),
+    "mdata": ("/mdata", "mdata.mdata:mod"),
+    "mobilize_america": ("/mobilize_america", "mobilize_america.mobilize_america:mod"),
+    "donors": ("/donors", "donors.donors:mod"),
+}
 
 app = Flask(__name__)
 CORS(app)
-app.register_blueprint(actblue_module, url_prefix="/actblue")
-app.register_blueprint(generic_kv_module, url_prefix="/generic_kv")
-app.register_blueprint(mdata_module, url_prefix="/mdata")
-app.register_blueprint(mobilize_america_module, url_prefix="/mobilize_america")
-app.register_blueprint(donors_module, url_prefix="/donors")
+lazy_blueprints = LazyBlueprints(app, BLUEPRINTS)
 
 
 @app.route("/")